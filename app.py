@@ -1,233 +1,202 @@
-from flask import Flask, redirect, request, session, url_for, render_template_string
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from spotipy.cache_handler import MemoryCacheHandler
+from flask import Flask, Response, jsonify, redirect, request, session, stream_with_context, stream_template, url_for, render_template
+from markupsafe import Markup
 import secrets
 import os
 from dotenv import load_dotenv
-import random
-import re
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import LabelEncoder
-from sklearn.neural_network import MLPClassifier
-from collections import Counter
-
-# Cargar variables de entorno
+import itertools
+import json
+import time
+
+# Cargar variables de entorno (antes de importar los módulos que leen su configuración de ellas)
 load_dotenv()
 
+import cliente_spotify
+from corpus import DATA_PATH, checksum_datos
+from texto import limpiar_tweet
+from inferencia import MOTOR_PATH, MotorInferencia
+from playlist import construir_pool_canciones, escribir_playlist, recomendaciones
+from seleccion import PoolCandidatos
+from cache import catalogo, predicciones, usuarios
+import respuestas
+import tokens
+import sesiones
+import trabajos
+import metricas
+from metricas import etapa
+from planificador import FONDO, planificador, prioridad
+import retroalimentacion
+
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(16))
 
+# La cookie solo lleva un identificador; token_info se guarda en el servidor (compartido entre workers)
+sesiones.init_app(app)
+
+# Latencia por ruta y /metrics (antes que respuestas para que la medida incluya la compresión)
+metricas.init_app(app)
+
+@metricas.registro.registrar_colector
+def _metricas_contadores():
+    # Contadores que ya llevan las cachés y el gestor de tokens: se leen solo al exponer /metrics
+    caches = {'catalogo': catalogo, 'predicciones': predicciones}
+    return [
+        ('cache_hits_total', 'counter', 'Aciertos de caché.',
+         [({'cache': nombre}, c.aciertos) for nombre, c in caches.items()]),
+        ('cache_misses_total', 'counter', 'Fallos de caché.',
+         [({'cache': nombre}, c.fallos) for nombre, c in caches.items()]),
+        ('token_refreshes_total', 'counter', 'Tokens de acceso renovados.', [({}, tokens.gestor.renovaciones)]),
+        ('token_refresh_failures_total', 'counter', 'Renovaciones de token fallidas.', [({}, tokens.gestor.fallos)]),
+        ('spotify_scheduler_queue_depth', 'gauge', 'Llamadas a Spotify esperando turno en el planificador.',
+         [({'priority': nombre}, n) for nombre, n in planificador.estadisticas().items()]),
+    ]
+
+# Hoja de estilos con huella, ETag/304 y compresión; plantillas precompiladas
+respuestas.init_app(app)
+
 # Configuración para producción
-CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
-CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET') 
-REDIRECT_URI = os.getenv('REDIRECT_URI')
-SCOPE = 'user-top-read playlist-modify-public'
+CLIENT_ID = cliente_spotify.CLIENT_ID
+CLIENT_SECRET = cliente_spotify.CLIENT_SECRET
+REDIRECT_URI = cliente_spotify.REDIRECT_URI
+SCOPE = cliente_spotify.SCOPE
 
 # Verificar que las credenciales estén configuradas
 if not all([CLIENT_ID, CLIENT_SECRET, REDIRECT_URI]):
     raise ValueError("Faltan las credenciales de Spotify. Configura las variables de entorno.")
 
 def get_spotify_oauth():
-    # Crear un cache único por usuario usando MemoryCacheHandler
-    cache_handler = MemoryCacheHandler()
-    return SpotifyOAuth(
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET,
-        redirect_uri=REDIRECT_URI,
-        scope=SCOPE,
-        cache_handler=cache_handler,
-        show_dialog=True  # Forzar que siempre muestre el diálogo de login
-    )
+    # Un único gestor OAuth por proceso, que no guarda tokens de ningún usuario
+    return cliente_spotify.oauth()
 
 def get_token():
     token_info = session.get('token_info', None)
     if not token_info:
         return None
     
-    sp_oauth = get_spotify_oauth()
-    
-    # Verificar si el token necesita renovación
-    if sp_oauth.is_token_expired(token_info):
-        token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])
-        session['token_info'] = token_info
+    # Renovación única por usuario y anticipada (en segundo plano) antes de que caduque
+    vigente = tokens.gestor.vigente(token_info)
+    if vigente is not token_info:
+        session['token_info'] = vigente
     
-    return token_info
-
-# --- Plantillas HTML y CSS ---
-
-def get_base_css():
-    """Devuelve el CSS base para todas las páginas para un diseño consistente."""
-    return '''
-        <style>
-            body { 
-                font-family: 'Segoe UI', 'Helvetica Neue', Arial, sans-serif; 
-                background-color: #121212;
-                color: #FFFFFF;
-                margin: 0;
-                padding: 20px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                min-height: calc(100vh - 40px);
-            }
-            .container {
-                max-width: 800px;
-                width: 100%;
-                margin: 20px auto;
-                background-color: #181818;
-                padding: 30px 40px;
-                border-radius: 10px;
-                box-shadow: 0 4px_20px rgba(0,0,0,0.2);
-                text-align: center;
-            }
-            h1 {
-                color: #1DB954;
-                font-size: 2.2em;
-                margin-bottom: 10px;
-                font-weight: 700;
-            }
-            h2 {
-                color: #FFFFFF;
-                margin-bottom: 20px;
-                font-weight: 600;
-            }
-            p {
-                font-size: 1.1em;
-                line-height: 1.6;
-                color: #B3B3B3;
-            }
-            .button {
-                background-color: #1DB954;
-                color: #FFFFFF;
-                padding: 15px 35px;
-                border: none;
-                border-radius: 50px;
-                font-size: 16px;
-                font-weight: bold;
-                cursor: pointer;
-                text-decoration: none;
-                display: inline-block;
-                margin: 10px 5px;
-                transition: background-color 0.3s ease, transform 0.2s ease;
-            }
-            .button:hover { 
-                background-color: #1ed760; 
-                transform: scale(1.05);
-            }
-            .button.logout { 
-                background-color: #535353; 
-            }
-            .button.logout:hover { 
-                background-color: #737373; 
-            }
-            a {
-                color: #1DB954;
-                text-decoration: none;
-            }
-            a:hover {
-                text-decoration: underline;
-            }
-            .list-item {
-                background-color: #282828;
-                margin: 15px 0;
-                padding: 15px 20px;
-                border-radius: 8px;
-                display: flex;
-                align-items: center;
-                text-align: left;
-                transition: background-color 0.3s ease;
-            }
-            .list-item:hover {
-                background-color: #383838;
-            }
-            .list-item .rank {
-                font-size: 20px;
-                font-weight: bold;
-                margin-right: 20px;
-                color: #B3B3B3;
-                min-width: 30px;
-            }
-            .list-item .info h3 {
-                margin: 0 0 5px 0;
-                color: #FFFFFF;
-                font-size: 1.1em;
-            }
-            .list-item .info p {
-                margin: 0;
-                color: #B3B3B3;
-                font-size: 0.9em;
-            }
-            .user-header {
-                text-align: center;
-                margin-bottom: 30px;
-                background: #282828;
-                padding: 20px;
-                border-radius: 10px;
-            }
-            .form-container {
-                margin-top: 20px;
-            }
-            .form-container label {
-                font-size: 1.1em;
-                margin-bottom: 15px;
-                display: block;
-            }
-            .form-container select {
-                background-color: #282828;
-                color: white;
-                padding: 12px 20px;
-                border-radius: 5px;
-                border: 1px solid #535353;
-                font-size: 1em;
-                margin: 10px;
-            }
-            .footer-nav {
-                text-align: center; 
-                margin-top: 30px;
-            }
-            @media (max-width: 768px) {
-                body {
-                    align-items: flex-start;
-                }
-                .container {
-                    padding: 20px;
-                    margin-top: 20px;
-                }
-                h1 {
-                    font-size: 1.8em;
-                }
-            }
-        </style>
-    '''
+    return vigente
+
+def token_de_sesion(sid):
+    """
+    token_info vigente de la sesión `sid`, leído del almacén de sesiones. Lo
+    usan los trabajos en segundo plano, que no tienen petición ni guardan el token.
+    """
+    token_info = (app.session_interface.leer(sid) or {}).get('token_info')
+    if not token_info:
+        raise RuntimeError("La sesión ha caducado. Vuelve a iniciar sesión y crea la playlist de nuevo.")
+    return tokens.gestor.vigente(token_info)
+
+# --- Caché por usuario ---
+
+# Los datos principales se piden una vez con el máximo de Spotify y cada página recorta lo que necesita
+TOP_ITEMS_LIMIT = 50
+
+def id_sesion_cache():
+    """Identificador opaco de la sesión con el que se guardan sus datos en la caché por usuario."""
+    if 'cache_id' not in session:
+        session['cache_id'] = secrets.token_hex(16)
+    return session['cache_id']
+
+def perfil_usuario(sp, id_sesion=None):
+    """Perfil del usuario (current_user), cacheado por sesión."""
+    return usuarios.obtener(id_sesion or id_sesion_cache(), 'perfil', sp.current_user)
+
+def cargador_top_usuario(sp, id_sesion=None):
+    """
+    Devuelve `cargar_top(tipo, limite)` para las canciones ('tracks') o artistas
+    ('artists') principales del usuario a corto plazo, cacheados por sesión.
+    Se puede llamar desde otros hilos: la clave de sesión se resuelve aquí (o se
+    pasa `id_sesion` cuando no hay petición, como en los trabajos en segundo plano).
+    """
+    id_sesion = id_sesion or id_sesion_cache()
+
+    def cargar_top(tipo, limite):
+        resultados = usuarios.obtener(
+            id_sesion, f'top_{tipo}',
+            lambda: getattr(sp, f'current_user_top_{tipo}')(limit=TOP_ITEMS_LIMIT, time_range='short_term'))
+        return {**resultados, 'items': resultados['items'][:limite]}
+    return cargar_top
+
+# Periodos de Spotify para los datos principales: (enlace, descripción en la página)
+PERIODOS_TOP = {
+    'short_term': ("4 semanas", "las últimas 4 semanas"),
+    'medium_term': ("6 meses", "los últimos 6 meses"),
+    'long_term': ("Siempre", "todo tu historial"),
+}
+# Máximo de artistas o canciones que muestran /top-artists y /top-tracks
+TOP_VIEW_MAX_ITEMS = int(os.getenv('TOP_VIEW_MAX_ITEMS', '300'))
+
+def paginas_top(sp, tipo, periodo, maximo, id_sesion=None):
+    """
+    Genera (posición, items) con las páginas de TOP_ITEMS_LIMIT canciones o
+    artistas principales del periodo, hasta `maximo`. Cada página se pide a
+    Spotify (o a la caché de la sesión) solo cuando se consume y se sigue
+    mientras la respuesta tenga 'next'.
+    """
+    id_sesion = id_sesion or id_sesion_cache()
+    posicion = 0
+    while posicion < maximo:
+        # La primera página a corto plazo es la misma que usa cargador_top_usuario
+        recurso = f'top_{tipo}' if (periodo, posicion) == ('short_term', 0) else f'top_{tipo}|{periodo}|{posicion}'
+        pagina = usuarios.obtener(
+            id_sesion, recurso,
+            lambda: getattr(sp, f'current_user_top_{tipo}')(limit=TOP_ITEMS_LIMIT, offset=posicion, time_range=periodo))
+        items = [item for item in pagina['items'] if item][:maximo - posicion]
+        if items:
+            yield posicion, items
+        if not pagina.get('next') or len(pagina['items']) < TOP_ITEMS_LIMIT:
+            return
+        posicion += TOP_ITEMS_LIMIT
+
+def _resto_paginas(paginas):
+    # Con la respuesta ya empezada no se puede mostrar una página de error: la lista se corta ahí
+    try:
+        yield from paginas
+    except Exception as e:
+        print(f"No se pudieron obtener más elementos principales: {e}")
+
+def pagina_top_en_streaming(sp, tipo, plantilla, plantilla_filas, user_info):
+    """
+    Respuesta que envía la cabecera de la página y la primera página de
+    elementos en cuanto llegan, y cada página siguiente según la devuelve
+    Spotify. Las filas de cada página se renderizan de una vez con la
+    plantilla precompilada `plantilla_filas`.
+    """
+    periodo = request.args.get('periodo', 'short_term')
+    if periodo not in PERIODOS_TOP:
+        periodo = 'short_term'
+    maximo = min(max(request.args.get('cuantos', TOP_VIEW_MAX_ITEMS, type=int), 1), TOP_VIEW_MAX_ITEMS)
+    paginas = paginas_top(sp, tipo, periodo, maximo)
+    # La primera se pide ya: si Spotify falla se muestra el error en lugar de una lista vacía
+    primera = next(paginas, None)
+    filas = app.jinja_env.get_template(plantilla_filas)
+
+    def renderizar_filas(inicio, items):
+        return Markup(filas.render(inicio=inicio, items=items))
+
+    return stream_template(plantilla, user_info=user_info, periodo=periodo, periodos=PERIODOS_TOP,
+                           paginas=itertools.chain([primera] if primera else [], _resto_paginas(paginas)),
+                           filas=renderizar_filas)
+
+def cerrar_sesion():
+    """Invalida la caché del usuario y limpia la sesión."""
+    usuarios.invalidar(session.get('cache_id'))
+    session.clear()
+
+# --- Páginas (plantillas en templates/, estilos en static/estilos.css) ---
 
 @app.route('/')
 def index():
-    return f'''
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <title>Emo2Music - Analiza tu Música</title>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        {get_base_css()}
-    </head>
-    <body>
-        <div class="container">
-            <h1>Emo2Music</h1>
-            <p>Conecta tu cuenta de Spotify para descubrir tus artistas y canciones más escuchadas, y crea playlists basadas en tu estado de ánimo.</p>
-            <a class="button" href="/login">Iniciar Sesión con Spotify</a>
-        </div>
-    </body>
-    </html>
-    '''
+    return render_template('index.html')
 
 @app.route('/login')
 def login():
     try:
         # Limpiar cualquier sesión anterior
-        session.clear()
+        cerrar_sesion()
         
         sp_oauth = get_spotify_oauth()
         auth_url = sp_oauth.get_authorize_url()
@@ -241,36 +210,19 @@ def login():
 def callback():
     try:
         sp_oauth = get_spotify_oauth()
-        session.clear()  # Limpiar sesión anterior
+        cerrar_sesion()  # Limpiar sesión anterior
         
         code = request.args.get('code')
         error = request.args.get('error')
         
         if error:
             if error == 'access_denied':
-                return f'''
-                <!DOCTYPE html>
-                <html lang="es">
-                <head>
-                    <title>Acceso Denegado</title>
-                    <meta charset="UTF-8">
-                    {get_base_css()}
-                </head>
-                <body>
-                    <div class="container">
-                        <h1>Acceso Denegado</h1>
-                        <p><strong>La aplicación está en modo de desarrollo.</strong></p>
-                        <p>Para utilizarla, el propietario de la aplicación debe añadir tu cuenta de Spotify a la lista de usuarios autorizados.</p>
-                        <a class="button" href="/">Volver al Inicio</a>
-                    </div>
-                </body>
-                </html>
-                '''
+                return render_template('acceso_denegado.html')
         
         if not code:
             return "Error: No se recibió código de autorización"
             
-        token_info = sp_oauth.get_access_token(code)
+        token_info = sp_oauth.get_access_token(code, check_cache=False)
         if not token_info:
             return "Error: No se pudo obtener el token de acceso"
             
@@ -282,24 +234,7 @@ def callback():
     except Exception as e:
         error_msg = str(e)
         if "invalid_client" in error_msg.lower() or "unauthorized" in error_msg.lower():
-            return f'''
-            <!DOCTYPE html>
-            <html lang="es">
-            <head>
-                <title>Usuario No Autorizado</title>
-                <meta charset="UTF-8">
-                {get_base_css()}
-            </head>
-            <body>
-                <div class="container">
-                    <h1>Aplicación en Modo Desarrollo</h1>
-                    <p>Esta aplicación de Spotify se encuentra actualmente en modo de desarrollo y solo los usuarios autorizados pueden acceder.</p>
-                    <p>Si deseas probar la aplicación, por favor, contacta al desarrollador.</p>
-                    <a class="button" href="/">Volver al Inicio</a>
-                </div>
-            </body>
-            </html>
-            '''
+            return render_template('no_autorizado.html')
         return f"Error en callback: {str(e)}"
 
 @app.route('/dashboard')
@@ -309,67 +244,22 @@ def dashboard():
         if not token_info:
             return redirect(url_for('login'))
         
-        sp = spotipy.Spotify(auth=token_info['access_token'])
-        user_info = sp.current_user()
+        sp = cliente_spotify.cliente(token_info)
+        user_info = perfil_usuario(sp)
         
         # Debug: Mostrar qué usuario está logueado
         print(f"Usuario logueado: {user_info['display_name']} (ID: {user_info['id']})")
         
-        html = f'''
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <title>Panel de Control - {user_info['display_name']}</title>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            {get_base_css()}
-        </head>
-        <body>
-            <div class="container">
-                <div class="user-header">
-                    <h2>Bienvenido, {user_info['display_name']}</h2>
-                    <p><strong>ID de Usuario:</strong> {user_info['id']} | <strong>Seguidores:</strong> {user_info['followers']['total']}</p>
-                </div>
-                
-                <h1>Panel de Control</h1>
-                <p>Selecciona una opción para explorar tu música.</p>
-                
-                <a class="button" href="/top-artists">Artistas Principales</a>
-                <a class="button" href="/top-tracks">Canciones Principales</a>
-                <a class="button" href="/crear-playlist">Crear Playlist por Ánimo</a>
-                <br>
-                <a class="button logout" href="/logout">Cerrar Sesión</a>
-            </div>
-        </body>
-        </html>
-        '''
-        return html
+        return render_template('dashboard.html', user_info=user_info)
         
     except Exception as e:
-        session.clear()  # Limpiar sesión en caso de error
+        cerrar_sesion()  # Limpiar sesión en caso de error
         return f"Error: {str(e)} - <a href='/'>Volver al inicio</a>"
 
 @app.route('/logout')
 def logout():
-    session.clear()  # Limpiar toda la sesión
-    return f'''
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <title>Sesión Cerrada</title>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        {get_base_css()}
-    </head>
-    <body>
-        <div class="container">
-            <h1>Sesión Cerrada</h1>
-            <p>Has cerrado sesión de tu cuenta de Spotify correctamente.</p>
-            <a class="button" href="/">Volver a la página de inicio</a>
-        </div>
-    </body>
-    </html>
-    '''
+    cerrar_sesion()  # Limpiar toda la sesión y su caché
+    return render_template('logout.html')
 
 @app.route('/top-artists')
 def get_top_artists():
@@ -378,58 +268,13 @@ def get_top_artists():
         if not token_info:
             return redirect(url_for('login'))
         
-        sp = spotipy.Spotify(auth=token_info['access_token'])
-        user_info = sp.current_user()
+        sp = cliente_spotify.cliente(token_info)
+        user_info = perfil_usuario(sp)
         
         # Debug: Verificar usuario
         print(f"Obteniendo artistas para: {user_info['display_name']} (ID: {user_info['id']})")
         
-        top_artists = sp.current_user_top_artists(limit=20, time_range='short_term')
-        
-        html = f'''
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <title>Artistas Principales - {user_info['display_name']}</title>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            {get_base_css()}
-        </head>
-        <body>
-            <div class="container">
-                <div class="user-header">
-                    <h2>Artistas Principales de {user_info['display_name']}</h2>
-                    <p>Basado en tu actividad de las últimas 4 semanas.</p>
-                </div>
-        '''
-        
-        if not top_artists['items']:
-            html += "<p>No se encontraron artistas principales. ¡Escucha más música!</p>"
-        else:
-            for i, artist in enumerate(top_artists['items'], 1):
-                genres = ', '.join(artist['genres'][:3]) if artist['genres'] else 'No especificado'
-                html += f'''
-                    <div class="list-item">
-                        <div class="rank">#{i}</div>
-                        <div class="info">
-                            <h3>{artist['name']}</h3>
-                            <p><strong>Géneros:</strong> {genres}</p>
-                            <p><strong>Popularidad:</strong> {artist['popularity']}/100</p>
-                        </div>
-                    </div>
-                '''
-        
-        html += f'''
-                <div class="footer-nav">
-                    <a class="button" href="/dashboard">Panel de Control</a>
-                    <a class="button" href="/top-tracks">Ver Canciones Principales</a>
-                    <a class="button logout" href="/logout">Cerrar Sesión</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-        return html
+        return pagina_top_en_streaming(sp, 'artists', 'top_artists.html', '_filas_artistas.html', user_info)
         
     except Exception as e:
         return f"Error obteniendo artistas: {str(e)} - <a href='/dashboard'>Volver</a>"
@@ -441,166 +286,114 @@ def get_top_tracks():
         if not token_info:
             return redirect(url_for('login'))
         
-        sp = spotipy.Spotify(auth=token_info['access_token'])
-        user_info = sp.current_user()
+        sp = cliente_spotify.cliente(token_info)
+        user_info = perfil_usuario(sp)
         
         # Debug: Verificar usuario
         print(f"Obteniendo tracks para: {user_info['display_name']} (ID: {user_info['id']})")
         
-        top_tracks = sp.current_user_top_tracks(limit=20, time_range='short_term')
-        
-        html = f'''
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <title>Canciones Principales - {user_info['display_name']}</title>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            {get_base_css()}
-        </head>
-        <body>
-            <div class="container">
-                <div class="user-header">
-                    <h2>Canciones Principales de {user_info['display_name']}</h2>
-                    <p>Basado en tu actividad de las últimas 4 semanas.</p>
-                </div>
-        '''
-        
-        if not top_tracks['items']:
-            html += "<p>No se encontraron canciones principales. ¡Escucha más música!</p>"
-        else:
-            for i, track in enumerate(top_tracks['items'], 1):
-                artists = ', '.join([artist['name'] for artist in track['artists']])
-                duration_ms = track['duration_ms']
-                duration_min = duration_ms // 60000
-                duration_sec = (duration_ms % 60000) // 1000
-                
-                html += f'''
-                    <div class="list-item">
-                        <div class="rank">#{i}</div>
-                        <div class="info">
-                            <h3>{track['name']}</h3>
-                            <p><strong>Artista:</strong> {artists}</p>
-                            <p><strong>Álbum:</strong> {track['album']['name']}</p>
-                            <p><strong>Duración:</strong> {duration_min}:{duration_sec:02d} | <strong>Popularidad:</strong> {track['popularity']}/100</p>
-                        </div>
-                    </div>
-                '''
-        
-        html += f'''
-                <div class="footer-nav">
-                    <a class="button" href="/dashboard">Panel de Control</a>
-                    <a class="button" href="/top-artists">Ver Artistas Principales</a>
-                    <a class="button logout" href="/logout">Cerrar Sesión</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-        return html
+        return pagina_top_en_streaming(sp, 'tracks', 'top_tracks.html', '_filas_canciones.html', user_info)
         
     except Exception as e:
         return f"Error obteniendo tracks: {str(e)} - <a href='/dashboard'>Volver</a>"
 
 # --- Funciones del Modelo de Clasificación ---
 
-def limpiar_tweet(texto):
-    """Limpia el texto de entrada para que coincida con el preprocesamiento del modelo."""
-    # Asegurarse de que el input es un string
-    texto = str(texto)
-    # Reemplazar la palabra HASHTAG por el símbolo #, como pediste
-    texto = texto.replace('HASHTAG', '')
-    # Limpieza con expresiones regulares
-    texto = re.sub(r"http\S+|www\.\S+", "", texto)
-    texto = re.sub(r"@\w+", "", texto)
-    texto = re.sub(r"[^\w\sáéíóúüñÁÉÍÓÚÜÑ]", "", texto)
-    texto = re.sub(r"\s+", " ", texto).strip()
-    return texto.lower()
-    
-def top_words_by_label(df, label_col, text_col, top_n):
-    vocab = set()
-    for label in df[label_col].unique():
-        textos = df[df[label_col] == label][text_col]
-        palabras = ' '.join(textos).split()
-        top = [w for w, _ in Counter(palabras).most_common(top_n)]
-        vocab.update(top)
-    return list(vocab)
-
-def train_sentiment_model():
+motor = None
+# Versión (mtime) del motor en uso y cada cuánto (segundos) se mira si otro proceso lo ha reescrito
+_version_bundle = None
+_proxima_revision_bundle = 0.0
+# Versión del bundle que no se pudo cargar: no se reintenta hasta que vuelva a cambiar
+_version_fallida = None
+# Solo para desarrollo: entrenar al arrancar si no hay bundle (en producción se construye al compilar)
+MODEL_TRAIN_ON_START = os.getenv('MODEL_TRAIN_ON_START', '0') == '1'
+MODEL_RELOAD_INTERVAL = float(os.getenv('MODEL_RELOAD_INTERVAL', '10'))
+
+def _mtime_bundle():
+    try:
+        return os.stat(MOTOR_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def cargar_modelo(modelos=None):
     """
-    Carga los datos, los preprocesa y entrena el modelo de clasificación de sentimientos.
+    Pone en uso el modelo, por defecto el motor exportado junto al bundle (o
+    uno construido a partir de `modelos`, una tupla (vectorizer, mlp,
+    label_encoder)), y descarta las predicciones cacheadas con el anterior.
     """
-    spanish_stopwords={'estáis', 'tuviese', 'ante', 'estada', 'estuvimos', 'esta', 'hubiera', 'tendrán', 'sintiendo', 'hayamos', 'su', 'con', 'estuviera', 'hubieron', 'hubieses', 'de', 'tengo', 'tenemos', 'mi', 'hubieran', 'desde', 'sentidos', 'habrán', 'hayas', 'estamos', 'estábamos', 'fuera', 'tengan', 'seréis', 'serán', 'estés', 'esté', 'me', 'otros', 'hasta', 'tuve', 'mías', 'vuestro', 'habríais', 'vuestras', 'habría', 'tened', 'un', 'fueses', 'esas', 'vuestra', 'lo', 'yo', 'o', 'nos', 'habréis', 'te', 'que', 'suyas', 'le', 'éramos', 'estaremos', 'tengáis', 'hubiesen', 'sentidas', 'serías', 'suya', 'nuestra', 'hubiste', 'soy', 'mío', 'sois', 'sin', 'ese', 'habrá', 'nuestras', 'más', 'fuese', 'estuvierais', 'tuvieses', 'habido', 'tuya', 'estuviste', 'han', 'habíamos', 'estarías', 'nada', 'tuviesen', 'estéis', 'tengamos', 'seríais', 'eres', 'he', 'pero', 'tenían', 'estemos', 'sea', 'por', 'hubiésemos', 'tuyas', 'estaría', 'habidos', 'fueseis', 'os', 'tuvieseis', 'eso', 'hubiese', 'fueron', 'porque', 'algunos', 'sentida', 'habiendo', 'tuvieran', 'eras', 'otro', 'habías', 'tenido', 'hemos', 'ellas', 'estuvieron', 'estaríamos', 'tú', 'donde', 'nosotros', 'habíais', 'durante', 'tus', 'tenidas', 'tendría', 'vuestros', 'tenéis', 'siente', 'unos', 'mis', 'entre', 'habéis', 'estuviéramos', 'y', 'son', 'eran', 'poco', 'fuisteis', 'estando', 'tuvo', 'tuvisteis', 'hubimos', 'teniendo', 'estuviésemos', 'estás', 'les', 'hayan', 'era', 'tenía', 'estarían', 'había', 'tuvieron', 'los', 'ya', 'hubo', 'míos', 'estoy', 'cuando', 'habrías', 'vosotras', 'seamos', 'tendríais', 'haya', 'habrían', 'sean', 'hayáis', 'estadas', 'ella', 'vosotros', 'este', 'algo', 'tienen', 'algunas', 'se', 'erais', 'tuvimos', 'quien', 'esa', 'tengas', 'sus', 'has', 'no', 'habidas', 'estaríais', 'estaban', 'antes', 'tenga', 'otra', 'estados', 'fuiste', 'tuvierais', 'para', 'fuesen', 'tendrías', 'sería', 'también', 'tanto', 'estuvieseis', 'estuvieras', 'tendrá', 'estuvieses', 'nosotras', 'tuvieras', 'suyos', 'teníais', 'será', 'hubieras', 'tuviésemos', 'tuyo', 'ti', 'mucho', 'estado', 'todo', 'fueran', 'habremos', 'habré', 'estuviese', 'hubisteis', 'fuimos', 'muchos', 'estaba', 'esto', 'a', 'estar', 'fuéramos', 'sobre', 'estaré', 'estad', 'estará', 'estabas', 'muy', 'teníamos', 'mí', 'hay', 'esos', 'somos', 'nuestros', 'tendríamos', 'él', 'están', 'estabais', 'fui', 'seáis', 'tenida', 'habrás', 'cual', 'fuerais', 'tuviera', 'estuvieran', 'uno', 'contra', 'habían', 'ellos', 'una', 'ha', 'ni', 'seré', 'tuyos', 'hubieseis', 'hubiéramos', 'seremos', 'tenidos', 'está', 'en', 'tendréis', 'e', 'estén', 'serían', 'estuvo', 'tuviéramos', 'hube', 'serás', 'las', 'estarán', 'del', 'sentid', 'suyo', 'mía', 'estos', 'estuviesen', 'tiene', 'fuésemos', 'la', 'fueras', 'tu', 'sí', 'al', 'quienes', 'tienes', 'tenías', 'sentido', 'todos', 'tuviste', 'como', 'seríamos', 'estas', 'es', 'habida', 'fue', 'tendremos', 'habríamos', 'nuestro', 'estaréis', 'otras', 'tendrían', 'tendré', 'qué', 'estuve', 'estarás', 'el', 'estuvisteis', 'hubierais', 'tendrás', 'seas'}
-
-    # Construir la ruta al archivo de datos
-    data_path = os.path.join(os.path.dirname(__file__), 'train.tsv')
-    if not os.path.exists(data_path):
-        print(f"ADVERTENCIA: El archivo de datos '{data_path}' no se encontró.")
-        return None, None, None
-
-    print("Entrenando el modelo de clasificación de sentimientos...")
-    # Cargar datos
-    df = pd.read_csv(data_path, sep='\t')
-    df.columns = [col.strip() for col in df.columns]
-    df = df[df['label'].isin(['joy ', 'sadness ', 'anger '])].copy()
-    # Indizea berrabiarazi
-    df.reset_index(drop=True, inplace=True)
-    # 'id' zutabea kendu
-    df = df.drop(columns=['id'])
-    # Limpieza y preprocesamiento
-    df['tweet'] = df['tweet'].apply(limpiar_tweet)
-    
-
-    # Codificar etiquetas y vectorizar texto
-    label_encoder = LabelEncoder()
-    y = label_encoder.fit_transform(df['label'])
+    global motor, _version_bundle
+    inicio = time.perf_counter()
+    if modelos:
+        nuevo_motor = MotorInferencia.desde_sklearn(*modelos) if modelos[1] is not None else None
+        version = None
+    else:
+        version = _mtime_bundle()
+        nuevo_motor = MotorInferencia.cargar(MOTOR_PATH, checksum_datos(DATA_PATH))
+        if nuevo_motor is None:
+            # Solo sin motor al día se importa scikit-learn, para exportarlo desde el bundle
+            from modelo import cargar_o_entrenar_motor
+            nuevo_motor = cargar_o_entrenar_motor(entrenar=MODEL_TRAIN_ON_START)
+            if nuevo_motor is None:
+                # Fallar al arrancar en lugar de entrenar dentro del maestro de gunicorn
+                raise RuntimeError("No hay un bundle del modelo al día. Ejecuta 'python modelo.py construir' "
+                                   "antes de arrancar (o MODEL_TRAIN_ON_START=1 para entrenar al arrancar).")
+            version = _mtime_bundle()
+    motor = nuevo_motor
+    _version_bundle = version
+    predicciones.invalidar()
+    metricas.MODELO_CARGA.fijar(time.perf_counter() - inicio)
+
+# Cargar el bundle del modelo al iniciar la app
+cargar_modelo()
+
+@app.before_request
+def arrancar_trabajos():
+    # Con gunicorn ya los arranca post_worker_init; esto cubre el servidor de desarrollo
+    trabajos.cola.arrancar()
+
+@app.before_request
+def recargar_modelo_si_cambia():
+    # Las actualizaciones con correcciones reescriben el bundle: cada worker lo recarga en la siguiente petición
+    global _proxima_revision_bundle, _version_fallida
+    ahora = time.monotonic()
+    if ahora < _proxima_revision_bundle or _version_bundle is None:
+        return
+    _proxima_revision_bundle = ahora + MODEL_RELOAD_INTERVAL
+    version = _mtime_bundle()
+    if version is not None and version not in (_version_bundle, _version_fallida):
+        print("El bundle del modelo ha cambiado: recargando.")
+        try:
+            cargar_modelo()
+        except Exception as e:
+            # Un bundle roto o desactualizado no tumba la app: se sigue sirviendo el motor que ya está en memoria
+            _version_fallida = version
+            print(f"No se pudo recargar el modelo; se sigue usando el anterior: {e}")
+
+def analizar_sentimiento(texto):
+    """Devuelve el 'mood' del texto y la probabilidad que el modelo MLP le da (su confianza)."""
+    motor_actual = motor
+    if motor_actual is None:
+        raise RuntimeError("Los modelos de clasificación no están cargados. Ejecuta 'python modelo.py construir' o verifica que 'train.tsv' exista.")
     
-
-
-    # Vocabulario personalizado (top-N por label)
-    custom_vocab = top_words_by_label(df, 'label', 'tweet', top_n=1250)
-
-    # Eliminar stopwords del vocabulario personalizado
-    custom_vocab_no_stop = [w for w in custom_vocab if w.lower() not in spanish_stopwords]
-
-    # Vectorizador con vocabulario personalizado sin stopwords
-    vectorizer = TfidfVectorizer(vocabulary=custom_vocab_no_stop)
-    X = vectorizer.fit_transform(df['tweet'])
-    # Entrenar el clasificador MLP
-    mlp = MLPClassifier(
-            hidden_layer_sizes=(64,),
-            activation='logistic',  # Cambiado de 'sigmoid' a 'logistic'
-            solver='adam',
-            alpha=0.01,
-            learning_rate_init=0.001,
-            max_iter=700,
-            random_state=42,
-            early_stopping=True,
-            n_iter_no_change=25,
-            tol=0.0001,
-            verbose=False
-        )
-    mlp.fit(X, y)
-
-    
-    print("Modelo entrenado y listo.")
-    return vectorizer, mlp, label_encoder
-
-# Entrenar los modelos una sola vez al iniciar la app
-vectorizer, mlp, label_encoder = train_sentiment_model()
+    # Los textos repetidos (o que solo difieren en lo que quita limpiar_tweet) no se vuelven a clasificar
+    with etapa('limpiar_tweet'):
+        texto_limpio = limpiar_tweet(texto)
+    return predicciones.obtener(texto_limpio, lambda: _clasificar(motor_actual, texto_limpio))
+
+def _clasificar(motor, texto_limpio):
+    with etapa('vectorizar'):
+        vector = motor.vectorizar(texto_limpio)
+    with etapa('predecir'):
+        probabilidades = motor.probabilidades(texto_limpio, vector)
+    indice = int(probabilidades.argmax())
+    return etiqueta_a_mood(motor.etiquetas[indice]), float(probabilidades[indice])
 
 def predecir_sentimiento(texto):
     """Predice el sentimiento de un texto usando el modelo MLP cargado."""
-    if not all([vectorizer, mlp, label_encoder]):
-        raise RuntimeError("Los modelos de clasificación no están cargados. Verifica que 'train.tsv' exista.")
-    
-    texto_limpio = limpiar_tweet(texto)
-    vector_texto = vectorizer.transform([texto_limpio])
-    prediccion_numerica = mlp.predict(vector_texto)
-    prediccion_etiqueta = label_encoder.inverse_transform(prediccion_numerica)
-    
-    # Mapear la etiqueta a un 'mood' simple
-    etiqueta = prediccion_etiqueta[0]
+    return analizar_sentimiento(texto)[0]
+
+def etiqueta_a_mood(etiqueta):
+    """Mapea la etiqueta del modelo a un 'mood' simple."""
     if etiqueta == 'joy ':
         return 'pozik'
     elif etiqueta == 'sadness ':
@@ -609,7 +402,195 @@ def predecir_sentimiento(texto):
         return 'hasarre'
     return 'desconocido'
 
+# --- API de clasificación por lotes ---
+
+# Máximo de textos por petición y cuántos se vectorizan/predicen de una vez
+SENTIMENT_BATCH_MAX = int(os.getenv('SENTIMENT_BATCH_MAX', '1000'))
+SENTIMENT_BATCH_CHUNK = int(os.getenv('SENTIMENT_BATCH_CHUNK', '256'))
+
+def clasificar_lote(textos):
+    """Clasifica una lista de textos de una vez con el motor y devuelve un resultado por texto."""
+    motor_actual = motor
+    with etapa('limpiar_tweet'):
+        textos_limpios = [limpiar_tweet(texto) for texto in textos]
+    with etapa('predecir'):
+        probabilidades = motor_actual.probabilidades_lote(textos_limpios)
+    etiquetas = motor_actual.etiquetas
+    resultados = []
+    for fila in probabilidades:
+        etiqueta = etiquetas[fila.argmax()]
+        resultados.append({
+            'label': etiqueta.strip(),
+            'mood': etiqueta_a_mood(etiqueta),
+            'probabilities': {e.strip(): round(float(p), 6) for e, p in zip(etiquetas, fila)},
+        })
+    return resultados
+
+def _textos_de_peticion():
+    """Genera (índice, texto o error) a partir de un array JSON o de un stream NDJSON."""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        lineas = (linea for linea in request.stream if linea.strip())
+        elementos = (json.loads(linea) for linea in lineas)
+    else:
+        elementos = request.get_json(silent=True)
+        if not isinstance(elementos, list):
+            raise ValueError("Se esperaba un array JSON de textos o un stream NDJSON.")
+    for indice, elemento in enumerate(elementos):
+        if isinstance(elemento, dict):
+            elemento = elemento.get('text')
+        if not isinstance(elemento, str):
+            yield indice, ValueError("Cada elemento debe ser un texto o un objeto con 'text'.")
+        else:
+            yield indice, elemento
+
+@app.route('/api/sentiment/batch', methods=['POST'])
+def sentiment_batch():
+    if motor is None:
+        return jsonify(error="Los modelos de clasificación no están cargados."), 503
+
+    try:
+        entrada = _textos_de_peticion()
+        if request.mimetype not in ('application/x-ndjson', 'application/jsonl'):
+            # Con un array JSON el tamaño se conoce de antemano
+            entrada = list(entrada)
+            if len(entrada) > SENTIMENT_BATCH_MAX:
+                return jsonify(error=f"El lote supera el máximo de {SENTIMENT_BATCH_MAX} textos."), 413
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def generar():
+        bloque = []
+
+        def vaciar():
+            resultados = clasificar_lote([texto for _, texto in bloque])
+            lineas = ''.join(json.dumps({'index': indice, **resultado}, ensure_ascii=False) + '\n'
+                             for (indice, _), resultado in zip(bloque, resultados))
+            bloque.clear()
+            return lineas
+
+        try:
+            for indice, texto in entrada:
+                if indice >= SENTIMENT_BATCH_MAX:
+                    # En NDJSON el límite solo se detecta al leer: se corta el stream
+                    if bloque:
+                        yield vaciar()
+                    yield json.dumps({'error': f"El lote supera el máximo de {SENTIMENT_BATCH_MAX} textos."}, ensure_ascii=False) + '\n'
+                    return
+                if isinstance(texto, Exception):
+                    yield json.dumps({'index': indice, 'error': str(texto)}, ensure_ascii=False) + '\n'
+                    continue
+                bloque.append((indice, texto))
+                if len(bloque) >= SENTIMENT_BATCH_CHUNK:
+                    yield vaciar()
+            if bloque:
+                yield vaciar()
+        except ValueError as e:
+            # Línea NDJSON inválida a mitad del stream: se entrega lo ya leído y se corta
+            if bloque:
+                yield vaciar()
+            yield json.dumps({'error': f"Entrada inválida: {e}"}, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generar()), mimetype='application/x-ndjson')
+
+
+# Longitud de la playlist: la elige el usuario entre el mínimo y PLAYLIST_MAX_TRACKS
+PLAYLIST_MIN_TRACKS = 18
+PLAYLIST_MAX_TRACKS = int(os.getenv('PLAYLIST_MAX_TRACKS', '500'))
+
+def longitud_playlist():
+    """Longitud pedida en el formulario, acotada a [PLAYLIST_MIN_TRACKS, PLAYLIST_MAX_TRACKS]."""
+    try:
+        longitud = int(request.form.get('longitud', PLAYLIST_MIN_TRACKS))
+    except ValueError:
+        longitud = PLAYLIST_MIN_TRACKS
+    return min(max(longitud, PLAYLIST_MIN_TRACKS), PLAYLIST_MAX_TRACKS)
 
+def generar_playlist(parametros, progreso):
+    """
+    Trabajo en segundo plano que crea la playlist del usuario para un estado de
+    ánimo ya predicho ('pozik' o 'triste'). Devuelve la URL y el nombre.
+    """
+    mood = parametros['mood']
+    confianza = parametros.get('confianza', 1.0)
+    semilla = parametros.get('semilla')
+    longitud = parametros['longitud']
+    id_sesion = parametros['cache_id']
+    # El token se resuelve en cada llamada: puede renovarse mientras dura el trabajo
+    sid = parametros['sesion']
+    sp = cliente_spotify.cliente_renovable(lambda: token_de_sesion(sid))
+
+    progreso("Obteniendo tu perfil", 5)
+    user_info = perfil_usuario(sp, id_sesion)
+    user_market = user_info.get('country')
+
+    # --- Lógica para Feliz y Triste ---
+    # Canciones y artistas principales, y las canciones de cada artista, en paralelo
+    progreso("Reuniendo tus canciones y artistas favoritos", 15)
+    artist_limit = 20 if mood == 'pozik' else 10
+    cargar_top = cargador_top_usuario(sp, id_sesion)
+    with etapa('pool_canciones'):
+        final_track_list = construir_pool_canciones(sp, user_market, artist_limit, cargar_top=cargar_top)
+    propias = [t['id'] for t in cargar_top('tracks', TOP_ITEMS_LIMIT)['items'] if t and t.get('id')]
+    candidatos = PoolCandidatos(final_track_list, propias=propias)
+    if len(candidatos) < PLAYLIST_MIN_TRACKS:
+        raise ValueError(f"No tienes suficientes canciones en tu historial para crear una playlist "
+                         f"({len(candidatos)} encontradas). ¡Escucha más música!")
+
+    progreso("Eligiendo canciones", 50)
+    uris = []
+    nombre = ""
+    
+    if mood == 'triste':
+        nombre = "Huts egiten ez dutenak"
+        with etapa('seleccion'):
+            selected_tracks = candidatos.elegir(longitud, mood, confianza, semilla=semilla)
+        uris = [t['uri'] for t in selected_tracks]
+
+    elif mood == 'pozik':
+        nombre = "Zure abesti gustukoenak eta iradokizun batzuk"
+        # Como con 18 canciones (10 propias y 8 recomendadas), en la misma proporción
+        with etapa('seleccion'):
+            base_tracks = candidatos.elegir(round(longitud * 10 / 18), mood, confianza, semilla=semilla)
+        uris = [t['uri'] for t in base_tracks]
+        seed_track_ids = [t['id'] for t in base_tracks]
+        try:
+            propias = set(uris)
+            with etapa('recomendaciones'):
+                recomendadas = recomendaciones(sp, seed_track_ids, user_market, longitud - len(uris))
+            uris.extend(uri for uri in recomendadas if uri not in propias)
+        except Exception as e:
+            print(f"Error obteniendo recomendaciones: {e}")
+        # Completar con canciones propias si faltan recomendaciones
+        remaining_needed = longitud - len(uris)
+        if remaining_needed > 0:
+            extra = candidatos.elegir(remaining_needed, mood, confianza, semilla=semilla, excluir=uris)
+            uris.extend(t['uri'] for t in extra)
+
+    progreso("Creando la playlist", 70)
+    descripcion = f"{mood} bazare entzun hau."
+    with etapa('playlist_create'):
+        playlist = sp.user_playlist_create(user_info['id'], nombre, public=True, description=descripcion)
+    progreso(f"Añadiendo {len(uris)} canciones", 80)
+    with etapa('playlist_add'):
+        escribir_playlist(sp, playlist['id'], uris)
+
+    return {'playlist_url': playlist['external_urls']['spotify'], 'nombre': nombre}
+
+def _generar_playlist_en_fondo(parametros, progreso):
+    # Sus llamadas a Spotify ceden el paso a las de las páginas que se están cargando
+    with prioridad(FONDO):
+        return generar_playlist(parametros, progreso)
+
+trabajos.cola.registrar('crear_playlist', _generar_playlist_en_fondo)
+
+def actualizar_modelo(parametros, progreso):
+    """Trabajo que aplica las correcciones pendientes al modelo y lo pone en uso si mejora."""
+    informe = retroalimentacion.actualizar_bundle(retroalimentacion.almacen, progreso=progreso)
+    if informe['aceptada']:
+        cargar_modelo()
+    return informe
+
+trabajos.cola.registrar('actualizar_modelo', actualizar_modelo)
 
 @app.route('/crear-playlist', methods=['GET', 'POST'])
 def crear_playlist():
@@ -617,19 +598,16 @@ def crear_playlist():
         token_info = get_token()
         if not token_info:
             return redirect(url_for('login'))
-        sp = spotipy.Spotify(auth=token_info['access_token'])
-        user_info = sp.current_user()
-        user_market = user_info.get('country')
 
-        # ...existing code...
         if request.method == 'POST':
             user_text = request.form.get('user_text')
             if not user_text:
                 return 'Por favor, introduce un texto.', 400
+            longitud = longitud_playlist()
 
             # Predecir el estado de ánimo a partir del texto
             try:
-                mood = predecir_sentimiento(user_text)
+                mood, confianza = analizar_sentimiento(user_text)
             except RuntimeError as e:
                 return f"Error del modelo: {e}", 500
             except Exception as e:
@@ -637,139 +615,98 @@ def crear_playlist():
 
             if mood == 'desconocido':
                 return "No se pudo determinar un sentimiento claro del texto. Inténtalo de nuevo.", 400
+            # Para que el usuario pueda confirmar o corregir la predicción (/confirmar-estado)
+            session['prediccion'] = {'texto': user_text, 'mood': mood}
             
             # Si está enfadado, redirigir a una playlist tranquila
             if mood == 'hasarre':
                 calm_playlist_url = 'https://open.spotify.com/playlist/37i9dQZF1DX4sWSpwq3LiO'
-                return f'''
-                <!DOCTYPE html>
-                <html lang="es">
-                <head>
-                    <title>Redirigiendo...</title>
-                    <meta charset="UTF-8">
-                    {get_base_css()}
-                    <meta http-equiv="refresh" content="2;url={calm_playlist_url}" />
-                </head>
-                <body>
-                    <div class="container">
-                        <h1>Redirigiendo a una Playlist Tranquila</h1>
-                        <p>Para ayudarte a relajar, te estamos llevando a una playlist de música tranquila en Spotify.</p>
-                        <p>Si no eres redirigido automáticamente, <a href="{calm_playlist_url}" target="_blank">haz clic aquí</a>.</p>
-                    </div>
-                </body>
-                </html>
-                '''
-
-            # --- Lógica para Feliz y Triste ---
-            top_tracks_results = sp.current_user_top_tracks(limit=30, time_range='short_term')
-            track_pool = {track['id']: track for track in top_tracks_results['items'] if track and track.get('id')}
-            artist_limit = 20 if mood == 'pozik' else 10
-            top_artists_results = sp.current_user_top_artists(limit=artist_limit, time_range='short_term')
-            artist_ids = [artist['id'] for artist in top_artists_results['items'] if artist and artist.get('id')]
-
-            for artist_id in artist_ids:
-                try:
-                    artist_top_tracks = sp.artist_top_tracks(artist_id, country=user_market)['tracks']
-                    for track in artist_top_tracks:
-                        if track and track.get('id') and track['id'] not in track_pool:
-                            track_pool[track['id']] = track
-                except Exception as e:
-                    print(f"No se pudieron obtener canciones para el artista {artist_id}: {e}")
-                    continue
+                return render_template('playlist_tranquila.html', playlist_url=calm_playlist_url, mood=mood)
+
+            # Las llamadas a Spotify se hacen en segundo plano: se responde ya con el id del trabajo
+            id_sesion = id_sesion_cache()
+            id_trabajo = trabajos.cola.encolar('crear_playlist', {
+                'mood': mood,
+                'confianza': confianza,
+                'longitud': longitud,
+                # Opcional: misma semilla, misma selección de canciones
+                'semilla': request.form.get('semilla', type=int),
+                # Solo el identificador de la sesión: el token se lee de ella al ejecutar el trabajo
+                'sesion': session.sid,
+                'cache_id': id_sesion,
+            }, propietario=id_sesion)
+            cabeceras = {'Location': url_for('estado_trabajo', id_trabajo=id_trabajo)}
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({
+                    'id': id_trabajo,
+                    'estado_url': url_for('estado_trabajo', id_trabajo=id_trabajo),
+                    'eventos_url': url_for('eventos_trabajo', id_trabajo=id_trabajo),
+                }), 202, cabeceras
+            return render_template('playlist_en_curso.html', id_trabajo=id_trabajo, mood=mood), 202, cabeceras
 
-            final_track_list = list(track_pool.values())
-            if len(final_track_list) < 18:
-                return f"<h2>No tienes suficientes canciones en tu historial para crear una playlist ({len(final_track_list)} encontradas). ¡Escucha más música!</h2><a href='/dashboard'>Volver</a>"
-
-            uris = []
-            nombre = ""
-            
-            if mood == 'triste':
-                nombre = "Huts egiten ez dutenak"
-                selected_tracks = random.sample(final_track_list, 18)
-                uris = [t['uri'] for t in selected_tracks]
-
-            elif mood == 'pozik':
-                nombre = "Zure abesti gustukoenak eta iradokizun batzuk"
-                base_tracks = random.sample(final_track_list, 10)
-                uris = [t['uri'] for t in base_tracks]
-                seed_track_ids = [t['id'] for t in base_tracks[:5]]
-                try:
-                    recommendations = sp.recommendations(seed_tracks=seed_track_ids, limit=8, market=user_market)
-                    uris.extend([t['uri'] for t in recommendations['tracks']])
-                except Exception as e:
-                    print(f"Error obteniendo recomendaciones: {e}")
-                    remaining_needed = 18 - len(uris)
-                    if remaining_needed > 0:
-                        extra_pool = [t for t in final_track_list if t['uri'] not in uris]
-                        uris.extend([t['uri'] for t in random.sample(extra_pool, min(remaining_needed, len(extra_pool)))])
-
-            descripcion = f"{mood} bazare entzun hau."
-            playlist = sp.user_playlist_create(user_info['id'], nombre, public=True, description=descripcion)
-            sp.playlist_add_items(playlist['id'], uris)
-
-            playlist_url = playlist['external_urls']['spotify']
-            return f'''
-            <!DOCTYPE html>
-            <html lang="es">
-            <head>
-                <title>Redirigiendo a tu Playlist</title>
-                <meta charset="UTF-8">
-                {get_base_css()}
-                <meta http-equiv="refresh" content="2;url={playlist_url}" />
-            </head>
-            <body>
-                <div class="container">
-                    <h1>Playlist Creada con Éxito</h1>
-                    <p>Tu playlist "{nombre}" está lista y se abrirá en Spotify en unos segundos.</p>
-                    <p>Si no eres redirigido automáticamente, <a href="{playlist_url}" target="_blank">haz clic aquí</a>.</p>
-                    <a class="button" href="/dashboard">Volver al Panel de Control</a>
-                </div>
-            </body>
-            </html>
-            '''
-# ...existing code...
         # GET: si no es POST, mostrar el formulario
-        return f'''
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <title>Crear Playlist por Sentimiento</title>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            {get_base_css()}
-            <style>
-                textarea {{
-                    width: 95%;
-                    padding: 15px;
-                    border-radius: 5px;
-                    border: 1px solid #535353;
-                    background-color: #282828;
-                    color: white;
-                    font-size: 1em;
-                    min-height: 80px;
-                    resize: vertical;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h2>Crear Playlist Basada en un Sentimiento</h2>
-                <form method="post" class="form-container">
-                    <label for="user_text">Escribe una frase (máx. 240 caracteres) que describa cómo te sientes:</label>
-                    <textarea name="user_text" id="user_text" maxlength="240" required></textarea>
-                    <br><br>
-                    <button class="button" type="submit">Crear Playlist</button>
-                </form>
-                <div class="footer-nav">
-                    <a href="/dashboard">Volver al Panel de Control</a>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
+        return render_template('crear_playlist.html', minimo=PLAYLIST_MIN_TRACKS, maximo=PLAYLIST_MAX_TRACKS)
     except Exception as e:
         return f"Error al crear la playlist: {str(e)} <br><a href='/dashboard'>Volver</a>"
 
+@app.route('/confirmar-estado', methods=['POST'])
+def confirmar_estado():
+    """
+    El usuario confirma o corrige el estado de ánimo de su última predicción.
+    La corrección se guarda y, si ya hay suficientes, se encola la actualización del modelo.
+    """
+    prediccion = session.pop('prediccion', None)
+    mood = request.form.get('mood')
+    if prediccion is None or mood not in retroalimentacion.ETIQUETA_DE_MOOD:
+        return jsonify({'error': 'No hay ninguna predicción que confirmar'}), 400
+    pendientes = retroalimentacion.almacen.guardar(prediccion['texto'], mood, prediccion['mood'])
+    if pendientes >= retroalimentacion.FEEDBACK_MIN_BATCH:
+        trabajos.cola.encolar_unico('actualizar_modelo', {})
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'guardado': True})
+    return redirect(url_for('dashboard'))
+
+# --- Estado de los trabajos en segundo plano ---
+
+# Cada cuánto se consulta el estado en el stream SSE y cuánto dura como mucho un stream
+# (el navegador vuelve a conectar solo al cerrarse)
+JOBS_SSE_INTERVAL = float(os.getenv('JOBS_SSE_INTERVAL', '0.5'))
+JOBS_SSE_MAX = float(os.getenv('JOBS_SSE_MAX', '60'))
+
+def trabajo_de_sesion(id_trabajo):
+    """Estado del trabajo si pertenece a la sesión actual, o None."""
+    if 'cache_id' not in session:
+        return None
+    return trabajos.cola.estado(id_trabajo, propietario=session['cache_id'])
+
+@app.route('/trabajos/<id_trabajo>')
+def estado_trabajo(id_trabajo):
+    estado = trabajo_de_sesion(id_trabajo)
+    if estado is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(estado)
+
+@app.route('/trabajos/<id_trabajo>/eventos')
+def eventos_trabajo(id_trabajo):
+    """Server-Sent Events con el estado del trabajo cada vez que cambia, hasta que termina."""
+    if trabajo_de_sesion(id_trabajo) is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    def generar():
+        limite = time.monotonic() + JOBS_SSE_MAX
+        anterior = None
+        yield "retry: 1000\n\n"
+        while time.monotonic() < limite:
+            estado = trabajos.cola.estado(id_trabajo)
+            if estado != anterior:
+                yield f"data: {json.dumps(estado, ensure_ascii=False)}\n\n"
+                anterior = estado
+            if estado is None or estado['estado'] in trabajos.ESTADOS_FINALES:
+                return
+            time.sleep(JOBS_SSE_INTERVAL)
+
+    return Response(stream_with_context(generar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
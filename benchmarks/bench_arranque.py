@@ -0,0 +1,110 @@
+"""
+Benchmark del arranque de un worker: cuánto tarda `import app` (imports y
+carga del modelo) en un proceso nuevo, medido con `python -X importtime`.
+
+Cada ronda lanza un intérprete nuevo con credenciales y almacenes de prueba;
+se informa del mejor tiempo de proceso completo y de `import app`, y de los
+módulos que más tardan en importarse. Falla (código 1) si la app importa
+alguno de los módulos de entrenamiento (--prohibidos) o, con --comparar, si
+alguna medida empeora más de --tolerancia respecto a unas guardadas antes:
+
+    python benchmarks/bench_arranque.py --guardar arranque.json
+    python benchmarks/bench_arranque.py --comparar arranque.json --tolerancia 0.25
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from comun import almacenes_temporales, comparar
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lo que un worker web no debería importar: solo hace falta para entrenar
+PROHIBIDOS = ['sklearn', 'pandas', 'scipy', 'modelo', 'busqueda']
+
+
+def entorno(tmp):
+    env = dict(os.environ)
+    env.update(almacenes_temporales(tmp))
+    return env
+
+def leer_importtime(salida):
+    """{módulo: (propio µs, acumulado µs, profundidad)} a partir de la salida de -X importtime."""
+    modulos = {}
+    for linea in salida.splitlines():
+        if not linea.startswith('import time:') or 'imported package' in linea:
+            continue
+        propio, acumulado, nombre = linea[len('import time:'):].split('|')
+        profundidad = (len(nombre) - len(nombre.lstrip())) // 2
+        modulos[nombre.strip()] = (int(propio), int(acumulado), profundidad)
+    return modulos
+
+def ronda(env):
+    """Arranca un intérprete que importa app; devuelve (segundos del proceso, módulos importados)."""
+    inicio = time.perf_counter()
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=RAIZ, env=env,
+                             capture_output=True, text=True)
+    segundos = time.perf_counter() - inicio
+    if proceso.returncode:
+        raise RuntimeError(f"No se pudo importar la app:\n{proceso.stderr[-2000:]}")
+    return segundos, leer_importtime(proceso.stderr)
+
+def ejecutar(rondas):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = entorno(tmp)
+        # La primera ronda puede exportar el motor o preparar cachés: no se cuenta
+        ronda(env)
+        medidas = [ronda(env) for _ in range(rondas)]
+    mejor_proceso = min(segundos for segundos, _ in medidas)
+    _, modulos = min(medidas, key=lambda m: m[1]['app'][1])
+    resultados = {
+        'arranque del proceso': mejor_proceso * 1e3,
+        'import app': modulos['app'][1] / 1e3,
+    }
+    return resultados, modulos
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rondas', type=int, default=5, help='procesos que se arrancan (se toma el mejor)')
+    parser.add_argument('--modulos', type=int, default=10, help='módulos más lentos que se muestran')
+    parser.add_argument('--prohibidos', nargs='*', default=PROHIBIDOS,
+                        help='módulos que la app no debe importar al arrancar')
+    parser.add_argument('--guardar', help='fichero JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='fichero JSON con resultados anteriores')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='empeoramiento relativo permitido')
+    args = parser.parse_args()
+
+    resultados, modulos = ejecutar(args.rondas)
+    for nombre, valor in resultados.items():
+        print(f"{nombre:<26}{valor:>10.1f} ms")
+
+    # Imports directos de la app (profundidad 1) ordenados por tiempo acumulado
+    directos = sorted(((acumulado, nombre) for nombre, (_, acumulado, profundidad) in modulos.items()
+                       if profundidad == 1), reverse=True)
+    print("\nImports de app más lentos:")
+    for acumulado, nombre in directos[:args.modulos]:
+        print(f"  {nombre:<32}{acumulado / 1e3:>8.1f} ms")
+
+    fallo = False
+    importados = [m for m in args.prohibidos if m in modulos]
+    if importados:
+        print(f"\nLa app importa módulos de entrenamiento al arrancar: {', '.join(importados)}")
+        fallo = True
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        print(f"\nComparación con {args.comparar} (tolerancia {args.tolerancia:.0%}):")
+        fallo = bool(comparar(resultados, base, args.tolerancia, 'ms', ancho=24)) or fallo
+    if fallo:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
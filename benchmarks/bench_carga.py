@@ -0,0 +1,223 @@
+"""
+Prueba de carga de la app contra el Spotify falso (spotify_falso.py).
+
+Arranca el servidor falso, crea sesiones ya autenticadas para N usuarios en el
+almacén de sesiones, levanta la app con gunicorn (gunicorn.conf.py, como en
+producción) y lanza peticiones concurrentes a /dashboard, /top-artists,
+/top-tracks y /crear-playlist. Para /crear-playlist mide tanto la respuesta
+del POST (202) como el tiempo hasta que el trabajo termina.
+
+Informa p50/p95/p99, peticiones por segundo, llamadas salientes a Spotify por
+endpoint y RSS de cada worker.
+
+    python benchmarks/bench_carga.py --usuarios 20 --concurrencia 16 --duracion 30 \\
+        --latencia-ms 80 --tasa-429 0.02 --workers 2
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np
+import requests
+
+from comun import almacenes_temporales
+from spotify_falso import SpotifyFalso
+
+RUTAS = ('/dashboard', '/top-artists', '/top-tracks', '/crear-playlist')
+# Textos que el modelo clasifica como 'triste' y 'pozik' (los que generan playlist)
+TEXTOS_PLAYLIST = ('estoy muy triste y solo', 'que feliz estoy hoy, me encanta')
+# Segundos máximos esperando a que termine un trabajo de playlist
+ESPERA_TRABAJO = 60
+
+
+def entorno(tmp, falso, puerto, workers):
+    env = dict(os.environ)
+    env.update(almacenes_temporales(tmp))
+    env.update({
+        'PORT': str(puerto),
+        'WEB_CONCURRENCY': str(workers),
+        'REDIRECT_URI': f'http://127.0.0.1:{puerto}/callback',
+        'SPOTIFY_API_PREFIX': f'{falso.url}/v1/',
+        'SPOTIFY_ACCOUNTS_URL': falso.url,
+        'SESSION_BACKEND': 'sqlite',
+    })
+    return env
+
+def crear_sesiones(env, usuarios):
+    """Guarda en el almacén de sesiones de la app una sesión autenticada por usuario."""
+    os.environ.update(env)
+    from cache import crear_backend
+    from sesiones import SESSION_MAX, SESSION_TTL, InterfazSesiones
+    interfaz = InterfazSesiones(crear_backend('sqlite', env['SESSION_PATH'], SESSION_MAX, SESSION_TTL, tabla='sesiones'))
+    sids = []
+    for i in range(usuarios):
+        sids.append(interfaz.crear({
+            'token_info': {'access_token': f'token-u{i}', 'refresh_token': f'refresh-u{i}', 'token_type': 'Bearer',
+                           'expires_in': 3600, 'expires_at': int(time.time()) + 3600,
+                           'scope': 'user-top-read playlist-modify-public'},
+            'cache_id': f'benchmark-u{i}',
+        }))
+    return sids
+
+def arrancar_gunicorn(env, puerto):
+    proceso = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'app:app'],
+                               cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó al arrancar:\n{proceso.stderr.read().decode()}")
+        try:
+            requests.get(f'http://127.0.0.1:{puerto}/', timeout=1)
+            return proceso
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("gunicorn no respondió a tiempo")
+
+def rss_workers(pid_maestro):
+    """RSS (MB) de los procesos hijos de gunicorn, leído de /proc."""
+    try:
+        with open(f'/proc/{pid_maestro}/task/{pid_maestro}/children') as f:
+            hijos = [int(p) for p in f.read().split()]
+    except OSError:
+        return {}
+    rss = {}
+    for pid in hijos:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for linea in f:
+                    if linea.startswith('VmRSS:'):
+                        rss[pid] = int(linea.split()[1]) / 1024
+        except OSError:
+            pass
+    return rss
+
+def hacer_peticion(http, base, ruta, contador, longitud):
+    """Hace una petición a `ruta` y devuelve [(etiqueta, segundos, ok)]."""
+    inicio = time.perf_counter()
+    if ruta != '/crear-playlist':
+        r = http.get(base + ruta, timeout=60)
+        return [(ruta, time.perf_counter() - inicio, r.status_code == 200)]
+
+    texto = TEXTOS_PLAYLIST[next(contador) % len(TEXTOS_PLAYLIST)]
+    r = http.post(base + ruta, data={'user_text': texto, 'longitud': longitud},
+                  headers={'Accept': 'application/json'}, timeout=60)
+    medidas = [('POST /crear-playlist', time.perf_counter() - inicio, r.status_code == 202)]
+    if r.status_code != 202:
+        return medidas
+    estado_url = base + r.json()['estado_url']
+    limite = time.monotonic() + ESPERA_TRABAJO
+    estado = None
+    while time.monotonic() < limite:
+        r = http.get(estado_url, timeout=60)
+        estado = r.json().get('estado') if r.status_code == 200 else None
+        if estado is None or estado in ('terminado', 'error'):
+            break
+        time.sleep(0.05)
+    medidas.append(('trabajo /crear-playlist', time.perf_counter() - inicio, estado == 'terminado'))
+    return medidas
+
+def cargar(base, sids, rutas, concurrencia, duracion, longitud):
+    medidas = defaultdict(list)
+    errores = defaultdict(int)
+    lock = threading.Lock()
+    limite = time.monotonic() + duracion
+    siguiente = itertools.count()
+    contador_textos = itertools.count()
+
+    def hilo():
+        sesiones_http = {}
+        while time.monotonic() < limite:
+            n = next(siguiente)
+            sid = sids[n % len(sids)]
+            ruta = rutas[n % len(rutas)]
+            http = sesiones_http.get(sid)
+            if http is None:
+                http = sesiones_http[sid] = requests.Session()
+                http.cookies.set('session', sid)
+            try:
+                resultado = hacer_peticion(http, base, ruta, contador_textos, longitud)
+            except requests.RequestException:
+                resultado = [(ruta, 0.0, False)]
+            with lock:
+                for etiqueta, segundos, ok in resultado:
+                    if ok:
+                        medidas[etiqueta].append(segundos)
+                    else:
+                        errores[etiqueta] += 1
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=hilo) for _ in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return medidas, errores, time.perf_counter() - inicio
+
+def informe(medidas, errores, transcurrido, falso, rss):
+    print(f"\n{'ruta':<26}{'n':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    total = 0
+    for etiqueta in sorted(set(medidas) | set(errores)):
+        tiempos = np.array(medidas.get(etiqueta, [])) * 1000
+        if etiqueta != 'trabajo /crear-playlist':
+            total += len(tiempos)
+        p50, p95, p99 = np.percentile(tiempos, [50, 95, 99]) if len(tiempos) else (float('nan'),) * 3
+        print(f"{etiqueta:<26}{len(tiempos):>7}{errores.get(etiqueta, 0):>6}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+    print(f"\nPeticiones por segundo: {total / transcurrido:.1f} ({total} en {transcurrido:.1f} s)")
+
+    print("\nLlamadas a Spotify (falso):")
+    for endpoint, n in falso.llamadas.most_common():
+        print(f"  {endpoint:<48}{n:>7}")
+    limitadas = sum(n for (_, estado), n in falso.respuestas.items() if estado == 429)
+    fallidas = sum(n for (_, estado), n in falso.respuestas.items() if estado >= 500)
+    print(f"  429 devueltos: {limitadas}, 5xx devueltos: {fallidas}")
+
+    if rss:
+        print("\nRSS de los workers: " + ', '.join(f"{pid}: {mb:.1f} MB" for pid, mb in sorted(rss.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--concurrencia', type=int, default=8)
+    parser.add_argument('--duracion', type=float, default=20.0, help='segundos de carga')
+    parser.add_argument('--rutas', nargs='+', default=list(RUTAS), choices=RUTAS)
+    parser.add_argument('--longitud', type=int, default=18, help='canciones por playlist')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--latencia-ms', type=float, default=50.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--tasa-error', type=float, default=0.0)
+    parser.add_argument('--tasa-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    falso = SpotifyFalso(latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms, tasa_error=args.tasa_error,
+                         tasa_429=args.tasa_429, retry_after=args.retry_after).arrancar()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = entorno(tmp, falso, args.puerto, args.workers)
+        sids = crear_sesiones(env, args.usuarios)
+        gunicorn = arrancar_gunicorn(env, args.puerto)
+        try:
+            base = f'http://127.0.0.1:{args.puerto}'
+            falso.reiniciar_contadores()
+            medidas, errores, transcurrido = cargar(base, sids, args.rutas, args.concurrencia, args.duracion,
+                                                    args.longitud)
+            rss = rss_workers(gunicorn.pid)
+        finally:
+            gunicorn.terminate()
+            gunicorn.wait(timeout=30)
+            falso.parar()
+    informe(medidas, errores, transcurrido, falso, rss)
+
+
+if __name__ == '__main__':
+    main()
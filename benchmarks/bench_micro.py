@@ -0,0 +1,108 @@
+"""
+Micro-benchmarks del camino de clasificación: limpiar_tweet, el entrenamiento
+(train_sentiment_model) y predecir_sentimiento con y sin la caché de
+predicciones.
+
+Usa los tweets de train.tsv como entrada y, como los demás benchmarks, un
+directorio temporal para las sesiones, cachés y demás almacenes de la app. Con --guardar se escriben los
+resultados en JSON; con --comparar se comparan con unos guardados antes y el
+proceso termina con código 1 si alguna medida empeora más de --tolerancia, para
+detectar regresiones antes de desplegar:
+
+    python benchmarks/bench_micro.py --guardar base.json
+    python benchmarks/bench_micro.py --comparar base.json --tolerancia 0.25
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comun import almacenes_temporales, comparar
+
+# Antes de importar la app, que abre sus almacenes al importarse
+_TMP = tempfile.mkdtemp(prefix='bench_micro-')
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ.update(almacenes_temporales(_TMP))
+
+import pandas as pd
+
+import app
+from cache import predicciones
+from modelo import DATA_PATH, train_sentiment_model
+from texto import limpiar_tweet
+
+
+def medir(funcion, repeticiones):
+    """Mejor tiempo medio por llamada (µs) de 5 rondas de `repeticiones` llamadas."""
+    mejor = float('inf')
+    for _ in range(5):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        mejor = min(mejor, (time.perf_counter() - inicio) / repeticiones)
+    return mejor * 1e6
+
+def textos_entrenamiento(n):
+    df = pd.read_csv(DATA_PATH, sep='\t')
+    return df['tweet'].astype(str).tolist()[:n]
+
+def ejecutar(n_textos, entrenar):
+    textos = textos_entrenamiento(n_textos)
+    resultados = {}
+
+    def limpiar_todos():
+        for texto in textos:
+            limpiar_tweet(texto)
+    resultados['limpiar_tweet'] = medir(limpiar_todos, 3) / len(textos)
+
+    def sin_cache():
+        for texto in textos:
+            predicciones.invalidar()
+            app.predecir_sentimiento(texto)
+    resultados['predecir_sentimiento (sin caché)'] = medir(sin_cache, 1) / len(textos)
+
+    for texto in textos:
+        app.predecir_sentimiento(texto)
+    def con_cache():
+        for texto in textos:
+            app.predecir_sentimiento(texto)
+    resultados['predecir_sentimiento (caché)'] = medir(con_cache, 3) / len(textos)
+
+    if entrenar:
+        inicio = time.perf_counter()
+        train_sentiment_model()
+        resultados['train_sentiment_model'] = (time.perf_counter() - inicio) * 1e6
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--textos', type=int, default=1000, help='tweets de train.tsv que se usan')
+    parser.add_argument('--sin-entrenamiento', action='store_true', help='no mide train_sentiment_model (tarda segundos)')
+    parser.add_argument('--guardar', help='fichero JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='fichero JSON con resultados anteriores')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='empeoramiento relativo permitido')
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.textos, not args.sin_entrenamiento)
+    for nombre, valor in resultados.items():
+        print(f"{nombre:<38}{valor:>14.1f} µs")
+
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        print(f"\nComparación con {args.comparar} (tolerancia {args.tolerancia:.0%}):")
+        if comparar(resultados, base, args.tolerancia, 'µs'):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Selección de canciones: PoolCandidatos frente a random.sample más el relleno
+con búsqueda lineal que hacía antes /crear-playlist.
+
+Genera pools sintéticos de varios tamaños (con duplicados por ISRC y artistas
+repetidos) y mide el tiempo medio de construir el pool y elegir k canciones.
+
+    python benchmarks/bench_seleccion.py [--tamanos 1000 5000 20000] [--k 500] [--repeticiones 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seleccion import PoolCandidatos
+
+
+def pool_sintetico(n, semilla=0):
+    rng = random.Random(semilla)
+    artistas = [f'artista{i}' for i in range(max(1, n // 10))]
+    tracks = []
+    for i in range(n):
+        # ~5 % son otra edición de una canción ya vista (mismo ISRC)
+        isrc = f'ES{rng.randrange(i):010d}' if i and rng.random() < 0.05 else f'ES{i:010d}'
+        artista = rng.choice(artistas)
+        tracks.append({
+            'id': f't{i}',
+            'uri': f'spotify:track:t{i}',
+            'name': f'Canción {i}',
+            'popularity': rng.randrange(101),
+            'artists': [{'id': artista, 'name': artista}],
+            'external_ids': {'isrc': isrc},
+        })
+    return tracks
+
+def anterior(tracks, k):
+    # Como antes: random.sample de la base y relleno buscando en una lista
+    base = random.sample(tracks, min(k // 2, len(tracks)))
+    uris = [t['uri'] for t in base]
+    extra_pool = [t for t in tracks if t['uri'] not in uris]
+    uris.extend(t['uri'] for t in random.sample(extra_pool, min(k - len(uris), len(extra_pool))))
+    return uris
+
+def nueva(tracks, k, propias):
+    candidatos = PoolCandidatos(tracks, propias=propias)
+    base = candidatos.elegir(k // 2, 'pozik', 0.8)
+    uris = [t['uri'] for t in base]
+    uris.extend(t['uri'] for t in candidatos.elegir(k - len(uris), 'pozik', 0.8, excluir=uris))
+    return uris
+
+def medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--k', type=int, default=500)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'pool':>8}{'k':>6}{'anterior (ms)':>16}{'PoolCandidatos (ms)':>22}")
+    for n in args.tamanos:
+        tracks = pool_sintetico(n)
+        propias = [t['id'] for t in tracks[:50]]
+        ms_anterior = medir(lambda: anterior(tracks, args.k), args.repeticiones)
+        ms_nueva = medir(lambda: nueva(tracks, args.k, propias), args.repeticiones)
+        print(f"{n:>8}{args.k:>6}{ms_anterior:>16.2f}{ms_nueva:>22.2f}")
+
+    # Determinismo con semilla
+    candidatos = PoolCandidatos(pool_sintetico(1000))
+    assert candidatos.elegir(50, 'triste', semilla=7) == candidatos.elegir(50, 'triste', semilla=7)
+
+
+if __name__ == '__main__':
+    main()
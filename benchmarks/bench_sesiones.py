@@ -0,0 +1,85 @@
+"""
+Coste por petición de la sesión en cookie firmada frente a la sesión en el servidor.
+
+Monta dos apps Flask mínimas con una vista que lee token_info de la sesión (y
+otra que además la modifica, como al renovar el token) y mide el tiempo medio
+por petición con el cliente de pruebas, junto con el tamaño de la cookie.
+
+    python benchmarks/bench_sesiones.py [--peticiones 5000] [--backend sqlite|memoria]
+"""
+import argparse
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, session
+
+from cache import crear_backend
+from sesiones import InterfazSesiones
+
+TOKEN_INFO = {
+    # Aleatorios para que la cookie firmada no se comprima más que con un token real
+    'access_token': 'BQ' + secrets.token_urlsafe(180),
+    'token_type': 'Bearer',
+    'expires_in': 3600,
+    'refresh_token': 'AQ' + secrets.token_urlsafe(98),
+    'scope': 'playlist-modify-public user-top-read',
+    'expires_at': int(time.time()) + 3600,
+}
+
+
+def crear_app(interfaz=None):
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+    if interfaz is not None:
+        app.session_interface = interfaz
+
+    @app.route('/leer')
+    def leer():
+        return session['token_info']['access_token'][:8]
+
+    @app.route('/escribir')
+    def escribir():
+        session['token_info'] = {**session['token_info'], 'expires_at': int(time.time()) + 3600}
+        return 'ok'
+
+    return app
+
+def medir(app, ruta, peticiones):
+    cliente = app.test_client()
+    with cliente.session_transaction() as s:
+        s['token_info'] = TOKEN_INFO
+        s['cache_id'] = 'c' * 32
+    cookie = cliente.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    for _ in range(100):
+        cliente.get(ruta)
+    inicio = time.perf_counter()
+    for _ in range(peticiones):
+        cliente.get(ruta)
+    return (time.perf_counter() - inicio) / peticiones * 1e6, len(cookie.value)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--peticiones', type=int, default=5000)
+    parser.add_argument('--backend', choices=['sqlite', 'memoria'], default='sqlite')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = crear_backend(args.backend, os.path.join(tmp, 'sesiones.sqlite3'), 10000, 3600, tabla='sesiones')
+        apps = {
+            'cookie firmada': crear_app(),
+            f'servidor ({args.backend})': crear_app(InterfazSesiones(backend)),
+        }
+        print(f"{'sesión':<22}{'ruta':<12}{'µs/petición':>14}{'cookie (bytes)':>16}")
+        for nombre, app in apps.items():
+            for ruta in ('/leer', '/escribir'):
+                us, tam = medir(app, ruta, args.peticiones)
+                print(f"{nombre:<22}{ruta:<12}{us:>14.1f}{tam:>16}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Utilidades compartidas por los benchmarks.
+
+- almacenes_temporales(tmp): variables de entorno que llevan todos los
+  almacenes SQLite de la app (sesiones, cachés, trabajos, límite de Spotify,
+  correcciones) y credenciales de prueba a un directorio temporal, para que un
+  benchmark nunca escriba en las bases de datos reales del desarrollador.
+- comparar(): variación respecto a unos resultados guardados antes y medidas
+  que empeoran más de la tolerancia.
+"""
+import os
+
+
+def almacenes_temporales(tmp):
+    """Variables de entorno con credenciales de prueba y los almacenes de la app dentro de `tmp`."""
+    return {
+        'SECRET_KEY': 'benchmark',
+        'SPOTIFY_CLIENT_ID': 'benchmark',
+        'SPOTIFY_CLIENT_SECRET': 'benchmark',
+        'REDIRECT_URI': 'http://127.0.0.1:8000/callback',
+        'SESSION_PATH': os.path.join(tmp, 'sesiones.sqlite3'),
+        'CATALOG_CACHE_PATH': os.path.join(tmp, 'cache.sqlite3'),
+        'JOBS_DB_PATH': os.path.join(tmp, 'trabajos.sqlite3'),
+        'SPOTIFY_RATE_PATH': os.path.join(tmp, 'limite_spotify.sqlite3'),
+        'FEEDBACK_DB_PATH': os.path.join(tmp, 'correcciones.sqlite3'),
+    }
+
+def comparar(resultados, base, tolerancia, unidad, ancho=36):
+    """Imprime la variación respecto a `base` y devuelve las medidas que empeoran más de `tolerancia`."""
+    regresiones = []
+    for nombre, valor in resultados.items():
+        anterior = base.get(nombre)
+        if not anterior:
+            continue
+        cambio = valor / anterior - 1
+        marca = '  REGRESIÓN' if cambio > tolerancia else ''
+        print(f"  {nombre:<{ancho}}{anterior:>12.1f} -> {valor:>10.1f} {unidad} ({cambio:+.0%}){marca}")
+        if cambio > tolerancia:
+            regresiones.append(nombre)
+    return regresiones
@@ -0,0 +1,254 @@
+"""
+Servidor local que imita los endpoints de la API de Spotify que usa la app.
+
+Las respuestas son deterministas (mismos ids y canciones para la misma
+entrada) y se puede inyectar latencia, errores 5xx y respuestas 429 con
+Retry-After. Cuenta las llamadas por endpoint para comparar cuántas peticiones
+salientes hace la app. Se usa desde bench_carga.py o por separado:
+
+    python benchmarks/spotify_falso.py --puerto 9000 --latencia-ms 80 --tasa-429 0.02
+
+y la app se apunta a él con SPOTIFY_API_PREFIX=http://127.0.0.1:9000/v1/ y
+SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:9000.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Elementos principales de cada usuario en cada periodo (Spotify los devuelve en páginas de 50)
+ARTISTAS_POR_USUARIO = 300
+CANCIONES_POR_USUARIO = 300
+
+
+def _id(*partes):
+    """Id de 22 caracteres alfanuméricos, como los de Spotify, derivado de `partes`."""
+    resumen = hashlib.sha256('|'.join(map(str, partes)).encode()).hexdigest()
+    return resumen[:22]
+
+def _artista(i):
+    id_ = _id('artista', i)
+    return {'id': id_, 'name': f'Artista {i}', 'genres': ['pop', 'indie'], 'popularity': (i * 37) % 101,
+            'uri': f'spotify:artist:{id_}', 'type': 'artist'}
+
+def _cancion(clave, i, artista):
+    id_ = _id('cancion', clave, i)
+    return {
+        'id': id_,
+        'uri': f'spotify:track:{id_}',
+        'name': f'Canción {clave}-{i}',
+        'popularity': int(id_[:4], 16) % 101,
+        'duration_ms': 150000 + int(id_[4:8], 16) % 120000,
+        'artists': [{'id': artista['id'], 'name': artista['name']}],
+        'album': {'name': f'Álbum {clave}'},
+        'external_ids': {'isrc': f'ES{id_[:10].upper()}'},
+        'type': 'track',
+    }
+
+
+class SpotifyFalso:
+    """Servidor HTTP en un hilo con latencia, errores y 429 configurables."""
+
+    def __init__(self, puerto=0, latencia_ms=50.0, jitter_ms=20.0, tasa_error=0.0, tasa_429=0.0,
+                 retry_after=1, semilla=0):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.tasa_error = tasa_error
+        self.tasa_429 = tasa_429
+        self.retry_after = retry_after
+        self.llamadas = Counter()
+        self.respuestas = Counter()
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+        self._playlists = {}
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                servidor._atender(self, 'GET')
+
+            def do_POST(self):
+                servidor._atender(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', puerto), Manejador)
+        self.httpd.daemon_threads = True
+        self.puerto = self.httpd.server_address[1]
+        self._hilo = threading.Thread(target=self.httpd.serve_forever, name='spotify-falso', daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.puerto}'
+
+    def arrancar(self):
+        self._hilo.start()
+        return self
+
+    def parar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            self.llamadas.clear()
+            self.respuestas.clear()
+
+    # Rutas: (método, patrón) -> función(coincidencia, query, cuerpo) -> dict
+    def _rutas(self):
+        return [
+            ('GET', r'/v1/me', self._perfil),
+            ('GET', r'/v1/me/top/artists', self._top_artistas),
+            ('GET', r'/v1/me/top/tracks', self._top_canciones),
+            ('GET', r'/v1/artists/(?P<id>\w+)/top-tracks', self._top_artista),
+            ('GET', r'/v1/recommendations', self._recomendaciones),
+            ('POST', r'/v1/users/(?P<id>\w+)/playlists', self._crear_playlist),
+            # spotipy >= 2.25 usa /items; versiones anteriores, /tracks
+            ('POST', r'/v1/playlists/(?P<id>\w+)/(?:items|tracks)', self._anadir_canciones),
+            ('POST', r'/api/token', self._token),
+        ]
+
+    def _atender(self, peticion, metodo):
+        url = urlparse(peticion.path)
+        longitud = int(peticion.headers.get('Content-Length') or 0)
+        cuerpo = peticion.rfile.read(longitud) if longitud else b''
+        for metodo_ruta, patron, funcion in self._rutas():
+            # spotipy pide algunos endpoints con barra final ('me/')
+            coincidencia = re.fullmatch(patron, url.path.rstrip('/'))
+            if metodo_ruta == metodo and coincidencia:
+                break
+        else:
+            return self._responder(peticion, 404, {'error': {'status': 404, 'message': 'No encontrado'}}, 'desconocido')
+
+        endpoint = f'{metodo} {patron}'
+        with self._lock:
+            self.llamadas[endpoint] += 1
+            sorteo = self._rng.random()
+            espera = max(0.0, self._rng.gauss(self.latencia_ms, self.jitter_ms)) / 1000
+        time.sleep(espera)
+        if sorteo < self.tasa_429:
+            return self._responder(peticion, 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                                   endpoint, {'Retry-After': str(self.retry_after)})
+        if sorteo < self.tasa_429 + self.tasa_error:
+            return self._responder(peticion, 503, {'error': {'status': 503, 'message': 'Service unavailable'}}, endpoint)
+        try:
+            datos = funcion(coincidencia, parse_qs(url.query), cuerpo, peticion.headers)
+        except ValueError as e:
+            return self._responder(peticion, 400, {'error': {'status': 400, 'message': str(e)}}, endpoint)
+        self._responder(peticion, 201 if funcion == self._crear_playlist else 200, datos, endpoint)
+
+    def _responder(self, peticion, estado, datos, endpoint, cabeceras=None):
+        with self._lock:
+            self.respuestas[(endpoint, estado)] += 1
+        cuerpo = json.dumps(datos).encode()
+        peticion.send_response(estado)
+        peticion.send_header('Content-Type', 'application/json')
+        peticion.send_header('Content-Length', str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            peticion.send_header(nombre, valor)
+        peticion.end_headers()
+        peticion.wfile.write(cuerpo)
+
+    @staticmethod
+    def _usuario(cabeceras):
+        # El token de acceso identifica al usuario: 'token-<usuario>'
+        return (cabeceras.get('Authorization') or '').rpartition('token-')[2] or 'anonimo'
+
+    def _perfil(self, coincidencia, query, cuerpo, cabeceras):
+        usuario = self._usuario(cabeceras)
+        return {'id': usuario, 'display_name': f'Usuario {usuario}', 'country': 'ES',
+                'followers': {'total': len(usuario)}}
+
+    @staticmethod
+    def _pagina(query, total, elemento, ruta):
+        """Página con el formato de Spotify (items, total, offset, next) de `total` elementos."""
+        limite = min(int(query.get('limit', ['20'])[0]), 50)
+        posicion = int(query.get('offset', ['0'])[0])
+        periodo = query.get('time_range', ['medium_term'])[0]
+        fin = min(posicion + limite, total)
+        siguiente = (f'{ruta}?limit={limite}&offset={fin}&time_range={periodo}' if fin < total else None)
+        return {'items': [elemento(i, periodo) for i in range(posicion, fin)], 'total': total, 'limit': limite,
+                'offset': posicion, 'next': siguiente}
+
+    def _top_artistas(self, coincidencia, query, cuerpo, cabeceras):
+        desplazamiento = sum(map(ord, self._usuario(cabeceras))) % 200
+        return self._pagina(query, ARTISTAS_POR_USUARIO, lambda i, periodo: _artista(desplazamiento + i),
+                            '/v1/me/top/artists')
+
+    def _top_canciones(self, coincidencia, query, cuerpo, cabeceras):
+        usuario = self._usuario(cabeceras)
+        desplazamiento = sum(map(ord, usuario)) % 200
+        return self._pagina(query, CANCIONES_POR_USUARIO,
+                            lambda i, periodo: _cancion(f'{usuario}-{periodo}', i, _artista(desplazamiento + i % 7)),
+                            '/v1/me/top/tracks')
+
+    def _top_artista(self, coincidencia, query, cuerpo, cabeceras):
+        artista = {'id': coincidencia['id'], 'name': f"Artista {coincidencia['id'][:6]}"}
+        return {'tracks': [_cancion(coincidencia['id'], i, artista) for i in range(10)]}
+
+    def _recomendaciones(self, coincidencia, query, cuerpo, cabeceras):
+        limite = int(query.get('limit', ['20'])[0])
+        semillas = query.get('seed_tracks', [''])[0]
+        artista = _artista(int(_id(semillas)[:4], 16) % 500)
+        return {'tracks': [_cancion(f'rec-{semillas}', i, artista) for i in range(limite)]}
+
+    def _crear_playlist(self, coincidencia, query, cuerpo, cabeceras):
+        id_ = _id('playlist', coincidencia['id'], time.time_ns())
+        with self._lock:
+            self._playlists[id_] = []
+        return {'id': id_, 'external_urls': {'spotify': f'https://open.spotify.com/playlist/{id_}'}}
+
+    def _anadir_canciones(self, coincidencia, query, cuerpo, cabeceras):
+        # spotipy manda la lista de URIs como cuerpo y la posición en la query
+        datos = json.loads(cuerpo or b'[]')
+        uris = datos.get('uris', []) if isinstance(datos, dict) else datos
+        if len(uris) > 100:
+            raise ValueError('Too many ids requested')
+        with self._lock:
+            canciones = self._playlists.setdefault(coincidencia['id'], [])
+            posicion = query.get('position', [None])[0]
+            if isinstance(datos, dict):
+                posicion = datos.get('position', posicion)
+            posicion = len(canciones) if posicion is None else int(posicion)
+            if posicion > len(canciones):
+                raise ValueError('Index out of bounds')
+            canciones[posicion:posicion] = uris
+        return {'snapshot_id': _id('snapshot', coincidencia['id'], len(canciones))}
+
+    def _token(self, coincidencia, query, cuerpo, cabeceras):
+        usuario = parse_qs(cuerpo.decode()).get('refresh_token', ['refresh-anonimo'])[0].rpartition('refresh-')[2]
+        return {'access_token': f'token-{usuario}', 'token_type': 'Bearer', 'expires_in': 3600,
+                'scope': 'user-top-read playlist-modify-public'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--puerto', type=int, default=9000)
+    parser.add_argument('--latencia-ms', type=float, default=50.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--tasa-error', type=float, default=0.0)
+    parser.add_argument('--tasa-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    servidor = SpotifyFalso(args.puerto, args.latencia_ms, args.jitter_ms, args.tasa_error, args.tasa_429,
+                            args.retry_after).arrancar()
+    print(f"Spotify falso escuchando en {servidor.url} (Ctrl+C para parar)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.parar()
+
+
+if __name__ == '__main__':
+    main()
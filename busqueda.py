@@ -0,0 +1,225 @@
+"""
+Búsqueda de hiperparámetros del modelo de sentimientos con validación cruzada.
+
+    python busqueda.py --top-n 500 1250 2500 --oculta 32 64 128 --alpha 0.001 0.01 0.1 --pliegues 5
+
+El preprocesado se hace una sola vez: el corpus limpio (corpus.py) y, para
+cada pliegue y tamaño de vocabulario, el vectorizador y las matrices TF-IDF de
+entrenamiento y validación se guardan en TRAINING_CACHE_DIR bajo el checksum de
+'train.tsv', así que las combinaciones que solo cambian el MLP (y las búsquedas
+siguientes sobre los mismos datos) no vuelven a limpiar ni a vectorizar. Cada
+combinación (top_n, capa oculta, alpha) × pliegue se entrena en un pool de
+procesos que usa todos los núcleos, cada uno con un solo hilo de BLAS.
+
+Informa de la precisión media entre pliegues, la latencia de predecir un texto
+con MotorInferencia (lo que paga la app en cada petición) y el tiempo de
+entrenamiento; marca el frente de Pareto precisión/latencia y recomienda la
+combinación más rápida que llega a --precision-minima. La configuración del
+bundle actual (o la de modelo.py si no hay bundle) se evalúa siempre en los
+mismos pliegues, y su precisión es la mínima por defecto: sin el flag nunca se
+recomienda un modelo peor que el que ya se usa.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import LabelEncoder
+
+from corpus import CACHE_DIR, Corpus, directorio_datos, preparar_corpus
+from inferencia import MotorInferencia
+from modelo import ALPHA, BUNDLE_PATH, DATA_PATH, HIDDEN_LAYER_SIZES, TOP_N, cargar_bundle, crear_clasificador
+from vocabulario import SPANISH_STOPWORDS, IndiceVocabulario
+
+# Textos de validación con los que se mide la latencia de inferencia de cada modelo
+TEXTOS_LATENCIA = 200
+
+# Artefactos ya leídos en cada proceso del pool
+_cargados = {}
+
+
+def _guardar(objeto, ruta):
+    # Escritura atómica: otro proceso nunca lee un artefacto a medias
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    joblib.dump(objeto, tmp)
+    os.replace(tmp, ruta)
+
+def _cargar(ruta):
+    if ruta not in _cargados:
+        _cargados.clear()
+        _cargados[ruta] = joblib.load(ruta)
+    return _cargados[ruta]
+
+def ruta_pliegue(directorio, pliegues, pliegue, top_n):
+    return os.path.join(directorio, f'pliegue{pliegue}de{pliegues}-top{top_n}.joblib')
+
+def preparar_pliegue(directorio_corpus, directorio, pliegues, pliegue, tamanos_vocabulario, semilla=42):
+    """
+    Vectoriza el pliegue para cada top_n que falte en la caché. El índice de
+    vocabulario del pliegue se construye una vez y sirve para todos los top_n.
+    """
+    pendientes = [n for n in tamanos_vocabulario if not os.path.exists(ruta_pliegue(directorio, pliegues, pliegue, n))]
+    if not pendientes:
+        return
+    corpus = Corpus.abrir(directorio_corpus)
+    textos = np.asarray(corpus.textos(), dtype=object)
+    etiquetas = corpus.etiquetas_texto()
+    division = StratifiedKFold(n_splits=pliegues, shuffle=True, random_state=semilla)
+    entrenamiento, validacion = list(division.split(textos, etiquetas))[pliegue]
+    codificador = LabelEncoder().fit(etiquetas)
+    # El vocabulario sale solo de la parte de entrenamiento del pliegue
+    indice = IndiceVocabulario.desde_textos(textos[entrenamiento], etiquetas[entrenamiento])
+    for top_n in pendientes:
+        vectorizer = TfidfVectorizer(vocabulary=indice.top_por_etiqueta(top_n, stopwords=SPANISH_STOPWORDS))
+        _guardar({
+            'vectorizer': vectorizer,
+            'clases': codificador.classes_,
+            'X_entrenamiento': vectorizer.fit_transform(textos[entrenamiento]),
+            'y_entrenamiento': codificador.transform(etiquetas[entrenamiento]),
+            'X_validacion': vectorizer.transform(textos[validacion]),
+            'y_validacion': codificador.transform(etiquetas[validacion]),
+            'textos_validacion': textos[validacion][:TEXTOS_LATENCIA].tolist(),
+        }, ruta_pliegue(directorio, pliegues, pliegue, top_n))
+
+def latencia_inferencia(motor, textos, rondas=3):
+    """Mejor tiempo medio (µs) de motor.predecir por texto en `rondas` pasadas."""
+    mejor = float('inf')
+    for _ in range(rondas):
+        inicio = time.perf_counter()
+        for texto in textos:
+            motor.predecir(texto)
+        mejor = min(mejor, (time.perf_counter() - inicio) / max(len(textos), 1))
+    return mejor * 1e6
+
+def evaluar(ruta, oculta, alpha):
+    """Entrena un MLP en el pliegue de `ruta` y devuelve su precisión, latencia y tiempo de entrenamiento."""
+    datos = _cargar(ruta)
+    mlp = crear_clasificador(tuple(oculta), alpha)
+    inicio = time.perf_counter()
+    mlp.fit(datos['X_entrenamiento'], datos['y_entrenamiento'])
+    segundos = time.perf_counter() - inicio
+    precision = float(np.mean(mlp.predict(datos['X_validacion']) == datos['y_validacion']))
+    codificador = LabelEncoder()
+    codificador.classes_ = datos['clases']
+    motor = MotorInferencia.desde_sklearn(datos['vectorizer'], mlp, codificador)
+    return precision, latencia_inferencia(motor, datos['textos_validacion']), segundos
+
+def _inicializar_proceso():
+    # Un hilo de BLAS por proceso: el paralelismo lo pone el pool
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+
+def configuracion_actual(bundle_path=BUNDLE_PATH, data_path=DATA_PATH):
+    """(top_n, capa oculta, alpha) del bundle actual, o los de modelo.py si no hay bundle al día."""
+    bundle = cargar_bundle(bundle_path, data_path)
+    hiperparametros = (bundle or {}).get('hiperparametros') or {}
+    return (hiperparametros.get('top_n', TOP_N), list(hiperparametros.get('hidden_layer_sizes', HIDDEN_LAYER_SIZES)),
+            hiperparametros.get('alpha', ALPHA))
+
+def buscar(tamanos_vocabulario, ocultas, alphas, pliegues=5, procesos=None, data_path=DATA_PATH, cache_dir=CACHE_DIR,
+           actual=None):
+    """
+    Devuelve una lista de resultados (dict) por combinación, con las medias
+    entre pliegues. La combinación `actual` (top_n, capa oculta, alpha) se
+    evalúa aunque no esté en la rejilla y se marca con 'actual'.
+    """
+    inicio = time.perf_counter()
+    corpus = preparar_corpus(data_path, cache_dir)
+    directorio = directorio_datos(corpus.checksum, cache_dir)
+    combinaciones = list(itertools.product(tamanos_vocabulario, ocultas, alphas))
+    if actual is not None:
+        actual = (actual[0], tuple(actual[1]), actual[2])
+        if actual not in [(top_n, tuple(oculta), alpha) for top_n, oculta, alpha in combinaciones]:
+            combinaciones.append(actual)
+            tamanos_vocabulario = sorted(set(tamanos_vocabulario) | {actual[0]})
+    with ProcessPoolExecutor(max_workers=procesos or os.cpu_count(), initializer=_inicializar_proceso) as pool:
+        list(pool.map(preparar_pliegue, itertools.repeat(corpus.directorio), itertools.repeat(directorio),
+                      itertools.repeat(pliegues), range(pliegues), itertools.repeat(tamanos_vocabulario)))
+        print(f"Corpus y matrices TF-IDF listos en {time.perf_counter() - inicio:.1f} s; "
+              f"entrenando {len(combinaciones)} combinaciones × {pliegues} pliegues...")
+        # Ordenadas por pliegue y top_n para que cada proceso reutilice el artefacto que ya tiene leído
+        tareas = [(ruta_pliegue(directorio, pliegues, p, top_n), oculta, alpha, (top_n, tuple(oculta), alpha))
+                  for p in range(pliegues) for top_n, oculta, alpha in combinaciones]
+        medidas = pool.map(evaluar, *zip(*[t[:3] for t in tareas]))
+        por_combinacion = {}
+        for tarea, medida in zip(tareas, medidas):
+            por_combinacion.setdefault(tarea[3], []).append(medida)
+
+    resultados = []
+    for (top_n, oculta, alpha), medidas in por_combinacion.items():
+        precisiones, latencias, segundos = map(np.array, zip(*medidas))
+        resultados.append({
+            'top_n': top_n, 'oculta': list(oculta), 'alpha': alpha,
+            'precision': float(precisiones.mean()), 'precision_std': float(precisiones.std()),
+            'latencia_us': float(np.median(latencias)), 'entrenamiento_s': float(segundos.mean()),
+            'actual': (top_n, oculta, alpha) == actual,
+        })
+    for r in resultados:
+        # En el frente de Pareto si ninguna otra es a la vez más precisa y más rápida
+        r['pareto'] = not any(o is not r and o['precision'] >= r['precision'] and o['latencia_us'] <= r['latencia_us']
+                              and (o['precision'] > r['precision'] or o['latencia_us'] < r['latencia_us'])
+                              for o in resultados)
+    resultados.sort(key=lambda r: (-r['precision'], r['latencia_us']))
+    print(f"Búsqueda terminada en {time.perf_counter() - inicio:.1f} s.")
+    return resultados
+
+def recomendar(resultados, precision_minima):
+    """La combinación más rápida que llega a `precision_minima`, o la más precisa si ninguna llega."""
+    validas = [r for r in resultados if r['precision'] >= precision_minima]
+    if not validas:
+        return max(resultados, key=lambda r: r['precision'])
+    return min(validas, key=lambda r: (r['latencia_us'], -r['precision']))
+
+def informe(resultados, recomendada):
+    print(f"\n{'top_n':>6} {'oculta':>10} {'alpha':>8} {'precisión':>16} {'latencia µs':>12} {'entreno s':>10}")
+    for r in resultados:
+        marca = ' *' if r['pareto'] else ''
+        marca += ' =' if r['actual'] else ''
+        marca += ' <-' if r is recomendada else ''
+        oculta = ','.join(map(str, r['oculta']))
+        print(f"{r['top_n']:>6} {oculta:>10} {r['alpha']:>8g} {r['precision']:>9.4f} ±{r['precision_std']:.4f} "
+              f"{r['latencia_us']:>12.1f} {r['entrenamiento_s']:>10.2f}{marca}")
+    print("\n* frente de Pareto precisión/latencia, = configuración actual, <- recomendada")
+    oculta = ' '.join(map(str, recomendada['oculta']))
+    print(f"Para usarla: python modelo.py construir --forzar --top-n {recomendada['top_n']} "
+          f"--oculta {oculta} --alpha {recomendada['alpha']:g}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top-n', type=int, nargs='+', default=[500, TOP_N, 2500],
+                        help="tamaños de vocabulario (palabras por etiqueta)")
+    parser.add_argument('--oculta', type=int, nargs='+', default=[32, HIDDEN_LAYER_SIZES[0], 128],
+                        help="neuronas de la capa oculta")
+    parser.add_argument('--alpha', type=float, nargs='+', default=[0.001, ALPHA, 0.1], help="regularización L2")
+    parser.add_argument('--pliegues', type=int, default=5)
+    parser.add_argument('--procesos', type=int, default=None, help="por defecto, todos los núcleos")
+    parser.add_argument('--precision-minima', type=float, default=None,
+                        help="precisión media mínima para recomendar la combinación más rápida "
+                             "(por defecto, la de la configuración actual)")
+    parser.add_argument('--guardar', help="fichero JSON donde guardar los resultados")
+    args = parser.parse_args(argv)
+
+    actual = configuracion_actual()
+    resultados = buscar(args.top_n, [[n] for n in args.oculta], args.alpha, args.pliegues, args.procesos, actual=actual)
+    precision_minima = args.precision_minima
+    if precision_minima is None:
+        precision_minima = next(r['precision'] for r in resultados if r['actual'])
+        print(f"Precisión mínima: {precision_minima:.4f}, la de la configuración actual.")
+    recomendada = recomendar(resultados, precision_minima)
+    informe(resultados, recomendada)
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump({'resultados': resultados, 'recomendada': recomendada}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,310 @@
+"""
+Cachés con caducidad (TTL) y límite de entradas.
+
+Hay dos backends con la misma interfaz:
+
+- CacheMemoria: un OrderedDict por proceso, el más rápido.
+- CacheSQLite: un archivo SQLite compartido por todos los workers de gunicorn
+  de la máquina, para que una entrada guardada por un worker sirva a los demás.
+  Las lecturas no escriben y el límite de entradas se aplica por lotes.
+
+CacheCatalogo envuelve cualquiera de los dos para los datos de catálogo de
+Spotify (iguales para todos los usuarios de un mercado) y cuenta aciertos y
+fallos. CacheUsuario guarda los datos de cada sesión (perfil, canciones y
+artistas principales) para no repetir llamadas al navegar entre páginas.
+CachePredicciones guarda el resultado del clasificador por texto normalizado.
+
+ConexionSQLite da la conexión por hilo y por proceso de CacheSQLite, y la
+reutilizan los demás almacenes SQLite de la app (trabajos.py,
+planificador.py, retroalimentacion.py).
+"""
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_NO_ENCONTRADO = object()
+
+
+class CacheMemoria:
+    """Caché en memoria del proceso con TTL y expulsión LRU."""
+
+    def __init__(self, max_entradas=1024, ttl=3600):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, default=None):
+        with self._lock:
+            entrada = self._datos.get(clave, _NO_ENCONTRADO)
+            if entrada is _NO_ENCONTRADO:
+                return default
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return default
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, ttl=None):
+        expira = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def borrar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def borrar_prefijo(self, prefijo):
+        """Borra todas las entradas cuya clave empiece por `prefijo`."""
+        with self._lock:
+            for clave in [c for c in self._datos if c.startswith(prefijo)]:
+                del self._datos[clave]
+
+    def purgar(self):
+        """Borra las entradas caducadas y devuelve cuántas había."""
+        ahora = time.monotonic()
+        with self._lock:
+            caducadas = [c for c, (expira, _) in self._datos.items() if expira < ahora]
+            for clave in caducadas:
+                del self._datos[clave]
+        return len(caducadas)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class ConexionSQLite:
+    """
+    Mixin para las clases que guardan su estado en el archivo SQLite `self.path`:
+    _conexion() da una conexión en modo WAL y autocommit por hilo y por proceso
+    (las conexiones no sobreviven a un fork). La clase crea `self._local =
+    threading.local()` antes de usarla.
+    """
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+
+class CacheSQLite(ConexionSQLite):
+    """
+    Caché con TTL guardada en un archivo SQLite.
+
+    Las claves deben ser str y los valores serializables a JSON. Varios procesos
+    pueden usar el mismo archivo a la vez (modo WAL). Leer no escribe nada: las
+    entradas caducadas se ignoran y se borran al purgar. El límite de entradas
+    se comprueba una vez cada `expulsar_cada` escrituras de cada proceso (no en
+    todas), borrando primero las caducadas y después las escritas hace más
+    tiempo, así que puede superarse temporalmente en unas pocas entradas.
+    """
+
+    def __init__(self, path, max_entradas=10000, ttl=3600, tabla='cache', expulsar_cada=100):
+        self.path = path
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.tabla = tabla
+        self.expulsar_cada = max(1, expulsar_cada)
+        self._escrituras = itertools.count(1)
+        self._local = threading.local()
+        with self._conexion() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {tabla} ("
+                         "clave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira REAL NOT NULL, accedido REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {tabla}_accedido ON {tabla} (accedido)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {tabla}_expira ON {tabla} (expira)")
+
+    def obtener(self, clave, default=None):
+        fila = self._conexion().execute(
+            f"SELECT valor FROM {self.tabla} WHERE clave = ? AND expira >= ?", (clave, time.time())).fetchone()
+        if fila is None:
+            return default
+        return json.loads(fila[0])
+
+    def guardar(self, clave, valor, ttl=None):
+        ahora = time.time()
+        expira = ahora + (self.ttl if ttl is None else ttl)
+        self._conexion().execute(
+            f"INSERT OR REPLACE INTO {self.tabla} (clave, valor, expira, accedido) VALUES (?, ?, ?, ?)",
+            (clave, json.dumps(valor), expira, ahora))
+        if next(self._escrituras) % self.expulsar_cada == 0:
+            self._expulsar(ahora)
+
+    def _expulsar(self, ahora):
+        """Borra las caducadas y, si aún sobran, las escritas hace más tiempo."""
+        conn = self._conexion()
+        conn.execute(f"DELETE FROM {self.tabla} WHERE expira < ?", (ahora,))
+        sobrantes = conn.execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0] - self.max_entradas
+        if sobrantes > 0:
+            conn.execute(f"DELETE FROM {self.tabla} WHERE clave IN "
+                         f"(SELECT clave FROM {self.tabla} ORDER BY accedido LIMIT ?)", (sobrantes,))
+
+    def borrar(self, clave):
+        self._conexion().execute(f"DELETE FROM {self.tabla} WHERE clave = ?", (clave,))
+
+    def borrar_prefijo(self, prefijo):
+        """Borra todas las entradas cuya clave empiece por `prefijo`."""
+        # Rango [prefijo, prefijo + U+10FFFF) en lugar de LIKE para no escapar comodines
+        self._conexion().execute(f"DELETE FROM {self.tabla} WHERE clave >= ? AND clave < ?",
+                                 (prefijo, prefijo + '\U0010ffff'))
+
+    def purgar(self):
+        """Borra las entradas caducadas y devuelve cuántas había."""
+        return self._conexion().execute(f"DELETE FROM {self.tabla} WHERE expira < ?", (time.time(),)).rowcount
+
+    def limpiar(self):
+        self._conexion().execute(f"DELETE FROM {self.tabla}")
+
+    def __len__(self):
+        return self._conexion().execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0]
+
+
+def crear_backend(nombre, path, max_entradas, ttl, tabla='cache'):
+    """Crea el backend de caché indicado por configuración ('memoria' o 'sqlite')."""
+    if nombre == 'memoria':
+        return CacheMemoria(max_entradas=max_entradas, ttl=ttl)
+    if nombre == 'sqlite':
+        return CacheSQLite(path, max_entradas=max_entradas, ttl=ttl, tabla=tabla)
+    raise ValueError(f"Backend de caché desconocido: {nombre}")
+
+
+class CacheCatalogo:
+    """Caché de consultas de catálogo de Spotify con clave (endpoint, id, mercado)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, endpoint, id_, mercado, cargar):
+        """Devuelve el valor cacheado o llama a `cargar()` y lo guarda si no está."""
+        clave = f"{endpoint}|{id_}|{mercado or ''}"
+        valor = self.backend.obtener(clave, _NO_ENCONTRADO)
+        if valor is not _NO_ENCONTRADO:
+            with self._lock:
+                self.aciertos += 1
+            return valor
+        with self._lock:
+            self.fallos += 1
+        valor = cargar()
+        self.backend.guardar(clave, valor)
+        return valor
+
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        return {
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': self.aciertos / total if total else 0.0,
+            'entradas': len(self.backend),
+        }
+
+
+class CacheUsuario:
+    """Caché por sesión de usuario con clave (id de sesión, recurso) e invalidación explícita."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def obtener(self, id_sesion, recurso, cargar):
+        """Devuelve el recurso cacheado de la sesión o llama a `cargar()` y lo guarda."""
+        clave = f"{id_sesion}|{recurso}"
+        valor = self.backend.obtener(clave, _NO_ENCONTRADO)
+        if valor is _NO_ENCONTRADO:
+            valor = cargar()
+            self.backend.guardar(clave, valor)
+        return valor
+
+    def invalidar(self, id_sesion):
+        """Borra todo lo cacheado para la sesión (al cerrar sesión)."""
+        if id_sesion:
+            self.backend.borrar_prefijo(f"{id_sesion}|")
+
+
+class CachePredicciones:
+    """
+    Caché de predicciones del clasificador con clave el texto ya normalizado
+    (limpiar_tweet), así que las variantes de mayúsculas, espacios, URLs o
+    menciones comparten entrada. Cada modelo cargado es una generación nueva:
+    invalidar() descarta lo anterior y una predicción hecha con el modelo viejo
+    que termine después no se guarda con la generación nueva.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, texto_limpio, cargar):
+        """Devuelve la predicción cacheada para el texto o llama a `cargar()` y la guarda."""
+        clave = (self.generacion, texto_limpio)
+        valor = self.backend.obtener(clave, _NO_ENCONTRADO)
+        if valor is not _NO_ENCONTRADO:
+            with self._lock:
+                self.aciertos += 1
+            return valor
+        with self._lock:
+            self.fallos += 1
+        valor = cargar()
+        self.backend.guardar(clave, valor)
+        return valor
+
+    def invalidar(self):
+        """Descarta todas las predicciones (al cargar un modelo nuevo)."""
+        with self._lock:
+            self.generacion += 1
+        self.backend.limpiar()
+
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        return {
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': self.aciertos / total if total else 0.0,
+            'entradas': len(self.backend),
+            'generacion': self.generacion,
+        }
+
+
+# Caché de catálogo compartida por toda la app
+CATALOG_CACHE_BACKEND = os.getenv('CATALOG_CACHE_BACKEND', 'sqlite')
+CATALOG_CACHE_PATH = os.getenv('CATALOG_CACHE_PATH', os.path.join(BASE_DIR, 'cache_catalogo.sqlite3'))
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', str(6 * 3600)))
+CATALOG_CACHE_MAX = int(os.getenv('CATALOG_CACHE_MAX', '5000'))
+
+catalogo = CacheCatalogo(crear_backend(CATALOG_CACHE_BACKEND, CATALOG_CACHE_PATH, CATALOG_CACHE_MAX, CATALOG_CACHE_TTL))
+
+# Caché de datos por sesión de usuario; compartida por defecto porque la página siguiente o el
+# trabajo de playlist pueden caer en otro worker ('memoria' solo sirve con uno)
+USER_CACHE_BACKEND = os.getenv('USER_CACHE_BACKEND', 'sqlite')
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+USER_CACHE_MAX = int(os.getenv('USER_CACHE_MAX', '2000'))
+
+usuarios = CacheUsuario(crear_backend(USER_CACHE_BACKEND, CATALOG_CACHE_PATH, USER_CACHE_MAX, USER_CACHE_TTL,
+                                      tabla='cache_usuarios'))
+
+# Caché de predicciones del clasificador (en memoria: las claves son tuplas y la predicción es barata)
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', '3600'))
+PREDICTION_CACHE_MAX = int(os.getenv('PREDICTION_CACHE_MAX', '10000'))
+
+predicciones = CachePredicciones(CacheMemoria(max_entradas=PREDICTION_CACHE_MAX, ttl=PREDICTION_CACHE_TTL))
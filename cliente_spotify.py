@@ -0,0 +1,235 @@
+"""
+Fábrica de clientes de Spotify.
+
+Cada proceso mantiene una sola requests.Session con keep-alive, un pool de
+conexiones dimensionado para el fan-out de playlist.py y reintentos con
+backoff para 429/5xx, y un único SpotifyOAuth. Los clientes por usuario son
+objetos ligeros que solo llevan el token de acceso y reutilizan esa sesión,
+así que las peticiones ya no pagan un handshake TLS nuevo cada vez. Las
+llamadas a la API esperan su turno en el planificador (planificador.py).
+
+Un POST (crear una playlist, añadir canciones) solo se reintenta tras un 429,
+que Spotify no ha aplicado: un 5xx puede llegar después de que la escritura se
+hiciera y repetirla la duplicaría. El Retry-After de un 429 se respeta entero;
+si pide esperar más de SPOTIFY_RETRY_AFTER_MAX no se reintenta y el 429 (con
+su Retry-After) llega a quien llama como SpotifyException.
+"""
+import os
+import threading
+
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+import metricas
+from planificador import planificador
+
+CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
+CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
+REDIRECT_URI = os.getenv('REDIRECT_URI')
+SCOPE = 'user-top-read playlist-modify-public'
+
+# URLs base de la API y del servicio de cuentas; se cambian para apuntar a un
+# servidor local que imita a Spotify (benchmarks/spotify_falso.py)
+SPOTIFY_API_PREFIX = os.getenv('SPOTIFY_API_PREFIX', 'https://api.spotify.com/v1/')
+SPOTIFY_ACCOUNTS_URL = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+
+# Tiempo máximo (segundos) de cada llamada HTTP a la API de Spotify
+SPOTIFY_TIMEOUT = float(os.getenv('SPOTIFY_TIMEOUT', '5'))
+# Conexiones abiertas por host (api.spotify.com, accounts.spotify.com); al menos tantas como hilos de fan-out
+SPOTIFY_POOL_MAXSIZE = int(os.getenv('SPOTIFY_POOL_MAXSIZE', '16'))
+SPOTIFY_RETRIES = int(os.getenv('SPOTIFY_RETRIES', '3'))
+SPOTIFY_BACKOFF = float(os.getenv('SPOTIFY_BACKOFF', '0.3'))
+# Espera máxima (segundos) de un Retry-After que se cumple dentro de la misma petición; si Spotify
+# pide más, no se reintenta y quien llama recibe el 429 con su Retry-After
+SPOTIFY_RETRY_AFTER_MAX = float(os.getenv('SPOTIFY_RETRY_AFTER_MAX', '5'))
+# Métodos que se pueden repetir tras un 5xx; el resto (POST) solo tras un 429
+_METODOS_REPETIBLES = frozenset(['GET', 'PUT', 'DELETE'])
+
+
+class _RetrySpotify(Retry):
+    """Retry que no repite escrituras tras un 5xx y no acorta el Retry-After de Spotify."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() not in _METODOS_REPETIBLES and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and response.status == 429:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > SPOTIFY_RETRY_AFTER_MAX:
+                # Con raise_on_status=False urllib3 devuelve este 429 en lugar de lanzar
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After de {retry_after:g} s"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class _RetryPlanificado(_RetrySpotify):
+    """
+    Como _RetrySpotify, pero cada 429 con Retry-After pausa todas las llamadas
+    a la API y cada reintento espera su turno y toma su ficha en el planificador
+    (planificador.py), como la primera petición.
+
+    Cada 429 pausa una sola vez: aquí si se va a reintentar y, si no,
+    _AdaptadorPlanificado al recibirlo.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # Si no se reintenta, lanza MaxRetryError y urllib3 devuelve el 429 al adaptador
+        nuevo = super().increment(method, url, response, error, _pool, _stacktrace)
+        if response is not None and response.status == 429:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None:
+                planificador.pausar(retry_after)
+        return nuevo
+
+    def sleep_for_retry(self, response):
+        # La espera del Retry-After la cumple planificador.adquirir() en sleep()
+        return self.get_retry_after(response) is not None
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        planificador.adquirir()
+
+
+class _AdaptadorPlanificado(HTTPAdapter):
+    """Adaptador de la API de Spotify: cada petición espera su turno en el planificador antes de salir."""
+
+    def send(self, request, **kwargs):
+        planificador.adquirir()
+        respuesta = super().send(request, **kwargs)
+        if respuesta.status_code == 429:
+            # 429 que ya no se reintenta (los reintentados los pausa _RetryPlanificado.increment):
+            # que las demás peticiones no choquen también con el límite
+            try:
+                planificador.pausar(float(respuesta.headers.get('Retry-After')))
+            except (TypeError, ValueError):
+                pass
+        return respuesta
+
+
+class _SinCache(CacheHandler):
+    """
+    El token de cada usuario vive en su sesión, no en el gestor OAuth: como el
+    gestor es compartido, no debe recordar el token de nadie.
+    """
+
+    def get_cached_token(self):
+        return None
+
+    def save_token_to_cache(self, token_info):
+        pass
+
+
+class _ClienteSpotify(spotipy.Spotify):
+    """Cliente por usuario que no cierra la sesión HTTP compartida al destruirse."""
+
+    def __del__(self):
+        pass
+
+
+class _TokenRenovable:
+    """auth_manager de spotipy que pide el token a `obtener_token()` antes de cada llamada."""
+
+    def __init__(self, obtener_token):
+        self.obtener_token = obtener_token
+
+    def get_access_token(self, as_dict=False):
+        token_info = self.obtener_token()
+        return token_info if as_dict else token_info['access_token']
+
+
+_lock = threading.RLock()
+_sesion = None
+_oauth = None
+
+
+def _crear_retry(clase):
+    return clase(
+        total=SPOTIFY_RETRIES,
+        connect=None,
+        read=False,
+        status=SPOTIFY_RETRIES,
+        backoff_factor=SPOTIFY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # POST solo tras un 429 (_RetrySpotify.is_retry)
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        respect_retry_after_header=True,
+        # Al agotar los reintentos devolver la última respuesta (con su Retry-After)
+        # para que spotipy lance SpotifyException con las cabeceras
+        raise_on_status=False,
+    )
+
+def _crear_sesion():
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SPOTIFY_POOL_MAXSIZE,
+                          max_retries=_crear_retry(_RetrySpotify))
+    sesion = requests.Session()
+    sesion.mount('https://', adapter)
+    sesion.mount('http://', adapter)
+    # Las llamadas a la API (no las de accounts) pasan por el planificador
+    sesion.mount(SPOTIFY_API_PREFIX, _AdaptadorPlanificado(pool_connections=1, pool_maxsize=SPOTIFY_POOL_MAXSIZE,
+                                                           max_retries=_crear_retry(_RetryPlanificado)))
+    # Latencia, 429 y errores de cada llamada (metricas.py)
+    sesion.hooks['response'].append(metricas.registrar_respuesta_spotify)
+    return sesion
+
+def sesion_http():
+    """Sesión HTTP compartida por todo el proceso (se crea en el primer uso)."""
+    global _sesion
+    if _sesion is None:
+        with _lock:
+            if _sesion is None:
+                _sesion = _crear_sesion()
+    return _sesion
+
+def oauth():
+    """Gestor OAuth único del proceso."""
+    global _oauth
+    if _oauth is None:
+        with _lock:
+            if _oauth is None:
+                gestor = SpotifyOAuth(
+                    client_id=CLIENT_ID,
+                    client_secret=CLIENT_SECRET,
+                    redirect_uri=REDIRECT_URI,
+                    scope=SCOPE,
+                    cache_handler=_SinCache(),
+                    requests_session=sesion_http(),
+                    requests_timeout=SPOTIFY_TIMEOUT,
+                    show_dialog=True  # Forzar que siempre muestre el diálogo de login
+                )
+                gestor.OAUTH_AUTHORIZE_URL = f"{SPOTIFY_ACCOUNTS_URL}/authorize"
+                gestor.OAUTH_TOKEN_URL = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
+                _oauth = gestor
+    return _oauth
+
+def cliente(token_info):
+    """Cliente de Spotify para un usuario, ligado a la sesión HTTP compartida."""
+    sp = _ClienteSpotify(auth=token_info['access_token'], requests_session=sesion_http(),
+                         requests_timeout=SPOTIFY_TIMEOUT)
+    sp.prefix = SPOTIFY_API_PREFIX
+    return sp
+
+def cliente_renovable(obtener_token):
+    """
+    Cliente para los trabajos en segundo plano: cada llamada usa el token_info
+    que devuelve `obtener_token()`, así que un trabajo largo sigue funcionando
+    cuando el token con el que empezó caduca.
+    """
+    sp = _ClienteSpotify(auth_manager=_TokenRenovable(obtener_token), requests_session=sesion_http(),
+                         requests_timeout=SPOTIFY_TIMEOUT)
+    sp.prefix = SPOTIFY_API_PREFIX
+    return sp
+
+def _reiniciar_tras_fork():
+    # Los sockets abiertos no se pueden compartir entre procesos: cada worker crea los suyos
+    global _lock, _sesion, _oauth
+    _lock = threading.RLock()
+    _sesion = None
+    _oauth = None
+
+os.register_at_fork(after_in_child=_reiniciar_tras_fork)
@@ -0,0 +1,219 @@
+"""
+Corpus de entrenamiento preparado una sola vez y guardado en columnas.
+
+Leer 'train.tsv' con pandas, quedarse con las etiquetas que usa el modelo y
+limpiar cada tweet se hace una vez por versión de los datos: el resultado se
+guarda en TRAINING_CACHE_DIR, bajo el SHA-256 del fichero, como arrays de
+NumPy sin cabecera que los entrenamientos y evaluaciones abren con mmap:
+
+- textos.bin: los tweets limpios en UTF-8, uno por línea (limpiar_tweet no
+  deja saltos de línea).
+- inicios.bin: int64 con el byte donde empieza cada tweet, más el final.
+- etiquetas.bin: int8 con la posición de la etiqueta en 'clases'.
+- manifiesto.json: checksum, filas, bytes, clases y versión del formato.
+
+El TSV se lee por bloques de CORPUS_CHUNK_ROWS filas, así que preparar un
+corpus mucho mayor no necesita tenerlo entero en memoria. Mientras el tamaño y
+la fecha de modificación del fichero no cambien ni siquiera se recalcula el
+checksum.
+
+    python modelo.py preparar
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from texto import limpiar_serie
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(BASE_DIR, 'train.tsv')
+CACHE_DIR = os.getenv('TRAINING_CACHE_DIR', os.path.join(BASE_DIR, '.cache_entrenamiento'))
+# Filas del TSV que se leen y limpian de cada vez
+CORPUS_CHUNK_ROWS = int(os.getenv('CORPUS_CHUNK_ROWS', '100000'))
+
+# Etiquetas con las que se entrena el modelo, tal y como aparecen en 'train.tsv'
+ETIQUETAS = ('joy ', 'sadness ', 'anger ')
+
+# Incrementar cuando cambie la limpieza o el formato de los ficheros
+CORPUS_VERSION = 1
+
+
+def _huella(data_path):
+    estado = os.stat(data_path)
+    return [estado.st_size, estado.st_mtime_ns]
+
+def _ruta_fuente(data_path, cache_dir):
+    clave = hashlib.sha1(os.path.abspath(data_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'fuente-{clave}.json')
+
+def checksum_datos(data_path, cache_dir=CACHE_DIR):
+    """
+    SHA-256 del archivo de entrenamiento, o None si no existe. Si el archivo no
+    ha cambiado desde que se preparó su corpus, se devuelve el ya calculado.
+    """
+    if not os.path.exists(data_path):
+        return None
+    try:
+        with open(_ruta_fuente(data_path, cache_dir), encoding='utf-8') as f:
+            fuente = json.load(f)
+        if fuente['huella'] == _huella(data_path):
+            return fuente['checksum']
+    except (OSError, ValueError, KeyError):
+        pass
+    sha = hashlib.sha256()
+    with open(data_path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def directorio_datos(checksum, cache_dir=CACHE_DIR):
+    """Directorio de caché de una versión de los datos (el corpus y los artefactos de busqueda.py)."""
+    return os.path.join(cache_dir, checksum[:16])
+
+
+def _mapear(ruta, dtype, n):
+    # np.memmap no admite ficheros vacíos
+    if not n:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(ruta, dtype=dtype, mode='r', shape=(n,))
+
+
+class Corpus:
+    """Tweets limpios y etiquetas de un corpus preparado."""
+
+    def __init__(self, checksum, clases, textos, inicios, etiquetas, directorio=None):
+        self.checksum = checksum
+        self.clases = list(clases)
+        self.directorio = directorio
+        self._textos = textos
+        self._inicios = inicios
+        # Posición de cada etiqueta en self.clases
+        self.etiquetas = etiquetas
+
+    @classmethod
+    def abrir(cls, directorio):
+        """Abre con mmap un corpus ya preparado. Lanza OSError o ValueError si falta o no vale."""
+        with open(os.path.join(directorio, 'manifiesto.json'), encoding='utf-8') as f:
+            manifiesto = json.load(f)
+        if manifiesto.get('version') != CORPUS_VERSION:
+            raise ValueError(f"versión {manifiesto.get('version')} != {CORPUS_VERSION}")
+        filas = manifiesto['filas']
+        return cls(
+            manifiesto['checksum'], manifiesto['clases'],
+            _mapear(os.path.join(directorio, 'textos.bin'), np.uint8, manifiesto['bytes']),
+            _mapear(os.path.join(directorio, 'inicios.bin'), np.int64, filas + 1),
+            _mapear(os.path.join(directorio, 'etiquetas.bin'), np.int8, filas),
+            directorio)
+
+    def __len__(self):
+        return len(self.etiquetas)
+
+    def textos(self, indices=None):
+        """Lista de tweets limpios; `indices` (enteros o máscara booleana) elige algunas filas."""
+        if indices is None:
+            return bytes(self._textos).decode('utf-8').split('\n')[:-1]
+        datos, inicios = self._textos, self._inicios
+        return [bytes(datos[inicios[i]:inicios[i + 1] - 1]).decode('utf-8')
+                for i in np.arange(len(self))[indices]]
+
+    def etiquetas_texto(self, indices=None):
+        """Array con el nombre de la etiqueta de cada fila (o de las de `indices`)."""
+        codigos = self.etiquetas if indices is None else self.etiquetas[indices]
+        return np.asarray(self.clases, dtype=object)[codigos]
+
+
+def _leer_bloques(data_path, clases, tamano_bloque):
+    """Genera (tweets limpios, códigos de etiqueta) por cada bloque del TSV."""
+    import pandas as pd
+
+    codigos = {etiqueta: i for i, etiqueta in enumerate(clases)}
+    # dtype=str: que cada bloque no deduzca tipos distintos para la misma columna
+    for bloque in pd.read_csv(data_path, sep='\t', dtype=str, chunksize=tamano_bloque):
+        bloque.columns = [col.strip() for col in bloque.columns]
+        bloque = bloque[bloque['label'].isin(clases)]
+        yield limpiar_serie(bloque['tweet']).tolist(), bloque['label'].map(codigos).to_numpy(np.int8)
+
+def _escribir(data_path, directorio, checksum, clases, tamano_bloque):
+    # Se escribe en un directorio temporal y se renombra: nadie abre un corpus a medias
+    tmp = f"{directorio}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    filas = posicion = 0
+    with open(os.path.join(tmp, 'textos.bin'), 'wb') as f_textos, \
+            open(os.path.join(tmp, 'inicios.bin'), 'wb') as f_inicios, \
+            open(os.path.join(tmp, 'etiquetas.bin'), 'wb') as f_etiquetas:
+        for textos, codigos in _leer_bloques(data_path, clases, tamano_bloque):
+            partes = [(texto + '\n').encode('utf-8') for texto in textos]
+            longitudes = np.fromiter(map(len, partes), dtype=np.int64, count=len(partes))
+            (posicion + np.cumsum(longitudes) - longitudes).tofile(f_inicios)
+            f_textos.write(b''.join(partes))
+            codigos.tofile(f_etiquetas)
+            filas += len(partes)
+            posicion += int(longitudes.sum())
+        np.array([posicion], dtype=np.int64).tofile(f_inicios)
+    with open(os.path.join(tmp, 'manifiesto.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': CORPUS_VERSION, 'checksum': checksum, 'filas': filas, 'bytes': posicion,
+                   'clases': list(clases), 'origen': os.path.abspath(data_path), 'creado': time.time()},
+                  f, ensure_ascii=False)
+    try:
+        os.rename(tmp, directorio)
+    except OSError:
+        # Otro proceso lo ha preparado a la vez
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(directorio):
+            raise
+
+def _guardar_fuente(data_path, checksum, cache_dir):
+    ruta = _ruta_fuente(data_path, cache_dir)
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'origen': os.path.abspath(data_path), 'huella': _huella(data_path), 'checksum': checksum}, f)
+    os.replace(tmp, ruta)
+
+def _en_memoria(data_path, checksum, clases, tamano_bloque):
+    textos, codigos = [], []
+    for bloque, codigos_bloque in _leer_bloques(data_path, clases, tamano_bloque):
+        textos.extend(bloque)
+        codigos.append(codigos_bloque)
+    partes = [(texto + '\n').encode('utf-8') for texto in textos]
+    inicios = np.zeros(len(partes) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, partes), dtype=np.int64, count=len(partes)), out=inicios[1:])
+    return Corpus(checksum, clases, np.frombuffer(b''.join(partes), dtype=np.uint8), inicios,
+                  np.concatenate(codigos) if codigos else np.empty(0, dtype=np.int8))
+
+def preparar_corpus(data_path, cache_dir=CACHE_DIR, etiquetas=ETIQUETAS, tamano_bloque=CORPUS_CHUNK_ROWS):
+    """
+    Devuelve el Corpus de `data_path`, preparándolo solo si no está ya en la
+    caché para este contenido. Si no se puede escribir la caché, se prepara
+    en memoria. Lanza FileNotFoundError si no existe el archivo.
+    """
+    checksum = checksum_datos(data_path, cache_dir)
+    if checksum is None:
+        raise FileNotFoundError(data_path)
+    # Mismo orden que LabelEncoder: los códigos coinciden con los del modelo
+    clases = sorted(etiquetas)
+    directorio = os.path.join(directorio_datos(checksum, cache_dir), 'corpus')
+    try:
+        corpus = Corpus.abrir(directorio)
+        if corpus.clases == clases:
+            return corpus
+    except (OSError, ValueError, KeyError):
+        pass
+
+    print(f"Preparando el corpus de '{data_path}'...")
+    inicio = time.perf_counter()
+    try:
+        shutil.rmtree(directorio, ignore_errors=True)
+        os.makedirs(os.path.dirname(directorio), exist_ok=True)
+        _escribir(data_path, directorio, checksum, clases, tamano_bloque)
+        _guardar_fuente(data_path, checksum, cache_dir)
+        corpus = Corpus.abrir(directorio)
+    except OSError as e:
+        print(f"No se pudo guardar el corpus preparado en '{directorio}': {e}")
+        corpus = _en_memoria(data_path, checksum, clases, tamano_bloque)
+    print(f"Corpus preparado: {len(corpus)} tweets en {time.perf_counter() - inicio:.1f} s.")
+    return corpus
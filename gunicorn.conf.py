@@ -0,0 +1,99 @@
+"""
+Configuración de gunicorn para producción.
+
+El modelo se carga una sola vez en el proceso maestro (preload_app) y los
+workers lo heredan con fork. Los pesos vienen del motor exportado junto al
+bundle y mapeado en memoria, así que los workers comparten sus páginas en lugar
+de tener cada uno su copia.
+
+Cada worker vuelca sus métricas en METRICS_DIR para que /metrics muestre las de
+todos, lo atienda el worker que lo atienda (metricas.py).
+"""
+import gc
+import glob
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Hilos por worker: los streams SSE de /trabajos/<id>/eventos no deben ocupar un worker entero
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+
+# Avisar si un worker arranca usando más memoria propia (USS) que este límite
+WORKER_MAX_USS_MB = float(os.getenv('WORKER_MAX_USS_MB', '0'))
+
+# Antes de que preload_app importe la app (metricas.py lo lee al importarse)
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'metricas-gunicorn-{os.getpid()}'))
+
+
+def memoria_proceso(pid='self'):
+    """Devuelve RSS, PSS y USS (memoria privada) del proceso en MB, leídos de /proc."""
+    campos = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for linea in f:
+                partes = linea.split()
+                if len(partes) == 3 and partes[2] == 'kB':
+                    campos[partes[0].rstrip(':')] = int(partes[1]) / 1024
+    except OSError:
+        # Fuera de Linux no hay smaps_rollup: solo se puede informar del pico de RSS
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024}
+    return {
+        'rss': campos.get('Rss', 0.0),
+        'pss': campos.get('Pss', 0.0),
+        'uss': campos.get('Private_Clean', 0.0) + campos.get('Private_Dirty', 0.0),
+    }
+
+
+def _formatear(memoria):
+    return ', '.join(f"{clave.upper()} {valor:.1f} MB" for clave, valor in memoria.items())
+
+
+def on_starting(server):
+    # Los volcados de una ejecución anterior no se suman a los de esta
+    directorio = os.environ['METRICS_DIR']
+    os.makedirs(directorio, exist_ok=True)
+    for ruta in glob.glob(os.path.join(directorio, '*.json')):
+        os.remove(ruta)
+
+
+def when_ready(server):
+    server.log.info("Maestro listo con el modelo precargado: %s", _formatear(memoria_proceso()))
+
+
+def pre_fork(server, worker):
+    # Sacar los objetos ya creados (vocabulario, modelo) del recolector de basura
+    # para que no toque sus cabeceras y no rompa el copy-on-write en los hijos
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Hilos de la cola de trabajos: recogen los que quedaron pendientes antes de un reinicio
+    import metricas
+    import trabajos
+    trabajos.cola.arrancar()
+    metricas.arrancar_volcado()
+
+    memoria = memoria_proceso()
+    worker.log.info("Worker %s arrancado: %s", worker.pid, _formatear(memoria))
+    if WORKER_MAX_USS_MB and memoria.get('uss', 0.0) > WORKER_MAX_USS_MB:
+        worker.log.warning(
+            "El worker %s usa %.1f MB de memoria propia (límite %.1f MB): "
+            "el modelo podría no estar compartiéndose entre workers.",
+            worker.pid, memoria['uss'], WORKER_MAX_USS_MB,
+        )
+
+
+def worker_exit(server, worker):
+    # Lo que contó desde el último volcado periódico
+    import metricas
+    metricas.volcar()
+
+
+def child_exit(server, worker):
+    import metricas
+    metricas.marcar_terminado(worker.pid)
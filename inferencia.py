@@ -0,0 +1,191 @@
+"""
+Motor de inferencia en NumPy puro para el clasificador de sentimientos.
+
+Reproduce TfidfVectorizer.transform + MLPClassifier.predict para un solo texto
+sin pasar por la validación de entrada de scikit-learn ni construir matrices
+dispersas: tokeniza con un diccionario, hace el producto disperso contra la
+capa oculta y devuelve directamente la etiqueta de la clase ganadora.
+
+El motor se exporta junto al bundle (MOTOR_PATH) con solo arrays de NumPy y
+tipos básicos, así que la app lo carga sin importar scikit-learn ni pandas:
+el código de entrenamiento (modelo.py) solo se importa si falta o está
+desactualizado.
+"""
+import os
+import re
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_PATH = os.getenv('MODEL_BUNDLE_PATH', os.path.join(BASE_DIR, 'modelo_sentimiento.joblib'))
+
+# Incrementar cuando cambie el formato del motor exportado
+MOTOR_VERSION = 1
+
+
+def ruta_motor(bundle_path):
+    """Ruta del motor exportado junto a un bundle ('modelo.joblib' -> 'modelo.motor.joblib')."""
+    return os.path.splitext(bundle_path)[0] + '.motor.joblib'
+
+MOTOR_PATH = ruta_motor(BUNDLE_PATH)
+
+
+def _logistic(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+_ACTIVACIONES = {
+    'logistic': _logistic,
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'identity': lambda x: x,
+}
+
+
+class MotorInferencia:
+    """Clasificador compilado a partir del vectorizador y el MLP ya entrenados."""
+
+    def __init__(self, vocabulario, idf, coefs, intercepts, etiquetas,
+                 token_pattern=r"(?u)\b\w\w+\b", lowercase=True, activacion='logistic'):
+        if activacion not in _ACTIVACIONES:
+            raise ValueError(f"Activación no soportada: {activacion}")
+        self.vocabulario = vocabulario
+        self.idf = idf
+        self.coefs = coefs
+        self.intercepts = intercepts
+        self.etiquetas = np.asarray(etiquetas, dtype=object)
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self.activacion = activacion
+        self._tokenizar = re.compile(token_pattern).findall
+        self._activacion = _ACTIVACIONES[activacion]
+
+    @classmethod
+    def desde_sklearn(cls, vectorizer, mlp, label_encoder):
+        """Construye el motor a partir de los objetos del bundle del modelo."""
+        params = vectorizer.get_params()
+        if (params['analyzer'] != 'word' or params['ngram_range'] != (1, 1)
+                or params['tokenizer'] is not None or params['preprocessor'] is not None
+                or params['strip_accents'] is not None or params['stop_words'] is not None
+                or params['binary'] or params['sublinear_tf']
+                or not params['use_idf'] or params['norm'] != 'l2'):
+            raise ValueError("El vectorizador usa opciones que el motor de inferencia no reproduce.")
+        if mlp.out_activation_ != 'softmax':
+            raise ValueError("El motor de inferencia solo soporta clasificación multiclase (softmax).")
+
+        return cls(
+            vocabulario=vectorizer.vocabulary_,
+            idf=vectorizer.idf_,
+            coefs=list(mlp.coefs_),
+            intercepts=list(mlp.intercepts_),
+            # Las clases del MLP son enteros del LabelEncoder: se traducen una sola vez
+            etiquetas=label_encoder.classes_[mlp.classes_],
+            token_pattern=params['token_pattern'],
+            lowercase=params['lowercase'],
+            activacion=mlp.activation,
+        )
+
+    def guardar(self, ruta, data_checksum=None):
+        """Escribe el motor de forma atómica, con el checksum de los datos con los que se entrenó."""
+        import joblib
+
+        estado = {
+            'version': MOTOR_VERSION,
+            'data_checksum': data_checksum,
+            'vocabulario': {token: int(indice) for token, indice in self.vocabulario.items()},
+            # Buffers contiguos para que al cargar con mmap se compartan entre workers
+            'idf': np.ascontiguousarray(self.idf),
+            'coefs': [np.ascontiguousarray(c) for c in self.coefs],
+            'intercepts': [np.ascontiguousarray(b) for b in self.intercepts],
+            'etiquetas': [str(e) for e in self.etiquetas],
+            'token_pattern': self.token_pattern,
+            'lowercase': self.lowercase,
+            'activacion': self.activacion,
+        }
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        joblib.dump(estado, tmp)
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta, data_checksum=None):
+        """
+        Carga un motor guardado con guardar() (los arrays, con mmap en solo
+        lectura). Devuelve None si falta, no se puede leer o, si se pasa
+        `data_checksum`, se entrenó con otros datos.
+        """
+        if not os.path.exists(ruta):
+            return None
+        import joblib
+
+        try:
+            estado = joblib.load(ruta, mmap_mode='r')
+        except Exception as e:
+            print(f"No se pudo leer el motor de inferencia '{ruta}': {e}")
+            return None
+        if estado.get('version') != MOTOR_VERSION:
+            print(f"El motor de inferencia '{ruta}' es de otra versión.")
+            return None
+        if data_checksum is not None and estado.get('data_checksum') != data_checksum:
+            print(f"El motor de inferencia '{ruta}' está desactualizado: los datos de entrenamiento han cambiado.")
+            return None
+        return cls(estado['vocabulario'], estado['idf'], estado['coefs'], estado['intercepts'], estado['etiquetas'],
+                   token_pattern=estado['token_pattern'], lowercase=estado['lowercase'],
+                   activacion=estado['activacion'])
+
+    def vectorizar(self, texto):
+        """Devuelve (índices, valores) del vector TF-IDF normalizado del texto."""
+        if self.lowercase:
+            texto = texto.lower()
+        conteos = {}
+        vocabulario = self.vocabulario
+        for token in self._tokenizar(texto):
+            indice = vocabulario.get(token)
+            if indice is not None:
+                conteos[indice] = conteos.get(indice, 0) + 1
+        if not conteos:
+            return None, None
+
+        # Mismo orden de índices que la matriz CSR de scikit-learn
+        indices = np.fromiter(sorted(conteos), dtype=np.intp, count=len(conteos))
+        valores = np.fromiter((conteos[i] for i in indices), dtype=np.float64, count=len(indices))
+        valores *= self.idf[indices]
+        valores /= np.sqrt(np.dot(valores, valores))
+        return indices, valores
+
+    def _salida(self, vector):
+        """Devuelve las activaciones de la capa de salida (antes de softmax) para un vector de vectorizar()."""
+        indices, valores = vector
+        if indices is None:
+            activacion = self.intercepts[0]
+        else:
+            activacion = valores @ self.coefs[0][indices] + self.intercepts[0]
+        return self._capas_siguientes(activacion)
+
+    def _capas_siguientes(self, activacion):
+        for coef, intercept in zip(self.coefs[1:], self.intercepts[1:]):
+            activacion = self._activacion(activacion) @ coef + intercept
+        return activacion
+
+    def predecir(self, texto):
+        """Devuelve la etiqueta predicha para un texto ya limpio."""
+        return self.etiquetas[int(np.argmax(self._salida(self.vectorizar(texto))))]
+
+    def probabilidades(self, texto, vector=None):
+        """
+        Probabilidad de cada etiqueta (en el orden de self.etiquetas), como
+        predict_proba. Si ya se tiene, se puede pasar el `vector` de vectorizar().
+        """
+        salida = self._salida(self.vectorizar(texto) if vector is None else vector)
+        exp = np.exp(salida - salida.max())
+        return exp / exp.sum()
+
+    def probabilidades_lote(self, textos):
+        """Matriz (textos × etiquetas) de probabilidades, como predict_proba sobre varios textos ya limpios."""
+        activacion = np.tile(self.intercepts[0], (len(textos), 1))
+        primera = self.coefs[0]
+        for fila, texto in enumerate(textos):
+            indices, valores = self.vectorizar(texto)
+            if indices is not None:
+                activacion[fila] += valores @ primera[indices]
+        salida = self._capas_siguientes(activacion)
+        exp = np.exp(salida - salida.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
@@ -0,0 +1,387 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Registrar una observación es incrementar números bajo un lock; el texto solo
+se genera cuando alguien consulta /metrics, así que sin nadie que lo lea el
+coste es prácticamente nulo.
+
+Con varios workers de gunicorn, gunicorn.conf.py define METRICS_DIR: cada
+worker vuelca sus métricas en un fichero JSON de ese directorio cada
+METRICS_FLUSH_INTERVAL segundos (y al salir), y /metrics, lo atienda el worker
+que lo atienda, suma los contadores e histogramas de todos (también de los
+workers que ya terminaron) y expone los indicadores (gauges) de cada worker
+vivo con la etiqueta `pid`. Lo de los demás workers puede llevar hasta
+METRICS_FLUSH_INTERVAL segundos de retraso. Sin METRICS_DIR (servidor de
+desarrollo, un solo proceso) se exponen las del proceso.
+
+- http_request_duration_seconds{route,method,status}: latencia por ruta.
+- stage_duration_seconds{stage}: etapas internas (limpiar_tweet, vectorizar,
+  predecir, render, playlist_create, playlist_add, token_refresh...), medidas
+  con `with etapa('nombre'):`.
+- spotify_request_duration_seconds{endpoint,method,status}: cada llamada a la
+  API de Spotify, medida en la sesión HTTP compartida.
+- spotify_rate_limited_total{endpoint} y spotify_errors_total{endpoint,kind}:
+  429 (también los que se reintentaron dentro de la sesión) y errores 5xx.
+- spotify_scheduler_wait_seconds{priority}, spotify_throttled_total{priority}
+  y spotify_rate_limit_pauses_total: cola del planificador de llamadas a
+  Spotify (planificador.py).
+- model_load_seconds: lo que tardó la última carga del modelo.
+"""
+import glob
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+# Límites de los buckets de los histogramas de latencia (segundos)
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Directorio compartido por los workers para agregar sus métricas (None: solo las del proceso)
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas(nombres, valores, extra=()):
+    """Pares (nombre, valor) de etiquetas como tupla, la forma en que se guardan y se agregan."""
+    return tuple((n, str(v)) for n, v in zip(nombres, valores)) + tuple(extra)
+
+def _formatear_etiquetas(pares):
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}'
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador monótono con etiquetas."""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores_etiquetas, cantidad=1):
+        with self._lock:
+            self._valores[valores_etiquetas] = self._valores.get(valores_etiquetas, 0) + cantidad
+
+    def valor(self, *valores_etiquetas):
+        return self._valores.get(valores_etiquetas, 0)
+
+    def muestras(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        for etiquetas, valor in valores:
+            yield self.nombre, _etiquetas(self.etiquetas, etiquetas), valor
+
+    def reiniciar(self):
+        with self._lock:
+            self._valores.clear()
+
+
+class Indicador(Contador):
+    """Valor que sube y baja (gauge)."""
+
+    tipo = 'gauge'
+
+    def fijar(self, valor, *valores_etiquetas):
+        with self._lock:
+            self._valores[valores_etiquetas] = valor
+
+
+class Histograma:
+    """Histograma con buckets fijos, suma y número de observaciones por combinación de etiquetas."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        posicion = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                # [conteos por bucket (el último es +Inf), suma, total]
+                serie = self._series[valores_etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][posicion] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def muestras(self):
+        with self._lock:
+            series = [(etiquetas, list(conteos), suma, total)
+                      for etiquetas, (conteos, suma, total) in self._series.items()]
+        for etiquetas, conteos, suma, total in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                yield (f'{self.nombre}_bucket',
+                       _etiquetas(self.etiquetas, etiquetas, (('le', _numero(limite)),)), acumulado)
+            yield f'{self.nombre}_sum', _etiquetas(self.etiquetas, etiquetas), suma
+            yield f'{self.nombre}_count', _etiquetas(self.etiquetas, etiquetas), total
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Registro:
+    """Conjunto de métricas que se exponen juntas."""
+
+    def __init__(self):
+        self._metricas = []
+        self._colectores = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def registrar_colector(self, funcion):
+        """`funcion()` devuelve [(nombre, tipo, ayuda, [(etiquetas dict, valor)])] y solo se llama al exponer."""
+        self._colectores.append(funcion)
+        return funcion
+
+    def familias(self):
+        """[(nombre, tipo, ayuda, [(nombre de la muestra, pares de etiquetas, valor)])] de este proceso."""
+        familias = [(m.nombre, m.tipo, m.ayuda, list(m.muestras())) for m in self._metricas]
+        for colector in self._colectores:
+            try:
+                resultado = colector()
+            except Exception as e:
+                print(f"Error en un colector de métricas: {e}")
+                continue
+            for nombre, tipo, ayuda, muestras in resultado:
+                familias.append((nombre, tipo, ayuda, [(nombre, _etiquetas(etiquetas.keys(), etiquetas.values()), valor)
+                                                       for etiquetas, valor in muestras]))
+        return familias
+
+    def reiniciar(self):
+        """Vacía los contadores e histogramas (no los indicadores), para no heredarlos tras un fork."""
+        for metrica in self._metricas:
+            if metrica.tipo != 'gauge':
+                metrica.reiniciar()
+
+    def exponer(self, familias=None):
+        lineas = []
+        for nombre, tipo, ayuda, muestras in (self.familias() if familias is None else familias):
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for nombre_muestra, etiquetas, valor in muestras:
+                lineas.append(f'{nombre_muestra}{_formatear_etiquetas(etiquetas)} {_numero(valor)}')
+        return '\n'.join(lineas) + '\n'
+
+
+def agregar(procesos):
+    """
+    Une las familias de varios procesos, [(pid, vivo, familias)]: suma los
+    contadores y los histogramas y deja los indicadores de cada proceso vivo
+    con la etiqueta `pid`.
+    """
+    agregadas = {}
+    for pid, vivo, familias in procesos:
+        for nombre, tipo, ayuda, muestras in familias:
+            if tipo == 'gauge' and not vivo:
+                continue
+            valores = agregadas.setdefault(nombre, (tipo, ayuda, {}))[2]
+            for nombre_muestra, etiquetas, valor in muestras:
+                etiquetas = tuple(map(tuple, etiquetas))
+                if tipo == 'gauge':
+                    if 'pid' not in dict(etiquetas):
+                        etiquetas += (('pid', str(pid)),)
+                    valores[nombre_muestra, etiquetas] = valor
+                else:
+                    valores[nombre_muestra, etiquetas] = valores.get((nombre_muestra, etiquetas), 0) + valor
+    return [(nombre, tipo, ayuda, [(n, etiquetas, valor) for (n, etiquetas), valor in valores.items()])
+            for nombre, (tipo, ayuda, valores) in agregadas.items()]
+
+
+registro = Registro()
+
+PETICIONES = registro.registrar(Histograma(
+    'http_request_duration_seconds', 'Latencia de las peticiones HTTP por ruta.', ('route', 'method', 'status')))
+ETAPAS = registro.registrar(Histograma(
+    'stage_duration_seconds', 'Duración de las etapas internas de las peticiones.', ('stage',)))
+SPOTIFY = registro.registrar(Histograma(
+    'spotify_request_duration_seconds', 'Latencia de las llamadas a la API de Spotify.', ('endpoint', 'method', 'status')))
+SPOTIFY_429 = registro.registrar(Contador(
+    'spotify_rate_limited_total', 'Respuestas 429 de Spotify, incluidas las reintentadas.', ('endpoint',)))
+SPOTIFY_ERRORES = registro.registrar(Contador(
+    'spotify_errors_total', 'Errores de Spotify (5xx o de conexión), incluidos los reintentados.', ('endpoint', 'kind')))
+SPOTIFY_ESPERA = registro.registrar(Histograma(
+    'spotify_scheduler_wait_seconds', 'Espera en la cola del planificador antes de llamar a Spotify.', ('priority',)))
+SPOTIFY_FRENADAS = registro.registrar(Contador(
+    'spotify_throttled_total', 'Llamadas a Spotify que tuvieron que esperar al límite de tasa o a una pausa.',
+    ('priority',)))
+SPOTIFY_PAUSAS = registro.registrar(Contador(
+    'spotify_rate_limit_pauses_total', 'Pausas de todas las llamadas a Spotify por un 429.'))
+MODELO_CARGA = registro.registrar(Indicador(
+    'model_load_seconds', 'Duración de la última carga del modelo de sentimientos.'))
+PROCESO = registro.registrar(Indicador('process_info', 'Procesos cuyas métricas incluye este scrape.', ('pid',)))
+
+
+class etapa:
+    """Cronómetro para `with etapa('nombre'):` que observa la duración en stage_duration_seconds."""
+
+    __slots__ = ('nombre', 'inicio')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ETAPAS.observar(time.perf_counter() - self.inicio, self.nombre)
+        return False
+
+
+# Segmentos de la URL de Spotify que son identificadores y no forman parte del endpoint
+_ANTES_DE_ID = frozenset(['albums', 'artists', 'audio-features', 'episodes', 'playlists', 'shows', 'tracks', 'users'])
+_ES_ID = re.compile(r'^[0-9A-Za-z]{22}$')
+
+def endpoint_spotify(url):
+    """Ruta de la API con los ids sustituidos por {id}: /v1/artists/{id}/top-tracks."""
+    ruta = url.split('://', 1)[-1].partition('/')[2].partition('?')[0]
+    segmentos = ruta.split('/')
+    for i, segmento in enumerate(segmentos):
+        if i and (segmentos[i - 1] in _ANTES_DE_ID or _ES_ID.match(segmento)) and segmento not in _ANTES_DE_ID:
+            segmentos[i] = '{id}'
+    return '/' + '/'.join(segmentos)
+
+def registrar_respuesta_spotify(respuesta, *args, **kwargs):
+    """Hook de respuesta de requests para la sesión HTTP compartida con Spotify."""
+    endpoint = endpoint_spotify(respuesta.url)
+    SPOTIFY.observar(respuesta.elapsed.total_seconds(), endpoint, respuesta.request.method, respuesta.status_code)
+    # Los intentos que urllib3 reintentó antes de esta respuesta
+    reintentos = getattr(getattr(respuesta.raw, 'retries', None), 'history', ()) or ()
+    for intento in reintentos:
+        if intento.status == 429:
+            SPOTIFY_429.inc(endpoint)
+        elif intento.status is not None and intento.status >= 500:
+            SPOTIFY_ERRORES.inc(endpoint, str(intento.status))
+        elif intento.error is not None:
+            SPOTIFY_ERRORES.inc(endpoint, type(intento.error).__name__)
+    if respuesta.status_code == 429:
+        SPOTIFY_429.inc(endpoint)
+    elif respuesta.status_code >= 500:
+        SPOTIFY_ERRORES.inc(endpoint, str(respuesta.status_code))
+    return respuesta
+
+def _ruta_volcado(pid):
+    return os.path.join(METRICS_DIR, f'{pid}.json')
+
+def volcar():
+    """Escribe las métricas de este proceso en METRICS_DIR para que las lea el worker que atienda /metrics."""
+    PROCESO.fijar(1, str(os.getpid()))
+    ruta = _ruta_volcado(os.getpid())
+    tmp = f'{ruta}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(registro.familias(), f)
+    os.replace(tmp, ruta)
+
+def marcar_terminado(pid):
+    """
+    Conserva los contadores e histogramas de un worker que ha terminado, pero
+    no sus indicadores, y deja libre su pid para un worker nuevo (child_exit).
+    """
+    try:
+        os.replace(_ruta_volcado(pid), os.path.join(METRICS_DIR, f'terminado-{pid}-{time.time_ns()}.json'))
+    except OSError:
+        pass
+
+def _leer_volcados():
+    procesos = []
+    for ruta in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        nombre = os.path.basename(ruta)[:-len('.json')]
+        vivo = not nombre.startswith('terminado-')
+        pid = nombre.split('-')[1] if not vivo else nombre
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                procesos.append((pid, vivo, json.load(f)))
+        except (OSError, ValueError) as e:
+            print(f"No se pudieron leer las métricas de '{ruta}': {e}")
+    return procesos
+
+def _volcar_periodicamente():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            volcar()
+        except OSError as e:
+            print(f"No se pudieron volcar las métricas: {e}")
+
+def arrancar_volcado():
+    """Arranca el volcado periódico de este worker (gunicorn.conf.py, post_worker_init)."""
+    if METRICS_DIR:
+        volcar()
+        threading.Thread(target=_volcar_periodicamente, name='metricas', daemon=True).start()
+
+def exponer():
+    if not METRICS_DIR:
+        PROCESO.fijar(1, str(os.getpid()))
+        return registro.exponer()
+    # Lo propio, al momento; lo de los demás workers, de su último volcado
+    volcar()
+    return registro.exponer(agregar(_leer_volcados()))
+
+# Lo registrado en el proceso maestro antes del fork no se cuenta en cada worker
+os.register_at_fork(after_in_child=registro.reiniciar)
+
+def init_app(app):
+    """
+    Mide la latencia de cada ruta y el renderizado de plantillas y registra
+    /metrics. Si METRICS_TOKEN está definido, /metrics exige
+    'Authorization: Bearer <token>'.
+    """
+    token = os.getenv('METRICS_TOKEN')
+
+    @app.before_request
+    def _inicio_peticion():
+        g._inicio_peticion = time.perf_counter()
+
+    @app.after_request
+    def _fin_peticion(respuesta):
+        inicio = g.pop('_inicio_peticion', None)
+        if inicio is not None:
+            ruta = request.url_rule.rule if request.url_rule is not None else 'sin_ruta'
+            PETICIONES.observar(time.perf_counter() - inicio, ruta, request.method, respuesta.status_code)
+        return respuesta
+
+    def _antes_de_renderizar(sender, template, context, **extra):
+        g.setdefault('_inicios_render', []).append(time.perf_counter())
+
+    def _renderizada(sender, template, context, **extra):
+        inicios = g.get('_inicios_render')
+        if inicios:
+            ETAPAS.observar(time.perf_counter() - inicios.pop(), 'render')
+
+    # weak=False: son funciones locales y blinker solo guardaría una referencia débil
+    before_render_template.connect(_antes_de_renderizar, app, weak=False)
+    template_rendered.connect(_renderizada, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('No autorizado\n', status=401, mimetype='text/plain')
+        return Response(exponer(), mimetype='text/plain; version=0.0.4')
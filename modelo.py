@@ -0,0 +1,336 @@
+"""
+Entrenamiento y empaquetado del modelo de clasificación de sentimientos.
+
+El modelo se construye offline con:
+
+    python modelo.py construir
+
+y se guarda como un bundle versionado (vectorizador + MLP + codificador de
+etiquetas + checksum de 'train.tsv'), junto con el motor de inferencia que
+carga la app (inferencia.py). En Heroku se construye al compilar el slug
+(bin/post_compile) y la fase release comprueba que está al día; la app solo
+importa este módulo para exportar el motor si falta, y no arranca si no hay
+bundle (salvo con MODEL_TRAIN_ON_START=1, para desarrollo). Los tweets limpios
+salen del corpus preparado de corpus.py ('python modelo.py preparar').
+
+Una de cada FEEDBACK_HOLDOUT_EVERY filas de 'train.tsv' no se entrena (ni entra
+en el vocabulario): es el conjunto de referencia, y la precisión del modelo
+sobre él se guarda en el bundle como listón de las actualizaciones con
+correcciones (retroalimentacion.py).
+"""
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import LabelEncoder
+from sklearn.neural_network import MLPClassifier
+
+import corpus
+from inferencia import BUNDLE_PATH, MotorInferencia, ruta_motor
+from texto import limpiar_tweet, limpiar_serie, limpiar_tweet_referencia
+from vocabulario import SPANISH_STOPWORDS, IndiceVocabulario
+
+BASE_DIR = corpus.BASE_DIR
+DATA_PATH = corpus.DATA_PATH
+
+# Incrementar cuando cambie el contenido o el formato del bundle
+BUNDLE_VERSION = 2
+
+
+# Una de cada N filas de 'train.tsv' forma el conjunto de referencia, que nunca se entrena: la precisión
+# del último entrenamiento completo sobre él es el listón fijo de las actualizaciones con correcciones
+FILAS_REFERENCIA_CADA = int(os.getenv('FEEDBACK_HOLDOUT_EVERY', '5'))
+
+def filas_referencia(n, cada=FILAS_REFERENCIA_CADA):
+    """Máscara de las filas del corpus que forman el conjunto de referencia."""
+    return np.arange(n) % cada == 0 if cada else np.zeros(n, dtype=bool)
+
+def precision(vectorizer, mlp, label_encoder, textos, etiquetas):
+    """Fracción de `textos` que el modelo clasifica con su etiqueta (1.0 si no hay textos)."""
+    if not textos:
+        return 1.0
+    predichas = label_encoder.inverse_transform(mlp.predict(vectorizer.transform(textos)))
+    return float(np.mean(predichas == np.asarray(etiquetas, dtype=object)))
+
+def precision_referencia(vectorizer, mlp, label_encoder, data_path=DATA_PATH, cada=FILAS_REFERENCIA_CADA):
+    """Precisión del modelo en el conjunto de referencia de 'train.tsv'."""
+    datos = corpus.preparar_corpus(data_path)
+    referencia = filas_referencia(len(datos), cada)
+    return precision(vectorizer, mlp, label_encoder, datos.textos(referencia),
+                     datos.etiquetas_texto(referencia).tolist())
+
+# Hiperparámetros por defecto (busqueda.py compara otras combinaciones)
+TOP_N = 1250
+HIDDEN_LAYER_SIZES = (64,)
+ALPHA = 0.01
+
+def crear_clasificador(hidden_layer_sizes=HIDDEN_LAYER_SIZES, alpha=ALPHA):
+    """MLP sin entrenar con la configuración del modelo."""
+    return MLPClassifier(
+            hidden_layer_sizes=hidden_layer_sizes,
+            activation='logistic',  # Cambiado de 'sigmoid' a 'logistic'
+            solver='adam',
+            alpha=alpha,
+            learning_rate_init=0.001,
+            max_iter=700,
+            random_state=42,
+            early_stopping=True,
+            n_iter_no_change=25,
+            tol=0.0001,
+            verbose=False
+        )
+
+def train_sentiment_model(data_path=DATA_PATH, top_n=TOP_N, indice=None, hidden_layer_sizes=HIDDEN_LAYER_SIZES,
+                          alpha=ALPHA, correcciones=()):
+    """
+    Carga los datos, los preprocesa y entrena el modelo de clasificación de sentimientos.
+
+    Las filas de referencia (filas_referencia) quedan fuera del entrenamiento.
+    Si se pasa un IndiceVocabulario ya construido sobre las filas de
+    entrenamiento, se reutiliza para el vocabulario en lugar de volver a
+    recorrer los textos. `correcciones` son pares (texto limpio, etiqueta) de
+    los usuarios (retroalimentacion.py) que se entrenan junto a 'train.tsv'.
+    """
+
+    # Comprobar la ruta al archivo de datos
+    if not os.path.exists(data_path):
+        print(f"ADVERTENCIA: El archivo de datos '{data_path}' no se encontró.")
+        return None, None, None
+
+    print("Entrenando el modelo de clasificación de sentimientos...")
+    # Tweets limpios y etiquetas del corpus preparado (solo se limpia si 'train.tsv' ha cambiado)
+    datos = corpus.preparar_corpus(data_path)
+    entrenamiento = ~filas_referencia(len(datos))
+    textos, etiquetas = datos.textos(entrenamiento), datos.etiquetas_texto(entrenamiento)
+    if correcciones:
+        print(f"Añadiendo {len(correcciones)} correcciones de los usuarios al entrenamiento.")
+        textos = textos + [texto for texto, _ in correcciones]
+        etiquetas = np.concatenate([etiquetas, np.asarray([e for _, e in correcciones], dtype=object)])
+        # El índice dado se construyó sin las correcciones
+        indice = None
+
+
+    # Codificar etiquetas y vectorizar texto
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(etiquetas)
+
+
+
+    # Vocabulario personalizado (top-N por label), sin stopwords
+    if indice is None:
+        indice = IndiceVocabulario.desde_textos(textos, etiquetas)
+    custom_vocab_no_stop = indice.top_por_etiqueta(top_n, stopwords=SPANISH_STOPWORDS)
+
+    # Vectorizador con vocabulario personalizado sin stopwords
+    vectorizer = TfidfVectorizer(vocabulary=custom_vocab_no_stop)
+    X = vectorizer.fit_transform(textos)
+    # Entrenar el clasificador MLP
+    mlp = crear_clasificador(hidden_layer_sizes, alpha)
+    mlp.fit(X, y)
+
+
+    print("Modelo entrenado y listo.")
+    return vectorizer, mlp, label_encoder
+
+# --- Bundle del modelo ---
+
+def checksum_datos(data_path=DATA_PATH):
+    """Devuelve el SHA-256 del archivo de entrenamiento, o None si no existe."""
+    return corpus.checksum_datos(data_path)
+
+def construir_bundle(data_path=DATA_PATH, bundle_path=BUNDLE_PATH, correcciones=(), **hiperparametros):
+    """
+    Entrena el modelo (con `hiperparametros` de train_sentiment_model si se
+    pasan, y las `correcciones` ya aplicadas) y lo guarda como bundle junto con
+    su precisión en el conjunto de referencia, que no ha visto al entrenar.
+    Devuelve el bundle o None si no hay datos.
+    """
+    vectorizer, mlp, label_encoder = train_sentiment_model(data_path, correcciones=correcciones, **hiperparametros)
+    if mlp is None:
+        return None
+    referencia = precision_referencia(vectorizer, mlp, label_encoder, data_path)
+    print(f"Precisión en el conjunto de referencia: {referencia:.4f}.")
+    return guardar_bundle(vectorizer, mlp, label_encoder, checksum_datos(data_path), bundle_path,
+                          hiperparametros=hiperparametros, precision_referencia=referencia,
+                          filas_referencia_cada=FILAS_REFERENCIA_CADA, correcciones_entrenadas=len(correcciones))
+
+def guardar_bundle(vectorizer, mlp, label_encoder, data_checksum, bundle_path=BUNDLE_PATH, **extra):
+    """
+    Escribe el bundle de forma atómica, y junto a él el motor de inferencia que
+    carga la app, y lo devuelve. `extra` se guarda junto al modelo.
+    """
+    # Pesos en buffers contiguos para que al cargar con mmap se compartan entre workers
+    mlp.coefs_ = [np.ascontiguousarray(c) for c in mlp.coefs_]
+    mlp.intercepts_ = [np.ascontiguousarray(b) for b in mlp.intercepts_]
+
+    bundle = {
+        'version': BUNDLE_VERSION,
+        'sklearn_version': sklearn.__version__,
+        'data_checksum': data_checksum,
+        'creado': time.time(),
+        'vectorizer': vectorizer,
+        'mlp': mlp,
+        'label_encoder': label_encoder,
+        **extra,
+    }
+    # Escritura atómica para que un worker nunca lea un bundle a medias
+    tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+    joblib.dump(bundle, tmp_path)
+    os.replace(tmp_path, bundle_path)
+    # Después del bundle: los workers recargan el modelo cuando cambia el motor
+    MotorInferencia.desde_sklearn(vectorizer, mlp, label_encoder).guardar(ruta_motor(bundle_path), data_checksum)
+    print(f"Bundle del modelo guardado en '{bundle_path}'.")
+    return bundle
+
+def motivo_bundle_obsoleto(bundle, data_path=DATA_PATH):
+    """Devuelve por qué el bundle no sirve, o None si está al día."""
+    if bundle.get('version') != BUNDLE_VERSION:
+        return f"versión {bundle.get('version')} != {BUNDLE_VERSION}"
+    if bundle.get('sklearn_version') != sklearn.__version__:
+        return f"scikit-learn {bundle.get('sklearn_version')} != {sklearn.__version__}"
+    checksum = checksum_datos(data_path)
+    # Sin datos de entrenamiento no se puede comprobar: se acepta el bundle
+    if checksum is not None and bundle.get('data_checksum') != checksum:
+        return "los datos de entrenamiento han cambiado"
+    return None
+
+def cargar_bundle(bundle_path=BUNDLE_PATH, data_path=DATA_PATH):
+    """
+    Carga el bundle si existe y está al día; si no, devuelve None.
+
+    Los arrays de NumPy (pesos del MLP, vector idf) se abren con mmap en solo
+    lectura, así que todos los procesos que cargan el mismo archivo comparten
+    las mismas páginas de memoria.
+    """
+    if not os.path.exists(bundle_path):
+        print(f"No existe el bundle del modelo '{bundle_path}'.")
+        return None
+    try:
+        bundle = joblib.load(bundle_path, mmap_mode='r')
+    except Exception as e:
+        print(f"No se pudo leer el bundle del modelo '{bundle_path}': {e}")
+        return None
+    motivo = motivo_bundle_obsoleto(bundle, data_path)
+    if motivo:
+        print(f"El bundle del modelo está desactualizado: {motivo}.")
+        return None
+    return bundle
+
+def cargar_o_entrenar(bundle_path=BUNDLE_PATH, data_path=DATA_PATH, entrenar=True):
+    """
+    Devuelve (vectorizer, mlp, label_encoder) desde el bundle y solo reentrena
+    (y regenera el bundle) si falta o está desactualizado. Con `entrenar=False`
+    devuelve (None, None, None) en ese caso.
+    """
+    bundle = cargar_bundle(bundle_path, data_path)
+    if bundle is None:
+        if not entrenar or construir_bundle(data_path, bundle_path) is None:
+            return None, None, None
+        # Releer desde disco para usar los pesos mapeados en memoria y no los del heap
+        bundle = cargar_bundle(bundle_path, data_path)
+        if bundle is None:
+            return None, None, None
+    return bundle['vectorizer'], bundle['mlp'], bundle['label_encoder']
+
+def cargar_o_entrenar_motor(bundle_path=BUNDLE_PATH, data_path=DATA_PATH, entrenar=True):
+    """
+    Como cargar_o_entrenar, pero devuelve el MotorInferencia (o None) y lo
+    exporta para que los siguientes arranques no necesiten scikit-learn.
+    """
+    vectorizer, mlp, label_encoder = cargar_o_entrenar(bundle_path, data_path, entrenar)
+    if mlp is None:
+        return None
+    motor = MotorInferencia.desde_sklearn(vectorizer, mlp, label_encoder)
+    motor.guardar(ruta_motor(bundle_path), checksum_datos(data_path))
+    return motor
+
+def correcciones_aplicadas():
+    """
+    Pares (texto, etiqueta) de las correcciones que las actualizaciones
+    incrementales ya aplicaron, para no perderlas al reentrenar desde cero. Solo
+    existen donde está la base de datos de correcciones (FEEDBACK_DB_PATH).
+    """
+    import retroalimentacion
+    return [(texto, etiqueta) for _, texto, etiqueta in retroalimentacion.almacen.leer(retroalimentacion.APLICADA)]
+
+def verificar_limpieza(data_path=DATA_PATH):
+    """
+    Comprueba que limpiar_tweet y limpiar_serie dan exactamente la misma salida
+    que la implementación original sobre todo el conjunto de datos.
+    Devuelve el número de discrepancias.
+    """
+    tweets = pd.read_csv(data_path, sep='\t')['tweet']
+    esperados = [limpiar_tweet_referencia(t) for t in tweets]
+    discrepancias = sum(1 for t, esperado in zip(tweets, esperados) if limpiar_tweet(t) != esperado)
+    discrepancias += sum(1 for limpio, esperado in zip(limpiar_serie(tweets), esperados) if limpio != esperado)
+    print(f"Limpieza de texto: {2 * len(tweets) - discrepancias}/{2 * len(tweets)} salidas idénticas a la versión original.")
+    return discrepancias
+
+def verificar_motor(bundle, data_path=DATA_PATH):
+    """
+    Comprueba que el motor NumPy predice exactamente lo mismo que scikit-learn
+    sobre todo el conjunto de datos. Devuelve el número de discrepancias.
+    """
+    vectorizer, mlp, label_encoder = bundle['vectorizer'], bundle['mlp'], bundle['label_encoder']
+    motor = MotorInferencia.desde_sklearn(vectorizer, mlp, label_encoder)
+    # Todas las filas, también las de etiquetas que no se usan para entrenar
+    textos = pd.read_csv(data_path, sep='\t')['tweet'].map(limpiar_tweet).tolist()
+    esperadas = label_encoder.inverse_transform(mlp.predict(vectorizer.transform(textos)))
+    discrepancias = sum(1 for texto, esperada in zip(textos, esperadas) if motor.predecir(texto) != esperada)
+    print(f"Motor de inferencia: {len(textos) - discrepancias}/{len(textos)} predicciones idénticas a scikit-learn.")
+    return discrepancias
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestiona el bundle del modelo de sentimientos.")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    construir = sub.add_parser('construir', help="Entrena el modelo y escribe el bundle.")
+    construir.add_argument('--forzar', action='store_true', help="Reentrenar aunque el bundle esté al día.")
+    construir.add_argument('--top-n', type=int, default=TOP_N, help="Palabras por etiqueta en el vocabulario.")
+    construir.add_argument('--oculta', type=int, nargs='+', default=list(HIDDEN_LAYER_SIZES),
+                           help="Neuronas de cada capa oculta.")
+    construir.add_argument('--alpha', type=float, default=ALPHA, help="Regularización L2 del MLP.")
+    construir.add_argument('--sin-correcciones', action='store_true',
+                           help="No entrenar con las correcciones ya aplicadas (FEEDBACK_DB_PATH).")
+    sub.add_parser('preparar', help="Limpia 'train.tsv' y guarda el corpus en la caché si ha cambiado.")
+    sub.add_parser('estado', help="Indica si el bundle existe y está al día.")
+    sub.add_parser('verificar', help="Compara la limpieza de texto y el motor de inferencia NumPy "
+                                     "con las implementaciones originales sobre 'train.tsv'.")
+    args = parser.parse_args(argv)
+
+    if args.comando == 'construir':
+        if not args.forzar and cargar_bundle() is not None:
+            print("El bundle ya está al día; usa --forzar para reentrenar.")
+            return 0
+        hiperparametros = {'top_n': args.top_n, 'hidden_layer_sizes': tuple(args.oculta), 'alpha': args.alpha}
+        correcciones = () if args.sin_correcciones else correcciones_aplicadas()
+        return 0 if construir_bundle(correcciones=correcciones, **hiperparametros) is not None else 1
+    if args.comando == 'preparar':
+        datos = corpus.preparar_corpus(DATA_PATH)
+        print(f"Corpus de {len(datos)} tweets ({', '.join(c.strip() for c in datos.clases)}) en '{datos.directorio}'.")
+        return 0
+
+    if args.comando == 'verificar':
+        # La limpieza de texto no depende del modelo: se comprueba aunque no haya bundle
+        discrepancias = verificar_limpieza()
+        bundle = cargar_bundle()
+        if bundle is None:
+            print("Sin un bundle al día no se puede verificar el motor de inferencia.")
+            return 1
+        return 1 if discrepancias + verificar_motor(bundle) else 0
+
+    bundle = cargar_bundle()
+    if bundle is None:
+        return 1
+    print(f"Bundle v{bundle['version']} al día (scikit-learn {bundle['sklearn_version']}, "
+          f"datos {bundle['data_checksum']}).")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,230 @@
+"""
+Planificador de las llamadas salientes a la API de Spotify.
+
+Todas las peticiones a SPOTIFY_API_PREFIX pasan por un cubo de fichas (token
+bucket) antes de salir, en el adaptador HTTP de cliente_spotify:
+
+- Se permiten SPOTIFY_RATE_LIMIT peticiones por segundo de media con ráfagas
+  de hasta SPOTIFY_RATE_BURST. Con SPOTIFY_RATE_BACKEND=sqlite (por defecto)
+  el cubo se guarda en un fichero y lo comparten todos los workers de la
+  máquina, así que el límite es de la máquina y no se multiplica por el número
+  de workers; con 'memoria' cada proceso tiene el suyo.
+- Los reintentos que hace la sesión HTTP (cliente_spotify.py) también pasan
+  por el cubo: cada intento toma su ficha.
+- Un 429 con Retry-After vacía el cubo y detiene todas las peticiones (de
+  todos los workers si el cubo es compartido) hasta que pase ese tiempo, en
+  lugar de que cada hilo siga chocando con el límite.
+- Las peticiones esperan en una cola con prioridad: las de las páginas que
+  carga el usuario (INTERACTIVA, por defecto) salen antes que las de los
+  trabajos en segundo plano (FONDO). La prioridad se fija con
+  `with prioridad(FONDO):` y la heredan los hilos de playlist.py.
+
+Se miden la espera en la cola, las peticiones frenadas y las pausas por 429
+(metricas.py), y la profundidad de la cola (estadisticas()).
+"""
+import contextvars
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+import metricas
+from cache import BASE_DIR, ConexionSQLite
+
+# Cuota de la app en Spotify: peticiones permitidas en su ventana móvil de 30 segundos. Spotify no
+# publica la cifra; se ajusta a la de la app y el límite de la máquina se deriva de ella
+SPOTIFY_QUOTA_30S = float(os.getenv('SPOTIFY_QUOTA_30S', '1500'))
+# Peticiones por segundo a la API de Spotify de toda la máquina (0 desactiva el límite) y ráfaga máxima.
+# Por defecto la cuota repartida en la ventana, con la ráfaga que cabe en 2 segundos de esa tasa
+SPOTIFY_RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', str(SPOTIFY_QUOTA_30S / 30)))
+SPOTIFY_RATE_BURST = float(os.getenv('SPOTIFY_RATE_BURST', str(max(1.0, 2 * SPOTIFY_RATE_LIMIT))))
+# 'sqlite' (uno compartido por todos los workers de la máquina) o 'memoria' (un cubo por proceso)
+SPOTIFY_RATE_BACKEND = os.getenv('SPOTIFY_RATE_BACKEND', 'sqlite')
+SPOTIFY_RATE_PATH = os.getenv('SPOTIFY_RATE_PATH', os.path.join(BASE_DIR, 'limite_spotify.sqlite3'))
+# Pausa máxima (segundos) que se acepta de un Retry-After
+SPOTIFY_RATE_PAUSE_MAX = float(os.getenv('SPOTIFY_RATE_PAUSE_MAX', '60'))
+
+INTERACTIVA, FONDO = 0, 1
+NOMBRES_PRIORIDAD = {INTERACTIVA: 'interactiva', FONDO: 'fondo'}
+
+_prioridad = contextvars.ContextVar('prioridad_spotify', default=INTERACTIVA)
+
+
+class prioridad:
+    """`with prioridad(FONDO):` marca las llamadas a Spotify del bloque como de segundo plano."""
+
+    __slots__ = ('nivel', '_marca')
+
+    def __init__(self, nivel):
+        self.nivel = nivel
+
+    def __enter__(self):
+        self._marca = _prioridad.set(self.nivel)
+        return self
+
+    def __exit__(self, *exc):
+        _prioridad.reset(self._marca)
+        return False
+
+
+class CuboMemoria:
+    """Cubo de fichas de un solo proceso."""
+
+    def __init__(self, tasa, rafaga):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self._fichas = rafaga
+        self._actualizado = time.monotonic()
+        self._pausa_hasta = 0.0
+
+    def tomar(self):
+        """Toma una ficha y devuelve 0, o los segundos que faltan para poder tomarla."""
+        ahora = time.monotonic()
+        if ahora < self._pausa_hasta:
+            return self._pausa_hasta - ahora
+        self._fichas = min(self.rafaga, self._fichas + (ahora - self._actualizado) * self.tasa)
+        self._actualizado = ahora
+        if self._fichas >= 1:
+            self._fichas -= 1
+            return 0.0
+        return (1 - self._fichas) / self.tasa
+
+    def pausar(self, segundos):
+        ahora = time.monotonic()
+        self._pausa_hasta = max(self._pausa_hasta, ahora + segundos)
+        self._fichas = 0.0
+        self._actualizado = self._pausa_hasta
+
+
+class CuboSQLite(ConexionSQLite):
+    """Cubo de fichas en una fila de SQLite, compartido por los procesos que abren el mismo fichero."""
+
+    def __init__(self, tasa, rafaga, path=SPOTIFY_RATE_PATH):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.path = path
+        self._local = threading.local()
+        with self._conexion() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cubo ("
+                         "id INTEGER PRIMARY KEY CHECK (id = 0), fichas REAL NOT NULL, "
+                         "actualizado REAL NOT NULL, pausa_hasta REAL NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO cubo VALUES (0, ?, ?, 0)", (rafaga, time.time()))
+
+    def tomar(self):
+        conn = self._conexion()
+        # BEGIN IMMEDIATE: leer y actualizar la fila sin que otro proceso se cuele en medio
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fichas, actualizado, pausa_hasta = conn.execute(
+                "SELECT fichas, actualizado, pausa_hasta FROM cubo WHERE id = 0").fetchone()
+            ahora = time.time()
+            if ahora < pausa_hasta:
+                return pausa_hasta - ahora
+            fichas = min(self.rafaga, fichas + max(0.0, ahora - actualizado) * self.tasa)
+            espera = 0.0
+            if fichas >= 1:
+                fichas -= 1
+            else:
+                espera = (1 - fichas) / self.tasa
+            conn.execute("UPDATE cubo SET fichas = ?, actualizado = ? WHERE id = 0", (fichas, ahora))
+            return espera
+        finally:
+            conn.execute("COMMIT")
+
+    def pausar(self, segundos):
+        hasta = time.time() + segundos
+        self._conexion().execute(
+            "UPDATE cubo SET fichas = 0, actualizado = MAX(pausa_hasta, ?), pausa_hasta = MAX(pausa_hasta, ?) "
+            "WHERE id = 0", (hasta, hasta))
+
+
+class Planificador:
+    """Cola con prioridad delante de un cubo de fichas."""
+
+    def __init__(self, cubo, pausa_max=SPOTIFY_RATE_PAUSE_MAX):
+        # cubo None: sin límite de tasa (solo se respetan los 429)
+        self.cubo = cubo
+        self.pausa_max = pausa_max
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._condicion = threading.Condition()
+        self._cola = []
+        self._orden = itertools.count()
+        self._pausa_hasta = 0.0
+
+    def adquirir(self):
+        """Bloquea hasta que la petición puede salir según su prioridad, el cubo y las pausas."""
+        nivel = _prioridad.get()
+        inicio = time.perf_counter()
+        frenada = False
+        with self._condicion:
+            turno = (nivel, next(self._orden))
+            heapq.heappush(self._cola, turno)
+            try:
+                while True:
+                    if self._cola[0] != turno:
+                        espera = None
+                    else:
+                        espera = self._tomar()
+                        if espera <= 0:
+                            break
+                    frenada = True
+                    self._condicion.wait(espera)
+            finally:
+                self._cola.remove(turno)
+                heapq.heapify(self._cola)
+                self._condicion.notify_all()
+        nombre = NOMBRES_PRIORIDAD.get(nivel, str(nivel))
+        metricas.SPOTIFY_ESPERA.observar(time.perf_counter() - inicio, nombre)
+        if frenada:
+            metricas.SPOTIFY_FRENADAS.inc(nombre)
+
+    def _tomar(self):
+        pausa = self._pausa_hasta - time.monotonic()
+        if self.cubo is None or pausa > 0:
+            return max(0.0, pausa)
+        try:
+            return self.cubo.tomar()
+        except sqlite3.Error as e:
+            # Sin acceso al cubo compartido la petición sale sin esperar
+            print(f"Error leyendo el límite de peticiones a Spotify: {e}")
+            return 0.0
+
+    def pausar(self, segundos):
+        """Detiene todas las peticiones `segundos` (el Retry-After de un 429)."""
+        segundos = min(max(float(segundos), 0.0), self.pausa_max)
+        if not segundos:
+            return
+        metricas.SPOTIFY_PAUSAS.inc()
+        with self._condicion:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+            if self.cubo is not None:
+                try:
+                    self.cubo.pausar(segundos)
+                except sqlite3.Error as e:
+                    print(f"Error guardando la pausa de Spotify: {e}")
+            self._condicion.notify_all()
+
+    def estadisticas(self):
+        with self._condicion:
+            niveles = [nivel for nivel, _ in self._cola]
+        return {nombre: niveles.count(nivel) for nivel, nombre in NOMBRES_PRIORIDAD.items()}
+
+
+def crear_cubo(backend=SPOTIFY_RATE_BACKEND, tasa=SPOTIFY_RATE_LIMIT, rafaga=SPOTIFY_RATE_BURST,
+               path=SPOTIFY_RATE_PATH):
+    if tasa <= 0:
+        return None
+    if backend == 'sqlite':
+        return CuboSQLite(tasa, rafaga, path)
+    return CuboMemoria(tasa, rafaga)
+
+
+# Planificador compartido por toda la app
+planificador = Planificador(crear_cubo())
+
+# Los hilos que esperaban en el proceso maestro no existen en el hijo
+os.register_at_fork(after_in_child=planificador._reiniciar)
@@ -0,0 +1,204 @@
+"""
+Construcción de playlists a partir de las llamadas a la API de Spotify.
+
+Las canciones principales de cada artista se piden en paralelo con un pool de
+hilos acotado en lugar de una tras otra, con un plazo global para toda la
+petición: lo que no haya llegado a tiempo se descarta, igual que antes se
+descartaba un artista que fallaba. Las respuestas de catálogo pasan por la
+caché compartida (cache.catalogo).
+
+escribir_playlist añade canciones a una playlist de cualquier longitud en
+trozos de 100 (el máximo de Spotify por llamada), uno tras otro y desde el hilo
+que la llama (el del trabajo en segundo plano), no en el pool: un trozo frenado
+por un 429 no ocupa los hilos de los que dependen las lecturas de los demás.
+
+Los hilos del pool heredan la prioridad del que los lanza (planificador.py),
+así que el fan-out de un trabajo en segundo plano no adelanta a las páginas.
+Un artista que recibe un 429 se vuelve a pedir, tras la pausa que impone el
+planificador, si aún queda plazo.
+"""
+import contextvars
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from spotipy.exceptions import SpotifyException
+
+from cache import catalogo
+from planificador import planificador
+
+# Llamadas simultáneas a Spotify por proceso y plazo global (segundos) para reunir el pool
+FANOUT_WORKERS = int(os.getenv('SPOTIFY_FANOUT_WORKERS', '8'))
+FANOUT_DEADLINE = float(os.getenv('SPOTIFY_FANOUT_DEADLINE', '8'))
+
+# Canciones por llamada a playlist_add_items (límite de Spotify) y reintentos de un trozo (o de
+# un artista) tras un 429 que la sesión HTTP ya no reintentó
+PLAYLIST_CHUNK = 100
+PLAYLIST_WRITE_RETRIES = int(os.getenv('SPOTIFY_PLAYLIST_WRITE_RETRIES', '4'))
+# Máximo de canciones que el endpoint de recomendaciones devuelve por llamada
+RECOMMENDATIONS_LIMIT = 100
+
+# Los hilos se crean al primer submit, así que el pool no arranca ningún hilo en el
+# proceso maestro de gunicorn (preload) y cada worker tiene los suyos
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='spotify')
+
+
+def _enviar(funcion, *args):
+    """submit al pool con el contexto (la prioridad de las llamadas a Spotify) del hilo que lo lanza."""
+    return _executor.submit(contextvars.copy_context().run, funcion, *args)
+
+
+def construir_pool_canciones(sp, mercado, limite_artistas, limite_canciones=30, plazo=FANOUT_DEADLINE,
+                             cargar_top=None):
+    """
+    Devuelve las canciones principales del usuario más las de sus artistas
+    principales, sin duplicados y en el mismo orden que la versión secuencial.
+
+    `cargar_top(tipo, limite)` ('tracks' o 'artists') permite servir los datos
+    principales del usuario desde una caché; por defecto se piden a Spotify.
+    Las llamadas que fallan o no terminan antes del plazo se ignoran.
+    """
+    if cargar_top is None:
+        def cargar_top(tipo, limite):
+            return getattr(sp, f'current_user_top_{tipo}')(limit=limite, time_range='short_term')
+
+    limite = time.monotonic() + plazo
+    futuro_canciones = _enviar(cargar_top, 'tracks', limite_canciones)
+    futuro_artistas = _enviar(cargar_top, 'artists', limite_artistas)
+
+    # En cuanto llegan los artistas se lanzan sus peticiones, sin esperar a las canciones
+    futuros_artista = []
+    pendientes = {futuro_canciones, futuro_artistas}
+    while futuro_artistas in pendientes:
+        hechos, pendientes = wait(pendientes, timeout=max(0, limite - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not hechos:
+            break
+    if futuro_artistas.done():
+        try:
+            artistas = futuro_artistas.result()['items']
+        except Exception as e:
+            print(f"No se pudieron obtener los artistas principales: {e}")
+            artistas = []
+        artist_ids = [artist['id'] for artist in artistas if artist and artist.get('id')]
+        futuros_artista = [
+            (artist_id, _enviar(top_tracks_artista, sp, artist_id, mercado, limite))
+            for artist_id in artist_ids
+        ]
+    else:
+        print("Plazo agotado esperando los artistas principales.")
+
+    wait([futuro_canciones] + [f for _, f in futuros_artista], timeout=max(0, limite - time.monotonic()))
+
+    track_pool = {}
+    for track in _resultado(futuro_canciones, "las canciones principales", default={'items': []})['items']:
+        if track and track.get('id'):
+            track_pool.setdefault(track['id'], track)
+    for artist_id, futuro in futuros_artista:
+        for track in _resultado(futuro, f"el artista {artist_id}", default={'tracks': []})['tracks']:
+            if track and track.get('id') and track['id'] not in track_pool:
+                track_pool[track['id']] = track
+    return list(track_pool.values())
+
+def top_tracks_artista(sp, artist_id, mercado, limite=None):
+    """
+    Canciones principales de un artista, compartidas entre usuarios del mismo
+    mercado vía la caché de catálogo. Tras un 429 se reintenta mientras la
+    espera (Retry-After o backoff) quepa antes de `limite` (time.monotonic()).
+    """
+    intentos_429 = 0
+    while True:
+        try:
+            return catalogo.obtener('artist_top_tracks', artist_id, mercado,
+                                    lambda: sp.artist_top_tracks(artist_id, country=mercado))
+        except SpotifyException as e:
+            if (e.http_status != 429 or limite is None or intentos_429 >= PLAYLIST_WRITE_RETRIES
+                    or time.monotonic() + _espera_reintento(e, intentos_429) >= limite):
+                raise
+            # La espera la impone el planificador al dejar pasar la siguiente llamada
+            _pausar_sin_retry_after(e, intentos_429)
+            intentos_429 += 1
+
+def _resultado(futuro, descripcion, default):
+    """Devuelve el resultado de una llamada o `default` si falló o no llegó a tiempo."""
+    if not futuro.done():
+        futuro.cancel()
+        print(f"Plazo agotado obteniendo canciones para {descripcion}.")
+        return default
+    try:
+        return futuro.result()
+    except Exception as e:
+        print(f"No se pudieron obtener canciones para {descripcion}: {e}")
+        return default
+
+def recomendaciones(sp, semillas, mercado, cuantas, plazo=FANOUT_DEADLINE):
+    """
+    Hasta `cuantas` URIs recomendadas a partir de `semillas` (ids de canciones),
+    en grupos de 5 semillas (el máximo de Spotify) pedidos en paralelo. Los
+    grupos que fallan se ignoran; si fallan todos se lanza la última excepción.
+    """
+    grupos = [semillas[i:i + 5] for i in range(0, len(semillas), 5)]
+    grupos = grupos[:max(1, math.ceil(cuantas / RECOMMENDATIONS_LIMIT))]
+    por_grupo = min(RECOMMENDATIONS_LIMIT, math.ceil(cuantas / len(grupos)))
+
+    def pedir(grupo):
+        return catalogo.obtener('recommendations', f"{','.join(sorted(grupo))}|{por_grupo}", mercado,
+                                lambda: sp.recommendations(seed_tracks=grupo, limit=por_grupo, market=mercado))
+
+    futuros = [_enviar(pedir, grupo) for grupo in grupos]
+    wait(futuros, timeout=plazo)
+    uris, error = [], None
+    for futuro in futuros:
+        if not futuro.done():
+            futuro.cancel()
+            continue
+        try:
+            uris.extend(t['uri'] for t in futuro.result()['tracks'])
+        except Exception as e:
+            error = e
+    if not uris and error is not None:
+        raise error
+    return list(dict.fromkeys(uris))[:cuantas]
+
+def escribir_playlist(sp, playlist_id, uris, reintentos=PLAYLIST_WRITE_RETRIES):
+    """
+    Añade `uris` al final de la playlist en trozos de PLAYLIST_CHUNK, en orden,
+    así que el orden final es el de la lista sin depender de cómo trata Spotify
+    una posición mayor que la longitud actual. Tras un 429 el trozo se reenvía
+    cuando el planificador deja pasar la siguiente llamada (la pausa del
+    Retry-After, o el backoff si no viene, la aplica él a todas); un 429 no se
+    llegó a escribir, así que reenviarlo no duplica canciones. Lanza la
+    excepción del primer trozo que no se pudo escribir.
+    """
+    for posicion in range(0, len(uris), PLAYLIST_CHUNK):
+        trozo = uris[posicion:posicion + PLAYLIST_CHUNK]
+        intentos_429 = 0
+        while True:
+            try:
+                sp.playlist_add_items(playlist_id, trozo)
+                break
+            except SpotifyException as e:
+                if e.http_status != 429 or intentos_429 >= reintentos:
+                    raise
+                _pausar_sin_retry_after(e, intentos_429)
+                intentos_429 += 1
+
+def _retry_after(error):
+    try:
+        return max(float((error.headers or {}).get('Retry-After')), 0)
+    except (TypeError, ValueError):
+        return None
+
+def _espera_reintento(error, intento):
+    """Segundos a esperar tras un 429: Retry-After si viene, si no backoff exponencial."""
+    retry_after = _retry_after(error)
+    return 2 ** intento if retry_after is None else retry_after
+
+def _pausar_sin_retry_after(error, intento):
+    """
+    Tras un 429 sin Retry-After pausa el planificador con el backoff de
+    _espera_reintento. Con Retry-After no hace falta: cliente_spotify ya lo
+    pausó al recibir el 429, y una segunda pausa se contaría dos veces.
+    """
+    if _retry_after(error) is None:
+        planificador.pausar(_espera_reintento(error, intento))
@@ -0,0 +1,119 @@
+"""
+Entrega de páginas y recursos estáticos.
+
+- La hoja de estilos se sirve desde una URL con la huella de su contenido
+  (/static/estilos.<huella>.css) y Cache-Control inmutable de un año: el
+  navegador la descarga una vez y no vuelve a pedirla hasta que cambie.
+- Las respuestas HTML llevan un ETag débil y responden 304 a un GET
+  condicional, y se comprimen con brotli (si está instalado) o gzip.
+- Las plantillas de Jinja se compilan al arrancar, en el proceso maestro de
+  gunicorn, y no en la primera petición de cada worker.
+"""
+import gzip
+import hashlib
+import os
+
+from flask import Response, abort, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+HOJA_ESTILOS = 'estilos.css'
+
+# Tamaño mínimo (bytes) para comprimir una respuesta; por debajo no compensa
+COMPRESION_MINIMO = int(os.getenv('COMPRESSION_MIN_BYTES', '512'))
+COMPRESION_NIVEL_GZIP = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESION_NIVEL_BROTLI = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+
+_TIPOS_COMPRIMIBLES = ('text/', 'application/json', 'application/javascript')
+
+
+class RecursoEstatico:
+    """Archivo estático leído una vez, con su huella y sus versiones precomprimidas."""
+
+    def __init__(self, path, mimetype):
+        with open(path, 'rb') as f:
+            self.contenido = f.read()
+        self.mimetype = mimetype
+        self.huella = hashlib.sha256(self.contenido).hexdigest()[:12]
+        self.etag = self.huella
+        # Comprimido al máximo una sola vez: todas las peticiones sirven estos bytes
+        self.codificados = {'gzip': gzip.compress(self.contenido, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.codificados['br'] = brotli.compress(self.contenido, quality=11)
+
+    def respuesta(self):
+        codificacion = _elegir_codificacion(self.codificados)
+        cuerpo = self.codificados[codificacion] if codificacion else self.contenido
+        respuesta = Response(cuerpo, mimetype=self.mimetype)
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+        respuesta.headers['Vary'] = 'Accept-Encoding'
+        respuesta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        respuesta.set_etag(self.etag)
+        return respuesta.make_conditional(request)
+
+
+def _elegir_codificacion(disponibles):
+    """Mejor codificación aceptada por el cliente entre las disponibles, o None."""
+    aceptadas = request.accept_encodings
+    for codificacion in ('br', 'gzip'):
+        if codificacion in disponibles and aceptadas[codificacion]:
+            return codificacion
+    return None
+
+def _comprimir(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=COMPRESION_NIVEL_BROTLI)
+    return gzip.compress(datos, compresslevel=COMPRESION_NIVEL_GZIP)
+
+def _preparar_respuesta(respuesta):
+    """ETag, GET condicional y compresión para las respuestas generadas por las vistas."""
+    if (request.method not in ('GET', 'HEAD') or respuesta.status_code != 200
+            or respuesta.direct_passthrough or respuesta.is_streamed
+            or 'Content-Encoding' in respuesta.headers
+            or not respuesta.mimetype.startswith(_TIPOS_COMPRIMIBLES)):
+        return respuesta
+
+    # Las páginas dependen de la sesión: se pueden guardar, pero siempre revalidando
+    respuesta.headers.setdefault('Cache-Control', 'private, no-cache')
+    respuesta.add_etag(weak=True)
+    respuesta.make_conditional(request)
+    if respuesta.status_code == 304:
+        return respuesta
+
+    datos = respuesta.get_data()
+    if len(datos) >= COMPRESION_MINIMO:
+        disponibles = ('br', 'gzip') if brotli is not None else ('gzip',)
+        codificacion = _elegir_codificacion(disponibles)
+        if codificacion:
+            respuesta.set_data(_comprimir(datos, codificacion))
+            respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.vary.add('Accept-Encoding')
+    return respuesta
+
+def init_app(app):
+    """Registra la ruta de la hoja de estilos, el ETag/compresión y precompila las plantillas."""
+    estilos = RecursoEstatico(os.path.join(STATIC_DIR, HOJA_ESTILOS), 'text/css')
+
+    @app.route('/static/estilos.<huella>.css')
+    def hoja_estilos(huella):
+        # Una huella antigua se sigue sirviendo (con el contenido actual) para no romper páginas cacheadas
+        if not huella.isalnum():
+            abort(404)
+        return estilos.respuesta()
+
+    @app.context_processor
+    def _url_estilos():
+        return {'url_estilos': lambda: url_for('hoja_estilos', huella=estilos.huella)}
+
+    app.after_request(_preparar_respuesta)
+
+    # Compilar todas las plantillas ahora: quedan en la caché de Jinja del proceso
+    # y, con preload_app, los workers las heredan ya compiladas
+    for nombre in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(nombre)
+    return estilos
@@ -0,0 +1,246 @@
+"""
+Actualización incremental del modelo con las correcciones de los usuarios.
+
+En /crear-playlist el usuario puede confirmar o corregir el estado de ánimo
+detectado. Cada respuesta se guarda (texto ya limpio y etiqueta correcta) en
+una tabla SQLite local y, cuando hay FEEDBACK_MIN_BATCH pendientes, se encola
+un trabajo (trabajos.py) que:
+
+- Copia el MLP del bundle y lo sigue entrenando con MLPClassifier.partial_fit
+  en mini-lotes, con el vocabulario del vectorizador fijo. Cada lote mezcla
+  correcciones con textos de 'train.tsv' para no olvidar lo aprendido.
+- Valida el modelo nuevo con un conjunto apartado que nunca se entrena: las
+  filas de referencia de 'train.tsv' (una de cada FEEDBACK_HOLDOUT_EVERY) y
+  una de cada FEEDBACK_HOLDOUT_EVERY correcciones. Se descarta la
+  actualización si, en las filas de referencia, queda más de
+  FEEDBACK_MAX_ACCURACY_DROP por debajo de la precisión del último
+  entrenamiento completo (guardada en el bundle, así que las caídas de varias
+  actualizaciones no se acumulan), o si en todo el conjunto apartado empeora
+  más de eso respecto al modelo actual.
+- Escribe el bundle nuevo con la misma escritura atómica que
+  `python modelo.py construir`; cada worker lo recarga al ver que ha cambiado.
+
+Las correcciones aplicadas siguen en la base de datos y `python modelo.py
+construir` las entrena junto a 'train.tsv', así que un entrenamiento completo
+no las pierde siempre que se haga donde está esa base de datos. En un sistema
+de ficheros efímero (un dyno de Heroku, la fase de build) no está: ahí las
+correcciones duran lo que duren el bundle actualizado y la base de datos.
+
+La app importa este módulo para guardar correcciones; scikit-learn y el resto
+del código de entrenamiento solo se importan cuando se aplica una actualización.
+
+    python retroalimentacion.py estado
+    python retroalimentacion.py aplicar
+"""
+import argparse
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+
+from cache import BASE_DIR, ConexionSQLite
+from corpus import DATA_PATH, preparar_corpus
+from inferencia import BUNDLE_PATH
+from texto import limpiar_tweet
+
+FEEDBACK_PATH = os.getenv('FEEDBACK_DB_PATH', os.path.join(BASE_DIR, 'correcciones.sqlite3'))
+# Correcciones pendientes a partir de las cuales se actualiza el modelo
+FEEDBACK_MIN_BATCH = int(os.getenv('FEEDBACK_MIN_BATCH', '32'))
+FEEDBACK_BATCH_SIZE = int(os.getenv('FEEDBACK_BATCH_SIZE', '32'))
+FEEDBACK_EPOCHS = int(os.getenv('FEEDBACK_EPOCHS', '5'))
+# Textos de 'train.tsv' que se repasan por cada corrección
+FEEDBACK_REPLAY_RATIO = float(os.getenv('FEEDBACK_REPLAY_RATIO', '2'))
+# Una de cada N correcciones (y de cada N filas de 'train.tsv') se aparta para validar
+FEEDBACK_HOLDOUT_EVERY = int(os.getenv('FEEDBACK_HOLDOUT_EVERY', '5'))
+# Caída de precisión máxima que se acepta en el conjunto apartado
+FEEDBACK_MAX_ACCURACY_DROP = float(os.getenv('FEEDBACK_MAX_ACCURACY_DROP', '0.01'))
+
+# Estado de ánimo -> etiqueta de 'train.tsv' (la inversa de app.etiqueta_a_mood)
+ETIQUETA_DE_MOOD = {'pozik': 'joy ', 'triste': 'sadness ', 'hasarre': 'anger '}
+
+PENDIENTE, APLICADA, DESCARTADA, VALIDACION = 'pendiente', 'aplicada', 'descartada', 'validacion'
+
+# Lo que guardar_bundle escribe siempre; el resto del bundle son datos extra que se conservan
+_CLAVES_BUNDLE = frozenset(['version', 'sklearn_version', 'data_checksum', 'creado', 'vectorizer', 'mlp',
+                            'label_encoder'])
+
+
+class AlmacenCorrecciones(ConexionSQLite):
+    """Correcciones de los usuarios en SQLite, compartidas por todos los workers."""
+
+    def __init__(self, path=FEEDBACK_PATH, apartar_cada=FEEDBACK_HOLDOUT_EVERY):
+        self.path = path
+        self.apartar_cada = apartar_cada
+        self._local = threading.local()
+        with self._conexion() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS correcciones ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, texto TEXT NOT NULL, etiqueta TEXT NOT NULL, "
+                         "predicha TEXT, estado TEXT NOT NULL, creado REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS correcciones_estado ON correcciones (estado, id)")
+
+    def guardar(self, texto, mood, mood_predicho=None):
+        """
+        Guarda el texto (se limpia aquí) con el estado de ánimo que el usuario
+        dice que es el correcto. Devuelve el número de correcciones pendientes.
+        """
+        if mood not in ETIQUETA_DE_MOOD:
+            raise ValueError(f"Estado de ánimo desconocido: {mood}")
+        texto_limpio = limpiar_tweet(texto)
+        if not texto_limpio.strip():
+            return self.pendientes()
+        conn = self._conexion()
+        cursor = conn.execute(
+            "INSERT INTO correcciones (texto, etiqueta, predicha, estado, creado) VALUES (?, ?, ?, ?, ?)",
+            (texto_limpio, ETIQUETA_DE_MOOD[mood], ETIQUETA_DE_MOOD.get(mood_predicho), PENDIENTE, time.time()))
+        # Una de cada `apartar_cada` no se entrena nunca: sirve para validar las actualizaciones
+        if self.apartar_cada and cursor.lastrowid % self.apartar_cada == 0:
+            conn.execute("UPDATE correcciones SET estado = ? WHERE id = ?", (VALIDACION, cursor.lastrowid))
+        return self.pendientes()
+
+    def pendientes(self):
+        return self._conexion().execute(
+            "SELECT COUNT(*) FROM correcciones WHERE estado = ?", (PENDIENTE,)).fetchone()[0]
+
+    def leer(self, estado, limite=None):
+        """[(id, texto, etiqueta)] con ese estado, de la más antigua a la más reciente."""
+        return self._conexion().execute(
+            "SELECT id, texto, etiqueta FROM correcciones WHERE estado = ? ORDER BY id LIMIT ?",
+            (estado, -1 if limite is None else limite)).fetchall()
+
+    def marcar(self, ids, estado):
+        self._conexion().executemany("UPDATE correcciones SET estado = ? WHERE id = ?", [(estado, i) for i in ids])
+
+    def resumen(self):
+        return dict(self._conexion().execute("SELECT estado, COUNT(*) FROM correcciones GROUP BY estado").fetchall())
+
+
+def entrenar_incremental(vectorizer, mlp, label_encoder, textos, etiquetas, repaso_textos, repaso_etiquetas,
+                         epocas=FEEDBACK_EPOCHS, tam_lote=FEEDBACK_BATCH_SIZE, ratio_repaso=FEEDBACK_REPLAY_RATIO,
+                         semilla=0):
+    """
+    Devuelve una copia de `mlp` entrenada con partial_fit sobre las
+    correcciones, mezclando en cada época `ratio_repaso` textos de repaso por
+    corrección. El MLP original (que puede estar mapeado en solo lectura) no se toca.
+    """
+    from scipy.sparse import vstack
+
+    nuevo = copy.deepcopy(mlp)
+    nuevo.coefs_ = [np.array(c) for c in mlp.coefs_]
+    nuevo.intercepts_ = [np.array(b) for b in mlp.intercepts_]
+    # partial_fit no admite early_stopping; el control lo hace la validación posterior
+    nuevo.set_params(early_stopping=False)
+    # Con early_stopping el MLP no guarda la mejor pérdida de entrenamiento, que partial_fit necesita
+    nuevo.best_loss_ = np.inf
+    nuevo._no_improvement_count = 0
+
+    rng = np.random.default_rng(semilla)
+    X = vectorizer.transform(textos)
+    y = label_encoder.transform(etiquetas)
+    X_repaso = vectorizer.transform(repaso_textos)
+    y_repaso = label_encoder.transform(repaso_etiquetas)
+    n_repaso = min(len(y_repaso), int(round(len(y) * ratio_repaso)))
+    for _ in range(epocas):
+        elegidas = rng.choice(len(y_repaso), size=n_repaso, replace=False) if n_repaso else []
+        X_epoca = vstack([X, X_repaso[elegidas]]).tocsr() if n_repaso else X
+        y_epoca = np.concatenate([y, y_repaso[elegidas]]) if n_repaso else y
+        orden = rng.permutation(len(y_epoca))
+        for inicio in range(0, len(orden), tam_lote):
+            lote = orden[inicio:inicio + tam_lote]
+            nuevo.partial_fit(X_epoca[lote], y_epoca[lote])
+    return nuevo
+
+def actualizar_bundle(almacen, bundle_path=BUNDLE_PATH, data_path=DATA_PATH, max_caida=FEEDBACK_MAX_ACCURACY_DROP,
+                      progreso=None):
+    """
+    Aplica las correcciones pendientes al modelo del bundle. Devuelve un informe
+    (dict) con 'aceptada', las precisiones antes y después en el conjunto
+    apartado y la del modelo nuevo frente a la del último entrenamiento
+    completo en las filas de referencia.
+    """
+    from modelo import FILAS_REFERENCIA_CADA, cargar_bundle, filas_referencia, guardar_bundle, precision
+
+    progreso = progreso or (lambda mensaje, porcentaje: None)
+    pendientes = almacen.leer(PENDIENTE)
+    if not pendientes:
+        return {'aceptada': False, 'motivo': 'No hay correcciones pendientes', 'correcciones': 0}
+    bundle = cargar_bundle(bundle_path, data_path)
+    if bundle is None:
+        return {'aceptada': False, 'motivo': 'No hay un bundle al día', 'correcciones': len(pendientes)}
+    vectorizer, mlp, label_encoder = bundle['vectorizer'], bundle['mlp'], bundle['label_encoder']
+
+    progreso("Preparando los datos", 20)
+    datos = preparar_corpus(data_path)
+    # Las mismas filas que el entrenamiento completo dejó fuera
+    apartada = filas_referencia(len(datos), bundle.get('filas_referencia_cada', FILAS_REFERENCIA_CADA))
+    textos_referencia = datos.textos(apartada)
+    etiquetas_referencia = datos.etiquetas_texto(apartada).tolist()
+    validacion = almacen.leer(VALIDACION)
+    textos_validacion = textos_referencia + [texto for _, texto, _ in validacion]
+    etiquetas_validacion = etiquetas_referencia + [etiqueta for _, _, etiqueta in validacion]
+
+    progreso(f"Entrenando con {len(pendientes)} correcciones", 40)
+    nuevo_mlp = entrenar_incremental(
+        vectorizer, mlp, label_encoder,
+        [texto for _, texto, _ in pendientes], [etiqueta for _, _, etiqueta in pendientes],
+        datos.textos(~apartada), datos.etiquetas_texto(~apartada).tolist())
+
+    progreso("Validando el modelo nuevo", 80)
+    antes = precision(vectorizer, mlp, label_encoder, textos_validacion, etiquetas_validacion)
+    despues = precision(vectorizer, nuevo_mlp, label_encoder, textos_validacion, etiquetas_validacion)
+    referencia = bundle.get('precision_referencia')
+    if referencia is None:
+        # Bundle guardado sin la referencia: la del modelo actual pasa a ser el listón fijo
+        referencia = precision(vectorizer, mlp, label_encoder, textos_referencia, etiquetas_referencia)
+    referencia_despues = precision(vectorizer, nuevo_mlp, label_encoder, textos_referencia, etiquetas_referencia)
+    informe = {'correcciones': len(pendientes), 'validacion': len(textos_validacion),
+               'precision_antes': antes, 'precision_despues': despues,
+               'precision_referencia': referencia, 'precision_referencia_despues': referencia_despues}
+    ids = [id_ for id_, _, _ in pendientes]
+    motivo = None
+    if referencia_despues < referencia - max_caida:
+        motivo = 'La precisión queda por debajo de la del último entrenamiento completo'
+    elif despues < antes - max_caida:
+        motivo = 'La precisión empeora en el conjunto apartado'
+    if motivo:
+        # Se apartan para revisarlas; no se entrenan en el próximo entrenamiento completo
+        almacen.marcar(ids, DESCARTADA)
+        print(f"Actualización del modelo descartada: precisión {antes:.4f} -> {despues:.4f}, "
+              f"referencia {referencia:.4f} -> {referencia_despues:.4f}.")
+        return {**informe, 'aceptada': False, 'motivo': motivo}
+
+    # Se conserva lo que guardó el último entrenamiento completo (precisión de referencia, hiperparámetros)
+    extra = {clave: valor for clave, valor in bundle.items() if clave not in _CLAVES_BUNDLE}
+    extra.update(precision_referencia=referencia,
+                 actualizaciones=bundle.get('actualizaciones', 0) + 1,
+                 correcciones=bundle.get('correcciones', 0) + len(ids))
+    guardar_bundle(vectorizer, nuevo_mlp, label_encoder, bundle['data_checksum'], bundle_path, **extra)
+    almacen.marcar(ids, APLICADA)
+    print(f"Modelo actualizado con {len(ids)} correcciones: precisión {antes:.4f} -> {despues:.4f}.")
+    return {**informe, 'aceptada': True}
+
+
+# Almacén compartido por toda la app
+almacen = AlmacenCorrecciones()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aplica las correcciones de los usuarios al modelo.")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    sub.add_parser('estado', help="Cuenta las correcciones por estado.")
+    sub.add_parser('aplicar', help="Aplica ya las correcciones pendientes.")
+    args = parser.parse_args(argv)
+
+    if args.comando == 'estado':
+        resumen = almacen.resumen()
+        for estado in (PENDIENTE, APLICADA, DESCARTADA, VALIDACION):
+            print(f"{estado}: {resumen.get(estado, 0)}")
+        return 0
+    informe = actualizar_bundle(almacen)
+    print(informe)
+    return 0 if informe['aceptada'] else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
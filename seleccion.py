@@ -0,0 +1,136 @@
+"""
+Selección de canciones para una playlist según el estado de ánimo.
+
+Sustituye a random.sample sobre el pool de canciones:
+
+- Se quitan duplicados por id, por ISRC (la misma grabación publicada en
+  varios álbumes) y por (título, artista principal).
+- Cada canción recibe una puntuación según el ánimo (popularidad y si es una
+  de las canciones principales del propio usuario) y un peso exp(nitidez *
+  puntuación), donde la nitidez crece con la confianza del clasificador: con
+  una predicción dudosa la elección se parece más a un sorteo uniforme.
+- Se eligen k canciones con muestreo ponderado sin reemplazo de
+  Efraimidis-Spirakis (clave log(u)/peso) sobre arrays de NumPy: una pasada
+  para las claves y argpartition para las k mejores, sin ordenar todo el pool.
+- Ningún artista pasa de un máximo de canciones mientras queden otros.
+
+Con `semilla` la elección es determinista.
+"""
+import math
+import os
+
+import numpy as np
+
+# Nitidez con confianza 1 (con confianza 1/3, la de un clasificador sin información, es casi uniforme)
+SELECTION_SHARPNESS = float(os.getenv('SELECTION_SHARPNESS', '3'))
+# Fracción máxima de la playlist que puede ocupar un mismo artista
+SELECTION_ARTIST_SHARE = float(os.getenv('SELECTION_ARTIST_SHARE', '0.15'))
+
+# Peso de cada componente de la puntuación por ánimo
+PERFILES = {
+    # Triste: las canciones de siempre del usuario antes que los éxitos
+    'triste': {'propia': 1.0, 'popularidad': 0.3},
+    # Pozik: canciones conocidas y populares, con algo de descubrimiento
+    'pozik': {'propia': 0.5, 'popularidad': 1.0},
+}
+
+
+class PoolCandidatos:
+    """Pool de canciones sin duplicados con sus atributos en arrays para puntuar y muestrear."""
+
+    def __init__(self, tracks, propias=()):
+        propias = set(propias)
+        ids, titulos, isrcs = set(), set(), set()
+        codigos_artista = {}
+        self.tracks = []
+        popularidad, propia, artista = [], [], []
+        # Una sola pasada: quitar duplicados y reunir los atributos que se puntúan
+        for track in tracks:
+            if not track or not track.get('uri'):
+                continue
+            id_ = track.get('id') or track['uri']
+            id_artista = ((track.get('artists') or [{}])[0] or {}).get('id') or ''
+            nombre = track.get('name')
+            titulo = (nombre.casefold(), id_artista) if nombre else None
+            isrc = (track.get('external_ids') or {}).get('isrc')
+            isrc = isrc.upper() if isrc else None
+            if id_ in ids or (titulo and titulo in titulos) or (isrc and isrc in isrcs):
+                continue
+            ids.add(id_)
+            if titulo:
+                titulos.add(titulo)
+            if isrc:
+                isrcs.add(isrc)
+            self.tracks.append(track)
+            popularidad.append(track.get('popularity') or 0)
+            propia.append(id_ in propias)
+            artista.append(codigos_artista.setdefault(id_artista, len(codigos_artista)))
+
+        self.popularidad = np.array(popularidad, dtype=np.float64) / 100
+        self.propia = np.array(propia, dtype=bool)
+        self.artista = np.array(artista, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def pesos(self, mood, confianza=1.0):
+        """Peso de muestreo de cada canción para el ánimo y la confianza de la predicción."""
+        perfil = PERFILES.get(mood, {})
+        puntuacion = perfil.get('popularidad', 0.0) * self.popularidad + perfil.get('propia', 0.0) * self.propia
+        return np.exp(SELECTION_SHARPNESS * confianza * puntuacion)
+
+    def elegir(self, k, mood, confianza=1.0, semilla=None, excluir=(), max_por_artista=None):
+        """
+        Devuelve hasta `k` canciones del pool (sin las de `excluir`, por URI) por
+        muestreo ponderado, con como mucho `max_por_artista` por artista
+        (por defecto SELECTION_ARTIST_SHARE de k) mientras haya alternativas.
+        """
+        rng = np.random.default_rng(semilla)
+        pesos = self.pesos(mood, confianza)
+        if excluir:
+            excluir = set(excluir)
+            disponibles = np.fromiter((t['uri'] not in excluir for t in self.tracks), dtype=bool, count=len(self))
+            pesos = np.where(disponibles, pesos, 0.0)
+        n = int(np.count_nonzero(pesos))
+        k = min(k, n)
+        if k <= 0:
+            return []
+        if max_por_artista is None:
+            max_por_artista = max(2, math.ceil(k * SELECTION_ARTIST_SHARE))
+
+        # Efraimidis-Spirakis: las k claves log(u)/peso más altas son una muestra ponderada sin reemplazo
+        with np.errstate(divide='ignore'):
+            claves = np.log(rng.random(len(self))) / pesos
+        orden = self._mejores(claves, min(n, k * 4))
+        elegidos = self._con_tope(orden, k, max_por_artista)
+        if len(elegidos) < k and len(orden) < n:
+            orden = self._mejores(claves, n)
+            elegidos = self._con_tope(orden, k, max_por_artista)
+        if len(elegidos) < k:
+            # No hay artistas suficientes para respetar el tope: se completa en orden de clave
+            ya = set(elegidos)
+            elegidos += [i for i in orden if i not in ya][:k - len(elegidos)]
+        return [self.tracks[i] for i in elegidos]
+
+    @staticmethod
+    def _mejores(claves, m):
+        """Índices de las m claves más altas, ordenados de mayor a menor."""
+        if m < len(claves):
+            indices = np.argpartition(claves, len(claves) - m)[len(claves) - m:]
+        else:
+            indices = np.arange(len(claves))
+        return indices[np.argsort(-claves[indices], kind='stable')].tolist()
+
+    def _con_tope(self, orden, k, max_por_artista):
+        elegidos = []
+        por_artista = {}
+        artista = self.artista
+        for i in orden:
+            a = artista[i]
+            if por_artista.get(a, 0) >= max_por_artista:
+                continue
+            por_artista[a] = por_artista.get(a, 0) + 1
+            elegidos.append(i)
+            if len(elegidos) == k:
+                break
+        return elegidos
@@ -0,0 +1,142 @@
+"""
+Sesiones guardadas en el servidor.
+
+La cookie de sesión solo lleva un identificador opaco y aleatorio; los datos
+(token_info, etc.) se guardan en un backend de cache.py:
+
+- 'sqlite' (por defecto): un archivo compartido por todos los workers de
+  gunicorn de la máquina, así que cualquier worker atiende cualquier sesión
+  aunque cada uno tenga un SECRET_KEY distinto.
+- 'memoria': por proceso; solo sirve con un único worker.
+
+Los datos solo se escriben cuando la sesión cambia, las sesiones caducan
+SESSION_TTL segundos después de la última escritura y las caducadas se borran
+cada SESSION_SWEEP_INTERVAL segundos. Al vaciar la sesión (login, logout) se
+descarta el identificador y se emite uno nuevo.
+"""
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import BASE_DIR, crear_backend
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite')
+SESSION_PATH = os.getenv('SESSION_PATH', os.path.join(BASE_DIR, 'sesiones.sqlite3'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(30 * 24 * 3600)))
+SESSION_MAX = int(os.getenv('SESSION_MAX', '100000'))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '600'))
+
+
+class SesionServidor(CallbackDict, SessionMixin):
+    """Sesión cuyo contenido vive en el servidor; `sid` es lo único que va en la cookie."""
+
+    def __init__(self, datos=None, sid=None):
+        def al_modificar(self):
+            self.modified = True
+        super().__init__(datos, al_modificar)
+        self.sid = sid
+        self.modified = False
+        # Al vaciarla se cambia el identificador para no reutilizarlo tras un login o logout
+        self.regenerar = False
+
+    def clear(self):
+        super().clear()
+        self.regenerar = True
+
+
+class InterfazSesiones(SessionInterface):
+    """SessionInterface de Flask que guarda los datos en un backend de cache.py."""
+
+    def __init__(self, backend, ttl=SESSION_TTL, intervalo_purga=SESSION_SWEEP_INTERVAL):
+        self.backend = backend
+        self.ttl = ttl
+        self.intervalo_purga = intervalo_purga
+        self._proxima_purga = time.monotonic() + intervalo_purga
+        self._lock = threading.Lock()
+
+    def _clave(self, sid):
+        return f"sesion|{sid}"
+
+    def leer(self, sid):
+        """Datos de la sesión `sid`, o None si no existe o ha caducado (para usarlos fuera de una petición)."""
+        return self.backend.obtener(self._clave(sid))
+
+    def crear(self, datos):
+        """Guarda una sesión nueva con `datos` y devuelve el identificador que va en la cookie."""
+        sid = secrets.token_urlsafe(32)
+        self.backend.guardar(self._clave(sid), dict(datos), ttl=self.ttl)
+        return sid
+
+    def open_session(self, app, request):
+        # Los recursos estáticos no usan la sesión: no se consulta el backend
+        if request.path.startswith(app.static_url_path + '/'):
+            return self.make_null_session(app)
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            datos = self.backend.obtener(self._clave(sid))
+            if datos is not None:
+                return SesionServidor(dict(datos), sid=sid)
+        return SesionServidor()
+
+    def make_null_session(self, app):
+        return SesionServidor()
+
+    def save_session(self, app, session, response):
+        self._purgar_si_toca()
+        nombre = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        ruta = self.get_cookie_path(app)
+
+        if session.sid and (session.regenerar or not session):
+            self.backend.borrar(self._clave(session.sid))
+            if not session:
+                response.delete_cookie(nombre, domain=dominio, path=ruta,
+                                       secure=self.get_cookie_secure(app),
+                                       httponly=self.get_cookie_httponly(app),
+                                       samesite=self.get_cookie_samesite(app))
+                return
+            session.sid = None
+
+        if not session or not session.modified and session.sid:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        self.backend.guardar(self._clave(session.sid), dict(session), ttl=self.ttl)
+        response.vary.add('Cookie')
+        response.set_cookie(
+            nombre, session.sid,
+            expires=datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+            httponly=self.get_cookie_httponly(app),
+            domain=dominio,
+            path=ruta,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def _purgar_si_toca(self):
+        if time.monotonic() < self._proxima_purga:
+            return
+        with self._lock:
+            if time.monotonic() < self._proxima_purga:
+                return
+            self._proxima_purga = time.monotonic() + self.intervalo_purga
+        try:
+            borradas = self.backend.purgar()
+        except Exception as e:
+            print(f"No se pudieron purgar las sesiones caducadas: {e}")
+            return
+        if borradas:
+            print(f"Sesiones caducadas borradas: {borradas}")
+
+
+def init_app(app):
+    """Sustituye la sesión de cookie firmada de Flask por la sesión en el servidor."""
+    backend = crear_backend(SESSION_BACKEND, SESSION_PATH, SESSION_MAX, SESSION_TTL, tabla='sesiones')
+    app.session_interface = InterfazSesiones(backend)
+    return app.session_interface
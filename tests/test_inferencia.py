@@ -0,0 +1,63 @@
+"""
+MotorInferencia debe predecir exactamente lo mismo que el vectorizador y el
+MLP de scikit-learn de los que se exporta. Se entrena un modelo pequeño sobre
+'train.tsv' en el propio test, así que no necesita el bundle del modelo.
+"""
+import csv
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.neural_network import MLPClassifier
+from sklearn.preprocessing import LabelEncoder
+
+from inferencia import MotorInferencia
+from texto import limpiar_tweet
+from vocabulario import SPANISH_STOPWORDS, IndiceVocabulario
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'train.tsv')
+# Filas con las que se entrena el modelo pequeño; se predicen todas
+FILAS_ENTRENAMIENTO = 2000
+
+
+@pytest.fixture(scope='module')
+def datos():
+    with open(DATA_PATH, encoding='utf-8', newline='') as f:
+        # Columnas id, tweet y label (la cabecera y las etiquetas llevan un espacio al final)
+        filas = list(csv.reader(f, delimiter='\t'))[1:]
+    textos = [limpiar_tweet(tweet) for _, tweet, _ in filas]
+    # Textos sin ninguna palabra del vocabulario: la salida es solo el sesgo de la capa oculta
+    textos += ['', 'zzzz qqqq']
+    return textos, [etiqueta for _, _, etiqueta in filas]
+
+def entrenar(textos, etiquetas, oculta, activacion):
+    indice = IndiceVocabulario.desde_textos(textos[:FILAS_ENTRENAMIENTO], etiquetas[:FILAS_ENTRENAMIENTO])
+    vectorizer = TfidfVectorizer(vocabulary=indice.top_por_etiqueta(300, stopwords=SPANISH_STOPWORDS))
+    X = vectorizer.fit_transform(textos[:FILAS_ENTRENAMIENTO])
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(etiquetas[:FILAS_ENTRENAMIENTO])
+    mlp = MLPClassifier(hidden_layer_sizes=oculta, activation=activacion, learning_rate_init=0.01, max_iter=50,
+                        random_state=0)
+    mlp.fit(X, y)
+    return vectorizer, mlp, label_encoder
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+@pytest.mark.parametrize('oculta, activacion', [((16,), 'logistic'), ((16,), 'relu'), ((16, 8), 'tanh')])
+def test_motor_predice_igual_que_sklearn(datos, tmp_path, oculta, activacion):
+    textos, etiquetas = datos
+    vectorizer, mlp, label_encoder = entrenar(textos, etiquetas, oculta, activacion)
+    X = vectorizer.transform(textos)
+    esperadas = label_encoder.inverse_transform(mlp.predict(X)).tolist()
+    # Un modelo que predice siempre lo mismo no comprobaría nada
+    assert len(set(esperadas)) > 1
+
+    motor = MotorInferencia.desde_sklearn(vectorizer, mlp, label_encoder)
+    ruta = str(tmp_path / 'modelo.motor.joblib')
+    motor.guardar(ruta, data_checksum='prueba')
+    for m in (motor, MotorInferencia.cargar(ruta, data_checksum='prueba')):
+        assert [m.predecir(texto) for texto in textos] == esperadas
+        np.testing.assert_allclose(m.probabilidades_lote(textos), mlp.predict_proba(X), rtol=1e-9, atol=1e-12)
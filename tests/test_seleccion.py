@@ -0,0 +1,71 @@
+"""
+PoolCandidatos: elección determinista con semilla, duplicados por id, ISRC y
+título, tope de canciones por artista, `excluir` y k mayor que el pool.
+"""
+from seleccion import PoolCandidatos
+
+
+def track(n, artista=None, nombre=None, isrc=None, id_=None, popularidad=50):
+    id_ = id_ or f't{n}'
+    return {
+        'id': id_,
+        'uri': f'spotify:track:{id_}',
+        'name': nombre or f'Canción {n}',
+        'artists': [{'id': artista or f'a{n}'}],
+        'external_ids': {'isrc': isrc} if isrc else {},
+        'popularity': popularidad,
+    }
+
+def uris(tracks):
+    return [t['uri'] for t in tracks]
+
+
+def test_misma_semilla_misma_eleccion():
+    candidatos = PoolCandidatos([track(n, artista=f'a{n % 40}', popularidad=n % 100) for n in range(500)])
+    primera = candidatos.elegir(50, 'triste', confianza=0.8, semilla=7)
+    assert len(primera) == 50
+    assert uris(primera) == uris(candidatos.elegir(50, 'triste', confianza=0.8, semilla=7))
+    assert uris(primera) != uris(candidatos.elegir(50, 'triste', confianza=0.8, semilla=8))
+
+def test_quita_duplicados_por_id_isrc_y_titulo():
+    candidatos = PoolCandidatos([
+        track(1, isrc='ESAAA0000001'),
+        # Mismo id, o mismo ISRC en otro álbum (sin distinguir mayúsculas)
+        track(2, id_='t1'),
+        track(3, isrc='esaaa0000001'),
+        # Mismo título y artista principal (sin distinguir mayúsculas)
+        track(4, artista='b', nombre='Hola'),
+        track(5, artista='b', nombre='HOLA'),
+        # Mismo título con otro artista: no es un duplicado
+        track(6, artista='c', nombre='Hola'),
+        # Sin URI no se puede añadir a una playlist
+        {'id': 'sin-uri', 'name': 'Nada'},
+        None,
+    ])
+    assert [t['id'] for t in candidatos.tracks] == ['t1', 't4', 't6']
+
+def test_tope_por_artista():
+    tracks = [track(n, artista='prolifico', popularidad=100) for n in range(30)]
+    tracks += [track(100 + n, artista=f'otro{n}', popularidad=0) for n in range(30)]
+    candidatos = PoolCandidatos(tracks)
+    elegidas = candidatos.elegir(20, 'pozik', semilla=1, max_por_artista=3)
+    assert len(elegidas) == 20
+    assert sum(t['artists'][0]['id'] == 'prolifico' for t in elegidas) == 3
+
+def test_tope_por_artista_se_completa_sin_alternativas():
+    candidatos = PoolCandidatos([track(n, artista='unico') for n in range(10)])
+    assert len(candidatos.elegir(6, 'pozik', semilla=1, max_por_artista=2)) == 6
+
+def test_excluir():
+    tracks = [track(n) for n in range(20)]
+    candidatos = PoolCandidatos(tracks)
+    excluidas = set(uris(tracks[:15]))
+    elegidas = candidatos.elegir(10, 'triste', semilla=3, excluir=excluidas)
+    assert sorted(uris(elegidas)) == sorted(uris(tracks[15:]))
+
+def test_k_mayor_que_el_pool():
+    tracks = [track(n) for n in range(8)]
+    candidatos = PoolCandidatos(tracks)
+    elegidas = candidatos.elegir(50, 'pozik', semilla=0)
+    assert sorted(uris(elegidas)) == sorted(uris(tracks))
+    assert PoolCandidatos([]).elegir(5, 'pozik', semilla=0) == []
@@ -0,0 +1,60 @@
+"""
+limpiar_tweet debe dar exactamente la misma salida que la implementación
+original en cuatro pasadas (limpiar_tweet_referencia). No necesita ningún
+bundle del modelo: se comprueba sobre casos límite fijos y todas las filas de
+'train.tsv'.
+"""
+import csv
+import os
+
+import pytest
+
+from texto import limpiar_serie, limpiar_tweet, limpiar_tweet_referencia
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'train.tsv')
+
+CASOS_LIMITE = [
+    '',
+    '   ',
+    'Hola   MUNDO',
+    'HASHTAG',
+    'Feliz HASHTAG y HASHTAG!',
+    'mira https://t.co/AiaaGdxmQO ya',
+    'mira www.ejemplo.com/ruta?x=1 ya',
+    '@usuario hola @otro_usuario',
+    '@usuariohttps://t.co/abc pegada',
+    '@usuariowww.ejemplo.com pegada',
+    'htHASHTAGtp://t.co/abc unida al quitar HASHTAG',
+    '@usHASHTAGuario unida al quitar HASHTAG',
+    '¡¿Qué tal?! Ñandú, pingüino, acción…',
+    'emojis 😀😢 y #etiqueta',
+    'números 123 y guiones_bajos_',
+    'tab\tsalto\nde línea',
+    12345,
+]
+
+
+def tweets_train():
+    with open(DATA_PATH, encoding='utf-8', newline='') as f:
+        return [fila['tweet'] for fila in csv.DictReader(f, delimiter='\t')]
+
+
+@pytest.mark.parametrize('texto', CASOS_LIMITE)
+def test_limpiar_tweet_casos_limite(texto):
+    assert limpiar_tweet(texto) == limpiar_tweet_referencia(texto)
+
+
+def test_limpiar_tweet_train():
+    tweets = tweets_train()
+    assert tweets
+    distintos = [t for t in tweets if limpiar_tweet(t) != limpiar_tweet_referencia(t)]
+    assert distintos == []
+
+
+def test_limpiar_serie_train():
+    pd = pytest.importorskip('pandas')
+    tweets = pd.Series(tweets_train() + CASOS_LIMITE, name='tweet')
+    limpios = limpiar_serie(tweets)
+    assert limpios.name == 'tweet'
+    assert limpios.index.equals(tweets.index)
+    assert limpios.tolist() == [limpiar_tweet_referencia(t) for t in tweets]
@@ -0,0 +1,41 @@
+"""
+Normalización de texto compartida por el entrenamiento y la app.
+
+limpiar_tweet hace en una sola pasada de una expresión regular precompilada lo
+que antes eran cuatro re.sub encadenados (URLs, menciones, signos de
+puntuación) y después colapsa espacios y pasa a minúsculas. El resultado es
+idéntico al de la implementación original, que se conserva en
+limpiar_tweet_referencia para poder comprobarlo (tests/test_texto.py y
+'python modelo.py verificar').
+"""
+import re
+
+# Una sola pasada: URLs, menciones y cualquier carácter que no sea letra, dígito o espacio.
+# La mención se detiene antes de un 'http...' o 'www....' pegado a ella para que, como en
+# la versión original (que borraba las URLs antes que las menciones), la URL se borre entera.
+_PATRON_LIMPIEZA = re.compile(r"http\S+|www\.\S+|@(?:(?!http\S|www\.\S)\w)+|[^\w\s]")
+_borrar = _PATRON_LIMPIEZA.sub
+
+
+def limpiar_tweet(texto):
+    """Limpia el texto de entrada para que coincida con el preprocesamiento del modelo."""
+    # Quitar la palabra HASHTAG antes de la expresión regular: al quitarla pueden quedar
+    # unidas partes de una URL o una mención, igual que en la versión original
+    texto = str(texto).replace('HASHTAG', '')
+    return ' '.join(_borrar('', texto).split()).lower()
+
+def limpiar_serie(serie):
+    """Versión por lotes de limpiar_tweet para una Series de pandas (conserva índice y nombre)."""
+    borrar = _borrar
+    limpios = [' '.join(borrar('', str(texto).replace('HASHTAG', '')).split()).lower() for texto in serie]
+    return type(serie)(limpios, index=serie.index, name=serie.name)
+
+def limpiar_tweet_referencia(texto):
+    """Implementación original en cuatro pasadas; solo se usa para verificar limpiar_tweet."""
+    texto = str(texto)
+    texto = texto.replace('HASHTAG', '')
+    texto = re.sub(r"http\S+|www\.\S+", "", texto)
+    texto = re.sub(r"@\w+", "", texto)
+    texto = re.sub(r"[^\w\sáéíóúüñÁÉÍÓÚÜÑ]", "", texto)
+    texto = re.sub(r"\s+", " ", texto).strip()
+    return texto.lower()
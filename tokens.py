@@ -0,0 +1,135 @@
+"""
+Renovación de tokens de acceso de Spotify.
+
+GestorTokens sustituye a la comprobación is_token_expired + refresh_access_token
+que se hacía en cada petición:
+
+- Single-flight: si varias peticiones del mismo usuario (pestañas, reintentos)
+  necesitan renovar a la vez, solo una llama a accounts.spotify.com y las demás
+  esperan su resultado.
+- Renovación proactiva: cuando al token le quedan menos de TOKEN_REFRESH_MARGIN
+  segundos se renueva en segundo plano y la petición sigue con el token actual,
+  que aún es válido. Solo se bloquea una petición si el token ya ha caducado.
+- El token renovado se guarda en memoria con clave el refresh token, así que
+  las peticiones que aún traen el token antiguo en su sesión reciben el nuevo.
+
+Se cuentan las renovaciones, los fallos y su latencia (estadisticas()).
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cliente_spotify
+import metricas
+from cache import CacheMemoria
+
+# Segundos antes de la caducidad a partir de los cuales se renueva en segundo plano
+TOKEN_REFRESH_MARGIN = float(os.getenv('TOKEN_REFRESH_MARGIN', '300'))
+# Margen con el que un token se considera ya caducado (el mismo que usa spotipy)
+TOKEN_EXPIRY_SKEW = float(os.getenv('TOKEN_EXPIRY_SKEW', '60'))
+# Tras un fallo en segundo plano, no se vuelve a intentar hasta pasados estos segundos
+TOKEN_RETRY_AFTER_FAILURE = float(os.getenv('TOKEN_RETRY_AFTER_FAILURE', '30'))
+TOKEN_REFRESH_WORKERS = int(os.getenv('TOKEN_REFRESH_WORKERS', '2'))
+
+
+class GestorTokens:
+    """Renueva los tokens de cada usuario una sola vez y antes de que caduquen."""
+
+    def __init__(self, renovar, margen=TOKEN_REFRESH_MARGIN, skew=TOKEN_EXPIRY_SKEW,
+                 espera_fallo=TOKEN_RETRY_AFTER_FAILURE, max_usuarios=10000):
+        # renovar(refresh_token) -> token_info nuevo (con 'expires_at')
+        self.renovar = renovar
+        self.margen = margen
+        self.skew = skew
+        self.espera_fallo = espera_fallo
+        self._renovados = CacheMemoria(max_entradas=max_usuarios, ttl=3600)
+        self._fallos_recientes = CacheMemoria(max_entradas=max_usuarios, ttl=espera_fallo)
+        self._en_vuelo = {}
+        self._lock = threading.Lock()
+        # Los hilos se crean en el primer submit, ya dentro de cada worker
+        self._executor = ThreadPoolExecutor(max_workers=TOKEN_REFRESH_WORKERS, thread_name_prefix='tokens')
+        self.renovaciones = 0
+        self.fallos = 0
+        self.latencia_total = 0.0
+        self.latencia_max = 0.0
+
+    @staticmethod
+    def _clave(token_info):
+        # No se guarda el refresh token en claro como clave
+        return hashlib.sha256(token_info['refresh_token'].encode()).hexdigest()
+
+    def vigente(self, token_info):
+        """
+        Devuelve un token válido para `token_info`: el mismo, uno ya renovado por
+        otra petición o uno recién renovado si había caducado. Lanza la excepción
+        de la renovación si el token caducado no se pudo renovar.
+        """
+        clave = self._clave(token_info)
+        renovado = self._renovados.obtener(clave)
+        if renovado is not None and renovado['expires_at'] > token_info['expires_at']:
+            token_info = renovado
+
+        restante = token_info['expires_at'] - time.time()
+        if restante < self.skew:
+            return self._renovar_una_vez(clave, token_info).result()
+        if restante < self.margen and self._fallos_recientes.obtener(clave) is None:
+            self._renovar_una_vez(clave, token_info)
+        return token_info
+
+    def _renovar_una_vez(self, clave, token_info):
+        """Future con la renovación en curso para `clave`, lanzándola si no hay ninguna."""
+        with self._lock:
+            futuro = self._en_vuelo.get(clave)
+            if futuro is None:
+                futuro = Future()
+                self._en_vuelo[clave] = futuro
+                self._executor.submit(self._renovar, clave, token_info['refresh_token'], futuro)
+        return futuro
+
+    def _renovar(self, clave, refresh_token, futuro):
+        inicio = time.perf_counter()
+        try:
+            nuevo = self.renovar(refresh_token)
+        except Exception as e:
+            with self._lock:
+                self.fallos += 1
+                del self._en_vuelo[clave]
+            self._fallos_recientes.guardar(clave, True)
+            print(f"Error renovando el token de acceso: {e}")
+            futuro.set_exception(e)
+            return
+        latencia = time.perf_counter() - inicio
+        metricas.ETAPAS.observar(latencia, 'token_refresh')
+        self._renovados.guardar(clave, nuevo, ttl=max(nuevo['expires_at'] - time.time(), 0))
+        with self._lock:
+            self.renovaciones += 1
+            self.latencia_total += latencia
+            self.latencia_max = max(self.latencia_max, latencia)
+            del self._en_vuelo[clave]
+        futuro.set_result(nuevo)
+
+    def estadisticas(self):
+        return {
+            'renovaciones': self.renovaciones,
+            'fallos': self.fallos,
+            'latencia_media': self.latencia_total / self.renovaciones if self.renovaciones else 0.0,
+            'latencia_max': self.latencia_max,
+            'en_vuelo': len(self._en_vuelo),
+        }
+
+    def _reiniciar_tras_fork(self):
+        # Un fork con una renovación en curso dejaría el lock o el Future colgados en el hijo
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self._executor = ThreadPoolExecutor(max_workers=TOKEN_REFRESH_WORKERS, thread_name_prefix='tokens')
+
+
+def _renovar_spotify(refresh_token):
+    return cliente_spotify.oauth().refresh_access_token(refresh_token)
+
+# Gestor compartido por toda la app
+gestor = GestorTokens(_renovar_spotify)
+
+os.register_at_fork(after_in_child=gestor._reiniciar_tras_fork)
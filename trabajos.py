@@ -0,0 +1,223 @@
+"""
+Cola de trabajos en segundo plano sin broker externo.
+
+Los trabajos se guardan en una tabla SQLite compartida por todos los workers de
+gunicorn de la máquina y los ejecutan hilos dentro de esos mismos procesos: la
+petición que encola recibe un id al instante y el cliente consulta el estado
+(JSON o Server-Sent Events) hasta que el trabajo termina.
+
+Cada tipo de trabajo se registra con `cola.registrar(tipo, funcion)`; la
+función recibe los parámetros y un callback `progreso(mensaje, porcentaje)` y
+devuelve un resultado serializable a JSON. Un trabajo que lanza una excepción
+queda en estado 'error' con el mensaje. Mientras un trabajo se ejecuta, un hilo
+de latidos renueva su 'actualizado' cada TRABAJOS_LATIDO segundos aunque no
+informe de progreso. Los trabajos que estaban en curso en un proceso que murió
+no se repiten (crear una playlist no es idempotente): pasan a 'error' cuando su
+latido supera TRABAJOS_TIMEOUT.
+
+Los hilos se arrancan en cada worker al iniciarse (gunicorn.conf.py) o en su
+primera petición, así que los trabajos que quedaron pendientes antes de un
+reinicio se recogen sin esperar a que alguien encole otro. Al arrancar se hace
+también una primera limpieza.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from cache import BASE_DIR, ConexionSQLite
+
+TRABAJOS_PATH = os.getenv('JOBS_DB_PATH', os.path.join(BASE_DIR, 'trabajos.sqlite3'))
+# Hilos que ejecutan trabajos en cada proceso
+TRABAJOS_HILOS = int(os.getenv('JOBS_WORKERS', '2'))
+# Cada cuánto (segundos) miran los hilos si hay trabajos encolados por otro proceso
+TRABAJOS_SONDEO = float(os.getenv('JOBS_POLL_INTERVAL', '0.5'))
+# Un trabajo en curso sin actualizar durante estos segundos se da por perdido
+TRABAJOS_TIMEOUT = float(os.getenv('JOBS_TIMEOUT', '300'))
+# Cada cuánto (segundos) se renueva el latido de los trabajos en curso de cada proceso
+TRABAJOS_LATIDO = float(os.getenv('JOBS_HEARTBEAT_INTERVAL', '30'))
+# Los trabajos terminados se borran pasado este tiempo
+TRABAJOS_RETENCION = float(os.getenv('JOBS_RETENTION', str(24 * 3600)))
+
+PENDIENTE, EN_CURSO, TERMINADO, ERROR = 'pendiente', 'en_curso', 'terminado', 'error'
+ESTADOS_FINALES = (TERMINADO, ERROR)
+
+
+class ColaTrabajos(ConexionSQLite):
+    """Cola persistente en SQLite con un pool de hilos por proceso."""
+
+    def __init__(self, path=TRABAJOS_PATH, hilos=TRABAJOS_HILOS, sondeo=TRABAJOS_SONDEO,
+                 timeout=TRABAJOS_TIMEOUT, retencion=TRABAJOS_RETENCION, latido=TRABAJOS_LATIDO):
+        self.path = path
+        self.hilos = hilos
+        self.sondeo = sondeo
+        self.timeout = timeout
+        self.retencion = retencion
+        self.latido = latido
+        self._funciones = {}
+        # Ids de los trabajos que se están ejecutando en este proceso
+        self._en_curso = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._aviso = threading.Event()
+        self._pid_hilos = None
+        self._proxima_limpieza = 0.0
+        with self._conexion() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS trabajos ("
+                         "id TEXT PRIMARY KEY, tipo TEXT NOT NULL, propietario TEXT, parametros TEXT NOT NULL, "
+                         "estado TEXT NOT NULL, mensaje TEXT NOT NULL DEFAULT '', porcentaje INTEGER NOT NULL DEFAULT 0, "
+                         "resultado TEXT, error TEXT, creado REAL NOT NULL, actualizado REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado)")
+
+    def registrar(self, tipo, funcion):
+        self._funciones[tipo] = funcion
+
+    def encolar(self, tipo, parametros, propietario=None):
+        """Guarda un trabajo pendiente y devuelve su id."""
+        if tipo not in self._funciones:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        id_ = secrets.token_urlsafe(16)
+        ahora = time.time()
+        self._conexion().execute(
+            "INSERT INTO trabajos (id, tipo, propietario, parametros, estado, mensaje, creado, actualizado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (id_, tipo, propietario, json.dumps(parametros), PENDIENTE, 'En cola', ahora, ahora))
+        self.arrancar()
+        self._aviso.set()
+        return id_
+
+    def encolar_unico(self, tipo, parametros, propietario=None):
+        """Como encolar, pero no hace nada (devuelve None) si ya hay uno de ese tipo pendiente o en curso."""
+        if tipo not in self._funciones:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        id_ = secrets.token_urlsafe(16)
+        ahora = time.time()
+        # Comprobar e insertar en la misma sentencia: dos procesos no pueden encolar ambos
+        cursor = self._conexion().execute(
+            "INSERT INTO trabajos (id, tipo, propietario, parametros, estado, mensaje, creado, actualizado) "
+            "SELECT ?, ?, ?, ?, ?, ?, ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM trabajos WHERE tipo = ? AND estado IN (?, ?))",
+            (id_, tipo, propietario, json.dumps(parametros), PENDIENTE, 'En cola', ahora, ahora,
+             tipo, PENDIENTE, EN_CURSO))
+        if not cursor.rowcount:
+            return None
+        self.arrancar()
+        self._aviso.set()
+        return id_
+
+    def estado(self, id_, propietario=None):
+        """Estado del trabajo como dict, o None si no existe o es de otro propietario."""
+        fila = self._conexion().execute(
+            "SELECT id, tipo, propietario, estado, mensaje, porcentaje, resultado, error, creado, actualizado "
+            "FROM trabajos WHERE id = ?", (id_,)).fetchone()
+        if fila is None or (propietario is not None and fila[2] != propietario):
+            return None
+        return {
+            'id': fila[0],
+            'tipo': fila[1],
+            'estado': fila[3],
+            'mensaje': fila[4],
+            'porcentaje': fila[5],
+            'resultado': json.loads(fila[6]) if fila[6] else None,
+            'error': fila[7],
+            'creado': fila[8],
+            'actualizado': fila[9],
+        }
+
+    def arrancar(self):
+        """Arranca los hilos de este proceso si aún no lo están (después del fork de gunicorn)."""
+        if self._pid_hilos == os.getpid():
+            return
+        with self._lock:
+            if self._pid_hilos == os.getpid():
+                return
+            self._pid_hilos = os.getpid()
+            # Los del proceso padre no se ejecutan aquí; la primera vuelta de cada hilo hace la limpieza
+            self._en_curso = set()
+            self._proxima_limpieza = 0.0
+            for i in range(self.hilos):
+                threading.Thread(target=self._bucle, name=f'trabajos-{i}', daemon=True).start()
+            threading.Thread(target=self._latir, name='trabajos-latido', daemon=True).start()
+
+    def _bucle(self):
+        while True:
+            try:
+                self._mantenimiento()
+                trabajo = self._reclamar()
+            except sqlite3.Error as e:
+                print(f"Error leyendo la cola de trabajos: {e}")
+                trabajo = None
+            if trabajo is None:
+                self._aviso.wait(self.sondeo)
+                self._aviso.clear()
+                continue
+            try:
+                self._ejecutar(*trabajo)
+            except Exception as e:
+                # El hilo no debe morir: el trabajo queda en curso y el timeout lo da por perdido
+                print(f"Error inesperado ejecutando el trabajo {trabajo[0]}: {e}")
+
+    def _latir(self):
+        """Renueva 'actualizado' de los trabajos en curso de este proceso, informen o no de progreso."""
+        while True:
+            time.sleep(self.latido)
+            ids = list(self._en_curso)
+            if not ids:
+                continue
+            try:
+                self._conexion().execute(
+                    f"UPDATE trabajos SET actualizado = ? WHERE estado = ? AND id IN ({', '.join('?' * len(ids))})",
+                    (time.time(), EN_CURSO, *ids))
+            except sqlite3.Error as e:
+                print(f"Error renovando el latido de los trabajos: {e}")
+
+    def _reclamar(self):
+        """Marca como en curso el trabajo pendiente más antiguo y lo devuelve, o None."""
+        fila = self._conexion().execute(
+            "UPDATE trabajos SET estado = ?, mensaje = 'Empezando', actualizado = ? "
+            "WHERE id = (SELECT id FROM trabajos WHERE estado = ? ORDER BY creado LIMIT 1) AND estado = ? "
+            "RETURNING id, tipo, parametros",
+            (EN_CURSO, time.time(), PENDIENTE, PENDIENTE)).fetchone()
+        return fila
+
+    def _ejecutar(self, id_, tipo, parametros):
+        def progreso(mensaje, porcentaje):
+            self._actualizar(id_, mensaje=mensaje, porcentaje=int(porcentaje))
+
+        self._en_curso.add(id_)
+        try:
+            resultado = self._funciones[tipo](json.loads(parametros), progreso)
+            self._actualizar(id_, estado=TERMINADO, mensaje='Terminado', porcentaje=100,
+                             resultado=json.dumps(resultado))
+        except Exception as e:
+            print(f"El trabajo {tipo} {id_} ha fallado: {e}")
+            try:
+                self._actualizar(id_, estado=ERROR, error=str(e) or type(e).__name__)
+            except sqlite3.Error as error_bd:
+                # Sin latido, _mantenimiento lo pasará a 'error' pasado el timeout
+                print(f"No se pudo guardar el error del trabajo {id_}: {error_bd}")
+        finally:
+            self._en_curso.discard(id_)
+
+    def _actualizar(self, id_, **campos):
+        campos['actualizado'] = time.time()
+        columnas = ', '.join(f"{c} = ?" for c in campos)
+        self._conexion().execute(f"UPDATE trabajos SET {columnas} WHERE id = ?", (*campos.values(), id_))
+
+    def _mantenimiento(self):
+        """Da por perdidos los trabajos sin latido y borra los terminados antiguos (como mucho una vez por minuto)."""
+        ahora = time.time()
+        if ahora < self._proxima_limpieza:
+            return
+        self._proxima_limpieza = ahora + 60
+        conn = self._conexion()
+        conn.execute("UPDATE trabajos SET estado = ?, error = 'El trabajo se interrumpió', actualizado = ? "
+                     "WHERE estado = ? AND actualizado < ?", (ERROR, ahora, EN_CURSO, ahora - self.timeout))
+        conn.execute("DELETE FROM trabajos WHERE estado IN (?, ?) AND actualizado < ?",
+                     (*ESTADOS_FINALES, ahora - self.retencion))
+
+
+# Cola compartida por toda la app
+cola = ColaTrabajos()
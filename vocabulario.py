@@ -0,0 +1,83 @@
+"""
+Índice de vocabulario por etiqueta.
+
+Tokeniza el corpus una sola vez y guarda una matriz de conteos etiqueta×token
+junto con la frecuencia de documento de cada token. A partir del índice se
+puede sacar el vocabulario top-N por etiqueta con distintos top_n, cortes de
+frecuencia de documento y stopwords sin volver a recorrer los textos.
+"""
+import numpy as np
+
+SPANISH_STOPWORDS = frozenset({'estáis', 'tuviese', 'ante', 'estada', 'estuvimos', 'esta', 'hubiera', 'tendrán', 'sintiendo', 'hayamos', 'su', 'con', 'estuviera', 'hubieron', 'hubieses', 'de', 'tengo', 'tenemos', 'mi', 'hubieran', 'desde', 'sentidos', 'habrán', 'hayas', 'estamos', 'estábamos', 'fuera', 'tengan', 'seréis', 'serán', 'estés', 'esté', 'me', 'otros', 'hasta', 'tuve', 'mías', 'vuestro', 'habríais', 'vuestras', 'habría', 'tened', 'un', 'fueses', 'esas', 'vuestra', 'lo', 'yo', 'o', 'nos', 'habréis', 'te', 'que', 'suyas', 'le', 'éramos', 'estaremos', 'tengáis', 'hubiesen', 'sentidas', 'serías', 'suya', 'nuestra', 'hubiste', 'soy', 'mío', 'sois', 'sin', 'ese', 'habrá', 'nuestras', 'más', 'fuese', 'estuvierais', 'tuvieses', 'habido', 'tuya', 'estuviste', 'han', 'habíamos', 'estarías', 'nada', 'tuviesen', 'estéis', 'tengamos', 'seríais', 'eres', 'he', 'pero', 'tenían', 'estemos', 'sea', 'por', 'hubiésemos', 'tuyas', 'estaría', 'habidos', 'fueseis', 'os', 'tuvieseis', 'eso', 'hubiese', 'fueron', 'porque', 'algunos', 'sentida', 'habiendo', 'tuvieran', 'eras', 'otro', 'habías', 'tenido', 'hemos', 'ellas', 'estuvieron', 'estaríamos', 'tú', 'donde', 'nosotros', 'habíais', 'durante', 'tus', 'tenidas', 'tendría', 'vuestros', 'tenéis', 'siente', 'unos', 'mis', 'entre', 'habéis', 'estuviéramos', 'y', 'son', 'eran', 'poco', 'fuisteis', 'estando', 'tuvo', 'tuvisteis', 'hubimos', 'teniendo', 'estuviésemos', 'estás', 'les', 'hayan', 'era', 'tenía', 'estarían', 'había', 'tuvieron', 'los', 'ya', 'hubo', 'míos', 'estoy', 'cuando', 'habrías', 'vosotras', 'seamos', 'tendríais', 'haya', 'habrían', 'sean', 'hayáis', 'estadas', 'ella', 'vosotros', 'este', 'algo', 'tienen', 'algunas', 'se', 'erais', 'tuvimos', 'quien', 'esa', 'tengas', 'sus', 'has', 'no', 'habidas', 'estaríais', 'estaban', 'antes', 'tenga', 'otra', 'estados', 'fuiste', 'tuvierais', 'para', 'fuesen', 'tendrías', 'sería', 'también', 'tanto', 'estuvieseis', 'estuvieras', 'tendrá', 'estuvieses', 'nosotras', 'tuvieras', 'suyos', 'teníais', 'será', 'hubieras', 'tuviésemos', 'tuyo', 'ti', 'mucho', 'estado', 'todo', 'fueran', 'habremos', 'habré', 'estuviese', 'hubisteis', 'fuimos', 'muchos', 'estaba', 'esto', 'a', 'estar', 'fuéramos', 'sobre', 'estaré', 'estad', 'estará', 'estabas', 'muy', 'teníamos', 'mí', 'hay', 'esos', 'somos', 'nuestros', 'tendríamos', 'él', 'están', 'estabais', 'fui', 'seáis', 'tenida', 'habrás', 'cual', 'fuerais', 'tuviera', 'estuvieran', 'uno', 'contra', 'habían', 'ellos', 'una', 'ha', 'ni', 'seré', 'tuyos', 'hubieseis', 'hubiéramos', 'seremos', 'tenidos', 'está', 'en', 'tendréis', 'e', 'estén', 'serían', 'estuvo', 'tuviéramos', 'hube', 'serás', 'las', 'estarán', 'del', 'sentid', 'suyo', 'mía', 'estos', 'estuviesen', 'tiene', 'fuésemos', 'la', 'fueras', 'tu', 'sí', 'al', 'quienes', 'tienes', 'tenías', 'sentido', 'todos', 'tuviste', 'como', 'seríamos', 'estas', 'es', 'habida', 'fue', 'tendremos', 'habríamos', 'nuestro', 'estaréis', 'otras', 'tendrían', 'tendré', 'qué', 'estuve', 'estarás', 'el', 'estuvisteis', 'hubierais', 'tendrás', 'seas'})
+
+
+class IndiceVocabulario:
+    """Conteos etiqueta×token de un corpus ya limpio, construidos en una sola pasada."""
+
+    def __init__(self, etiquetas, tokens, conteos, primera_aparicion, frecuencia_documentos, n_documentos):
+        self.etiquetas = etiquetas
+        self.tokens = tokens
+        # conteos[e, t]: apariciones del token t en los textos de la etiqueta e
+        self.conteos = conteos
+        # primera_aparicion[e, t]: posición de la primera aparición de t en los textos de e
+        # (desempata igual que Counter.most_common, por orden de inserción)
+        self.primera_aparicion = primera_aparicion
+        self.frecuencia_documentos = frecuencia_documentos
+        self.n_documentos = n_documentos
+
+    @classmethod
+    def desde_textos(cls, textos, etiquetas):
+        """Construye el índice a partir de textos limpios y sus etiquetas (mismo orden)."""
+        ids_etiqueta = {}
+        ids_token = {}
+        token_de = []
+        etiqueta_de = []
+        documento_de = []
+        for documento, (texto, etiqueta) in enumerate(zip(textos, etiquetas)):
+            id_etiqueta = ids_etiqueta.setdefault(etiqueta, len(ids_etiqueta))
+            for palabra in texto.split():
+                token_de.append(ids_token.setdefault(palabra, len(ids_token)))
+                etiqueta_de.append(id_etiqueta)
+                documento_de.append(documento)
+
+        n_etiquetas, n_tokens = len(ids_etiqueta), len(ids_token)
+        token_de = np.asarray(token_de, dtype=np.int64)
+        clave = np.asarray(etiqueta_de, dtype=np.int64) * n_tokens + token_de
+
+        conteos = np.bincount(clave, minlength=n_etiquetas * n_tokens).reshape(n_etiquetas, n_tokens)
+        # np.unique devuelve la posición de la primera aparición de cada par (etiqueta, token)
+        primera_aparicion = np.full(n_etiquetas * n_tokens, np.iinfo(np.int64).max, dtype=np.int64)
+        claves_unicas, primeras = np.unique(clave, return_index=True)
+        primera_aparicion[claves_unicas] = primeras
+        # Pares (documento, token) distintos para la frecuencia de documento
+        pares = np.unique(np.asarray(documento_de, dtype=np.int64) * n_tokens + token_de)
+        frecuencia_documentos = np.bincount(pares % n_tokens, minlength=n_tokens) if n_tokens else np.zeros(0, dtype=np.int64)
+
+        return cls(
+            etiquetas=list(ids_etiqueta),
+            tokens=np.asarray(list(ids_token), dtype=object),
+            conteos=conteos,
+            primera_aparicion=primera_aparicion.reshape(n_etiquetas, n_tokens),
+            frecuencia_documentos=frecuencia_documentos,
+            n_documentos=documento + 1 if ids_etiqueta else 0,
+        )
+
+    def _limite_documentos(self, valor):
+        # Igual que en scikit-learn: un float es una proporción y un int un número de documentos
+        return valor * self.n_documentos if isinstance(valor, float) else valor
+
+    def top_por_etiqueta(self, top_n, stopwords=(), min_df=1, max_df=1.0):
+        """
+        Devuelve la unión ordenada de los top_n tokens más frecuentes de cada etiqueta.
+
+        Los cortes min_df/max_df descartan tokens antes de elegir el top-N; las
+        stopwords se quitan después, como en el entrenamiento original.
+        """
+        candidatos = ((self.frecuencia_documentos >= self._limite_documentos(min_df))
+                      & (self.frecuencia_documentos <= self._limite_documentos(max_df)))
+        elegidos = np.zeros(len(self.tokens), dtype=bool)
+        for conteos, primera in zip(self.conteos, self.primera_aparicion):
+            indices = np.flatnonzero(candidatos & (conteos > 0))
+            orden = np.lexsort((primera[indices], -conteos[indices]))
+            elegidos[indices[orden[:top_n]]] = True
+        return sorted(t for t in self.tokens[elegidos] if t.lower() not in stopwords)